@@ -0,0 +1,193 @@
+import hashlib
+import http.client
+import logging
+import os
+import socket
+import tempfile
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+CHUNK_SIZE = 65536
+SPOOL_SIZE = 1024 * 1024   # larger files are spooled to disk while hashing
+
+
+def open_stream(url, timeout=30):
+    """Open GET request to url and return connection and response that can be read in chunks"""
+    url_obj = urllib.parse.urlparse(url)
+    if url_obj.scheme == "http":
+        connection = http.client.HTTPConnection(url_obj.hostname, url_obj.port, timeout=timeout, blocksize=CHUNK_SIZE)
+    else:
+        connection = http.client.HTTPSConnection(url_obj.hostname, url_obj.port, timeout=timeout, blocksize=CHUNK_SIZE)
+    path = url_obj.path
+    if url_obj.query:
+        path += "?" + url_obj.query
+    connection.request("GET", path, headers={"User-Agent": "endcord"})
+    return connection, connection.getresponse()
+
+
+def spool_stream(stream):
+    """Copy stream to spooled temporary file while hashing it, return file rewound to start and hex digest"""
+    spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE)
+    digest = hashlib.sha256()
+    while chunk := stream.read(CHUNK_SIZE):
+        digest.update(chunk)
+        spool.write(chunk)
+    spool.seek(0)
+    return spool, digest.hexdigest()
+
+
+class AttachmentUploader:
+    """Re-uploads attachments from source CDN to target, streaming them in chunks by a pool of workers"""
+
+    def __init__(self, max_size, workers=4, cache=None, media_channels=None):
+        self.max_size = max_size
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="uploader")
+        self.cache = cache
+        self.media_channels = media_channels or {}   # target name: channel for re-hosting files not sent as attachments
+        self.pending = set()
+
+
+    def upload(self, target_discord, channel_id, attachment):
+        """
+        Stream one attachment from its source url to target upload url.
+        If same file is already in cache, return its target url instead of uploading it again.
+        Return attachment dict ready for send_message, dict with target url, or None if it cant be uploaded.
+        """
+        size = attachment.get("size")
+        if size and size > self.max_size:
+            logger.debug(f"({target_discord.name}) Attachment {attachment["name"]} is too large: {size}")
+            return None
+        if self.cache:
+            url = self.cache.get_by_source(target_discord.name, attachment["url"])
+            if url:
+                return {"name": attachment["name"], "url": url}
+        try:
+            connection, response = open_stream(attachment["url"])
+        except (socket.gaierror, TimeoutError, ConnectionError, http.client.HTTPException) as e:
+            logger.warn(f"({target_discord.name}) Failed to download attachment {attachment["name"]}: {e}")
+            return None
+        spool = None
+        digest = None
+        try:
+            if response.status != 200:
+                logger.warn(f"({target_discord.name}) Failed to download attachment {attachment["name"]}. Response code: {response.status}")
+                return None
+            size = int(response.getheader("Content-Length", 0))
+            if not size or size > self.max_size:
+                logger.debug(f"({target_discord.name}) Attachment {attachment["name"]} has unknown size or is too large: {size}")
+                return None
+            stream = response
+            if self.cache:
+                spool, digest = spool_stream(response)
+                url = self.cache.get_by_hash(target_discord.name, digest)
+                if url:
+                    self.cache.add_source(target_discord.name, attachment["url"], digest)
+                    return {"name": attachment["name"], "url": url}
+                stream = spool
+            upload = target_discord.request_attachment_upload(channel_id, attachment["name"], size)
+            if not upload:
+                return None
+            if not target_discord.upload_attachment(upload["upload_url"], stream, size):
+                return None
+        except (TimeoutError, ConnectionError, http.client.HTTPException) as e:
+            logger.warn(f"({target_discord.name}) Failed to download attachment {attachment["name"]}: {e}")
+            return None
+        finally:
+            connection.close()
+            if spool:
+                spool.close()
+        return {
+            "name": attachment["name"],
+            "upload_url": upload["upload_url"],
+            "upload_filename": upload["upload_filename"],
+            "source": attachment["url"],
+            "hash": digest,
+            "size": size,
+        }
+
+
+    def upload_all(self, target_discord, channel_id, attachments):
+        """
+        Upload attachments concurrently, return list of uploaded attachments in original order.
+        Attachments that are uploaded are marked hidden, so they are not linked in message text,
+        and attachments that are found in cache are linked to their target url.
+        """
+        futures = [self.executor.submit(self.upload, target_discord, channel_id, attachment) for attachment in attachments]
+        uploaded = []
+        for attachment, future in zip(attachments, futures):
+            result = future.result()
+            if not result:
+                continue
+            if "upload_url" in result:
+                attachment["hidden"] = True
+                uploaded.append(result)
+            else:
+                attachment["url"] = result["url"]
+        return uploaded
+
+
+    def resolve_all(self, target_discord, attachments, uploads):
+        """
+        Mark attachments of edited message the same way upload_all did when it was sent, without uploading anything.
+        Attachments at `uploads` indexes were uploaded and are marked hidden, other ones that are found in cache
+        are linked to their target url, and the rest keep their source url.
+        If uploads were not recorded, attachments that are not cached and not too large are assumed uploaded.
+        """
+        uploaded = None if uploads is None else {int(num) for num in uploads.split(",") if num}
+        for num, attachment in enumerate(attachments):
+            if uploaded is not None and num in uploaded:
+                attachment["hidden"] = True
+                continue
+            size = attachment.get("size")
+            if uploaded is None and size and size > self.max_size:
+                continue
+            url = self.cache.get_by_source(target_discord.name, attachment["url"]) if self.cache else None
+            if url:
+                attachment["url"] = url
+            elif uploaded is None:
+                attachment["hidden"] = True
+
+
+    def store_uploaded(self, target_name, uploaded, message_attachments):
+        """Add uploaded attachments to cache, with target urls taken from sent message"""
+        if not self.cache:
+            return
+        for attachment, message_attachment in zip(uploaded, message_attachments):
+            if attachment["hash"]:
+                self.cache.add(target_name, attachment["source"], attachment["hash"], message_attachment["url"], attachment["size"])
+
+
+    def get_rehosted(self, target_discord, url):
+        """
+        Get target url of file re-hosted in target media channel, such as avatar.
+        If it is not re-hosted yet, start re-hosting it in background and return source url.
+        """
+        if not (self.cache and target_discord.name in self.media_channels):
+            return url
+        rehosted = self.cache.get_by_source(target_discord.name, url)
+        if rehosted:
+            return rehosted
+        if url not in self.pending:
+            self.pending.add(url)
+            self.executor.submit(self.rehost, target_discord, url)
+        return url
+
+
+    def rehost(self, target_discord, url):
+        """Upload file to target media channel and add it to cache"""
+        try:
+            channel_id = self.media_channels[target_discord.name]
+            attachment = {
+                "name": os.path.basename(urllib.parse.urlparse(url).path) or "file",
+                "url": url,
+            }
+            result = self.upload(target_discord, channel_id, attachment)
+            if result and "upload_url" in result:
+                message = target_discord.send_message(channel_id, "", attachments=[result], return_message=True)
+                if message:
+                    self.store_uploaded(target_discord.name, [result], message["attachments"])
+        except Exception as e:
+            logger.warn(f"({target_discord.name}) Failed to re-host {url}: {e}")
+        finally:
+            self.pending.discard(url)
@@ -4,6 +4,8 @@ import time
 
 import apsw
 
+from bridge import metrics
+
 logger = logging.getLogger(__name__)
 DISCORD_EPOCH = 1420070400000
 
@@ -28,7 +30,7 @@ class PairStore:
 
         self.run  = True
         if pair_lifetime_days and cleanup_days:
-            self.cleanup_thread = threading.Thread(target=self.cleanup_loop, daemon=True)
+            self.cleanup_thread = threading.Thread(target=self.cleanup_loop, daemon=True, name=f"cleanup-{self.name}")
             self.cleanup_thread.start()
 
 
@@ -43,6 +45,14 @@ class PairStore:
                 name TEXT PRIMARY KEY
             )
         """)
+        # webhooks used to send messages in channels
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS webhooks (
+                channel_id TEXT PRIMARY KEY,
+                webhook_id TEXT NOT NULL,
+                token TEXT NOT NULL
+            )
+        """)
         logger.info(f"{self.name} Database initializes successfully")
 
 
@@ -52,43 +62,152 @@ class PairStore:
             self.conn.execute(f"""
                 CREATE TABLE IF NOT EXISTS {channel_pair} (
                     source TEXT PRIMARY KEY,
-                    target TEXT NOT NULL
+                    target TEXT NOT NULL,
+                    hash TEXT,
+                    bot TEXT,
+                    uploads TEXT
                 )
             """)
+            # tables created before rendered content hashes, sending bots and uploads were stored
+            columns = [row[1] for row in self.conn.execute(f"PRAGMA table_info({channel_pair})")]
+            for column in ("hash", "bot", "uploads"):
+                if column not in columns:
+                    self.conn.execute(f"ALTER TABLE {channel_pair} ADD COLUMN {column} TEXT")
             self.conn.execute("INSERT OR IGNORE INTO channels (name) VALUES (?)", (channel_pair,))
         return channel_pair
 
 
-    def add_pair(self, channel_pair, source, target):
-        """Add a pair of source and target message snowflakes"""
+    @metrics.timed_query
+    def add_pairs(self, channel_pair, pairs):
+        """
+        Add multiple pairs of source and target message snowflakes in one transaction.
+        Pairs are (source, target, hash, bot, uploads), where bot is id of bot or webhook that sent target message,
+        and uploads are indexes of re-uploaded attachments.
+        """
+        with self.conn:
+            self.conn.executemany(f"INSERT OR REPLACE INTO {channel_pair} (source, target, hash, bot, uploads) VALUES (?, ?, ?, ?, ?)", pairs)
+
+
+    @metrics.timed_query
+    def add_pair_targets(self, source, pairs):
+        """
+        Add pairs of one source message and its targets in multiple channel pairs in one transaction.
+        Pairs are (channel_pair, target, hash, bot, uploads), where bot is id of bot or webhook that sent target message,
+        and uploads are indexes of re-uploaded attachments.
+        """
         with self.conn:
-            self.conn.execute(f"INSERT OR REPLACE INTO {channel_pair} (source, target) VALUES (?, ?)", (source, target))
+            for channel_pair, target, content_hash, bot, uploads in pairs:
+                self.conn.execute(f"INSERT OR REPLACE INTO {channel_pair} (source, target, hash, bot, uploads) VALUES (?, ?, ?, ?, ?)", (source, target, content_hash, bot, uploads))
 
 
+    @metrics.timed_query
     def get_target(self, channel_pair, source):
         """Get target id from source in a pair, if not found return none"""
         row = self.conn.execute(f"SELECT target FROM {channel_pair} WHERE source = ? LIMIT 1", (source,)).fetchone()
+        metrics.count_lookup(self.name, row)
         if row:
             return row[0]
         return None
 
 
+    @metrics.timed_query
+    def get_target_info(self, channel_pair, source):
+        """
+        Get target id, hash of rendered target content, id of bot or webhook that sent it and indexes of re-uploaded attachments,
+        from source in a pair, if not found return none.
+        """
+        row = self.conn.execute(f"SELECT target, hash, bot, uploads FROM {channel_pair} WHERE source = ? LIMIT 1", (source,)).fetchone()
+        metrics.count_lookup(self.name, row)
+        if row:
+            return row[0], row[1], row[2], row[3]
+        return None
+
+
+    @metrics.timed_query
+    def set_hash(self, channel_pair, source, content_hash):
+        """Update hash of rendered target content for a pair"""
+        with self.conn:
+            self.conn.execute(f"UPDATE {channel_pair} SET hash = ? WHERE source = ?", (content_hash, source))
+
+
+    @metrics.timed_query
+    def get_targets(self, channel_pair, sources):
+        """Get target ids and ids of bots that sent them for multiple sources in a pair, return dict source: (target, bot) for found pairs"""
+        targets = {}
+        for num in range(0, len(sources), 500):
+            chunk = sources[num:num+500]
+            placeholders = ",".join("?" * len(chunk))
+            for source, target, bot in self.conn.execute(f"SELECT source, target, bot FROM {channel_pair} WHERE source IN ({placeholders})", chunk):
+                targets[source] = (target, bot)
+        return targets
+
+
+    def get_last_source(self, channel_pair):
+        """Get newest source id in a pair, if pair is empty return none"""
+        row = self.conn.execute(f"SELECT source FROM {channel_pair} ORDER BY CAST(source AS INTEGER) DESC LIMIT 1").fetchone()
+        if row:
+            return row[0]
+        return None
+
+
+    def get_first_source(self, channel_pair):
+        """Get oldest source id in a pair, if pair is empty return none"""
+        row = self.conn.execute(f"SELECT source FROM {channel_pair} ORDER BY CAST(source AS INTEGER) ASC LIMIT 1").fetchone()
+        if row:
+            return row[0]
+        return None
+
+
+    @metrics.timed_query
     def get_source(self, channel_pair, target):
         """Get source id from target in a pair, if not found return none"""
         row = self.conn.execute(f"SELECT source FROM {channel_pair} WHERE target = ? LIMIT 1", (target,)).fetchone()
+        metrics.count_lookup(self.name, row)
         if row:
             return row[0]
         return None
 
 
+    @metrics.timed_query
     def delete_pair(self, channel_pair, source):
         """Delete a pair by source"""
         with self.conn:
             self.conn.execute(f"DELETE FROM {channel_pair} WHERE source = ?", (source,))
 
 
+    @metrics.timed_query
+    def delete_pairs(self, channel_pair, sources):
+        """Delete multiple pairs by source"""
+        with self.conn:
+            for num in range(0, len(sources), 500):
+                chunk = sources[num:num+500]
+                placeholders = ",".join("?" * len(chunk))
+                self.conn.execute(f"DELETE FROM {channel_pair} WHERE source IN ({placeholders})", chunk)
+
+
+    def get_webhook(self, channel_id):
+        """Get webhook id and token for channel, if not found return none"""
+        row = self.conn.execute("SELECT webhook_id, token FROM webhooks WHERE channel_id = ?", (channel_id,)).fetchone()
+        if row:
+            return row[0], row[1]
+        return None
+
+
+    def add_webhook(self, channel_id, webhook_id, token):
+        """Add webhook id and token for channel"""
+        with self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO webhooks (channel_id, webhook_id, token) VALUES (?, ?, ?)", (channel_id, webhook_id, token))
+
+
+    def delete_webhook(self, channel_id):
+        """Delete webhook for channel"""
+        with self.conn:
+            self.conn.execute("DELETE FROM webhooks WHERE channel_id = ?", (channel_id,))
+
+
     def cleanup_old_pairs(self):
         """Delete pairs older than the configured lifetime"""
+        start = time.perf_counter()
         cutoff = (time.time() - self.pair_lifetime_days * 86400) * 1000
         old_pairs = []
         deleted = 0
@@ -105,6 +224,7 @@ class PairStore:
                 deleted += len(old_pairs)
         if not deleted:
             logger.debug(f"({self.name}) Cleanup: No old pairs found")
+        metrics.set_gauge("bridge_db_cleanup_seconds", time.perf_counter() - start, database=self.name)
 
 
     def cleanup_loop(self):
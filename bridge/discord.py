@@ -1,18 +1,48 @@
 import http.client
 import json
 import logging
+import math
+import queue
+import re
 import socket
+import threading
 import time
 import urllib
 
-from bridge.message import prepare_messages
+from bridge import metrics
+from bridge.message import prepare_message, prepare_messages
 
 logger = logging.getLogger(__name__)
+DISCORD_EPOCH = 1420070400000
+MAX_RETRIES = 5
+UPLOAD_CHUNK_SIZE = 65536
+match_route_id = re.compile(r"/(messages|reactions)/(?!bulk-delete\b)[^/?]+")
+match_webhook_token = re.compile(r"(/webhooks/[^/?]+)/[^/?]+")
+
+
+def timestamp_to_snowflake(timestamp):
+    """Convert unix time in ms to discord snowflake"""
+    return (int(timestamp) - DISCORD_EPOCH) << 22
+
+
+def snowflake_to_timestamp(snowflake):
+    """Convert discord snowflake to unix time in ms"""
+    return (int(snowflake) >> 22) + DISCORD_EPOCH
 
 
 def generate_nonce():
     """Generate nonce string - current UTC time as discord snowflake"""
-    return str((int(time.time() * 1000) - 1420070400 * 1000) << 22)
+    return str(timestamp_to_snowflake(time.time() * 1000))
+
+
+def get_route(method, url):
+    """
+    Get rate limit route key from request, keeping top-level resource IDs and hiding webhook tokens:
+    `/api/v9/channels/123/messages/456?limit=5` --> `/api/v9/channels/123/messages/id`
+    `/api/v9/webhooks/123/abc/messages/456` --> `/api/v9/webhooks/123/token/messages/id`
+    """
+    url = match_webhook_token.sub(r"\1/token", url.split("?")[0])
+    return method + " " + match_route_id.sub(r"/\1/id", url)
 
 
 class Discord():
@@ -21,9 +51,11 @@ class Discord():
     def __init__(self, token, host, cdn, name):
         host_obj = urllib.parse.urlparse(host)
         if host_obj.netloc:
-            self.host = host_obj.netloc
+            self.host = host_obj.hostname
         else:
             self.host = host_obj.path
+        self.secure = host_obj.scheme != "http"
+        self.port = host_obj.port or (443 if self.secure else 80)
         self.name = name
         logger.debug(f"({self.name}) Endpoints: API={self.host}, CDN={cdn}")
         self.token = token
@@ -31,11 +63,103 @@ class Discord():
             "Authorization": f"Bot {self.token}",
             "Content-Type": "application/json",
         }
+        self.rate_limits = {}   # route: time when its rate limit resets
+        self.buckets = {}   # route: [remaining requests, time when they reset]
+        self.global_rate_limit = 0
+        self.my_id = None
 
 
-    def get_connection(self, host, port):
+    def get_connection(self, host, port, timeout=5):
         """Get connection object"""
-        return http.client.HTTPSConnection(host, port, timeout=5)
+        if self.secure:
+            return http.client.HTTPSConnection(host, port, timeout=timeout)
+        return http.client.HTTPConnection(host, port, timeout=timeout)
+
+
+    def send_request(self, method, url, body=None):
+        """
+        Send request to API, waiting for rate limited route to reset and retrying on 429.
+        Return response status code and data, or None, None on connection error.
+        """
+        route = get_route(method, url)
+        for _ in range(MAX_RETRIES):
+            wait = max(self.rate_limits.get(route, 0), self.global_rate_limit) - time.time()
+            if wait > 0:
+                time.sleep(wait)
+            start = time.perf_counter()
+            try:
+                connection = self.get_connection(self.host, self.port)
+                connection.request(method, url, body, self.header)
+                response = connection.getresponse()
+                data = response.read()
+            except (socket.gaierror, TimeoutError, ConnectionError, http.client.HTTPException):
+                connection.close()
+                metrics.inc("bridge_http_responses_total", client=self.name, status="error")
+                return None, None
+            connection.close()
+            metrics.observe("bridge_http_request_seconds", time.perf_counter() - start, client=self.name, route=route)
+            metrics.inc("bridge_http_responses_total", client=self.name, status=response.status)
+            remaining = response.getheader("X-RateLimit-Remaining")
+            if remaining is not None:
+                reset = time.time() + float(response.getheader("X-RateLimit-Reset-After", 0))
+                self.buckets[route] = [int(remaining), reset]
+                if remaining == "0":
+                    self.rate_limits[route] = reset
+            if response.status != 429:
+                return response.status, data
+            try:
+                rate_limit = json.loads(data)
+                retry_after = float(rate_limit["retry_after"])
+                is_global = rate_limit.get("global")
+            except (ValueError, KeyError, TypeError):
+                retry_after = float(response.getheader("Retry-After", 1))
+                is_global = False
+            metrics.inc("bridge_http_rate_limited_total", client=self.name, route=route)
+            logger.warn(f"({self.name}) Rate limited on {route}, retrying after {retry_after}s")
+            if is_global:
+                self.global_rate_limit = time.time() + retry_after
+            else:
+                self.rate_limits[route] = time.time() + retry_after
+        return 429, data
+
+
+    def get_headroom(self, method, url):
+        """
+        Get number of requests that can be sent on route before it is rate limited, infinite if it is not known.
+        If route is rate limited, return negative time until it resets.
+        """
+        route = get_route(method, url)
+        now = time.time()
+        wait = max(self.rate_limits.get(route, 0), self.global_rate_limit) - now
+        if wait > 0:
+            return -wait
+        bucket = self.buckets.get(route)
+        if bucket and bucket[1] > now:
+            return bucket[0]
+        return math.inf
+
+
+    def get_my_id(self):
+        """Get my user ID"""
+        status, data = self.send_request("GET", "/api/v9/users/@me")
+        if status == 200:
+            self.my_id = json.loads(data)["id"]
+            return self.my_id
+        if status:
+            logger.error(f"({self.name}) Failed to get my user. Response code: {status}")
+        return None
+
+
+    def get_gateway_bot(self):
+        """Get recommended number of gateway shards and max concurrency of identify requests"""
+        status, data = self.send_request("GET", "/api/v9/gateway/bot")
+        if status == 200:
+            data = json.loads(data)
+            max_concurrency = data.get("session_start_limit", {}).get("max_concurrency", 1)
+            return data["shards"], max_concurrency
+        if status:
+            logger.error(f"({self.name}) Failed to get gateway shards. Response code: {status}")
+        return None
 
 
     def get_messages(self, channel_id, num=50, before=None, after=None, around=None):
@@ -48,27 +172,81 @@ class Discord():
             url += f"&after={after}"
         if around:
             url += f"&around={around}"
-        try:
-            connection = self.get_connection(self.host, 443)
-            connection.request("GET", url, message_data, self.header)
-            response = connection.getresponse()
-        except (socket.gaierror, TimeoutError):
-            connection.close()
-            return None
-        if response.status == 200:
-            data = json.loads(response.read())
-            connection.close()
+        status, data = self.send_request("GET", url, message_data)
+        if status == 200:
+            data = json.loads(data)
             # debug_chat
             # with open("messages.json", "w") as f:
             #     json.dump(data, f, indent=2)
             return prepare_messages(data)
-        logger.error(f"({self.name}) Failed to fetch messages. Response code: {response.status}")
-        connection.close()
+        if status:
+            logger.error(f"({self.name}) Failed to fetch messages. Response code: {status}")
+        return None
+
+
+    def get_message(self, channel_id, message_id):
+        """Get one message by its ID"""
+        message_data = None
+        url = f"/api/v9/channels/{channel_id}/messages/{message_id}"
+        status, data = self.send_request("GET", url, message_data)
+        if status == 200:
+            return prepare_message(json.loads(data))
+        if status:
+            logger.error(f"({self.name}) Failed to fetch message {message_id}. Response code: {status}")
         return None
 
 
-    def send_message(self, channel_id, message_content, reply_id=None, reply_channel_id=None, reply_guild_id=None, reply_ping=True, attachments=None, embeds=None, stickers=None):
-        """Send a message in the channel with reply with or without ping"""
+    def iter_messages(self, channel_id, num=100, before=None, after=None):
+        """
+        Iterate over pages of messages going forward from `after` or backward from `before` message ID.
+        Pages are yielded sorted in iteration direction, while next page is fetched in a thread.
+        Raises ConnectionError if some page could not be fetched.
+        """
+        pages = queue.Queue(maxsize=1)
+        stop = threading.Event()
+        threading.Thread(target=self.fetch_pages, daemon=True, args=(pages, stop, channel_id, num, before, after)).start()
+        try:
+            while True:
+                messages = pages.get()
+                if messages is None:
+                    raise ConnectionError(f"Failed to fetch messages in channel {channel_id}")
+                if messages:
+                    yield messages
+                if not messages or len(messages) < num:
+                    break
+        finally:
+            stop.set()
+
+
+    def fetch_pages(self, pages, stop, channel_id, num, before, after):
+        """
+        Fetch pages of messages into queue until channel end is reached, should be run in a thread.
+        None is put into queue when page could not be fetched.
+        """
+        while not stop.is_set():
+            messages = self.get_messages(channel_id, num=num, before=before, after=after)
+            if messages:
+                if after:
+                    messages.sort(key=lambda x: int(x.id))
+                    after = messages[-1].id
+                else:
+                    messages.sort(key=lambda x: int(x.id), reverse=True)
+                    before = messages[-1].id
+            while not stop.is_set():
+                try:
+                    pages.put(messages, timeout=1)
+                    break
+                except queue.Full:
+                    pass
+            if not messages or len(messages) < num:
+                break
+
+
+    def send_message(self, channel_id, message_content, reply_id=None, reply_channel_id=None, reply_guild_id=None, reply_ping=True, attachments=None, embeds=None, stickers=None, return_message=False):
+        """
+        Send a message in the channel with reply with or without ping.
+        Return sent message id, or whole sent message if return_message is True.
+        """
         message_dict = {
             "content": message_content,
             "tts": "false",
@@ -113,20 +291,61 @@ class Discord():
             message_dict["sticker_ids"] = stickers
         message_data = json.dumps(message_dict)
         url = f"/api/v9/channels/{channel_id}/messages"
+        status, data = self.send_request("POST", url, message_data)
+        if status == 200:
+            if return_message:
+                return json.loads(data)
+            return json.loads(data)["id"]
+        if status:
+            logger.error(f"({self.name}) Failed to send message. Response code: {status}")
+        return None
+
+
+    def request_attachment_upload(self, channel_id, filename, size):
+        """Request url for uploading attachment to the channel, return dict with upload_url and upload_filename"""
+        message_data = json.dumps({
+            "files": [{
+                "file_size": size,
+                "filename": filename,
+                "id": "0",
+                "is_clip": False,
+            }],
+        })
+        url = f"/api/v9/channels/{channel_id}/attachments"
+        status, data = self.send_request("POST", url, message_data)
+        if status == 200:
+            return json.loads(data)["attachments"][0]
+        if status:
+            logger.error(f"({self.name}) Failed to request attachment upload. Response code: {status}")
+        return None
+
+
+    def upload_attachment(self, upload_url, stream, size):
+        """Upload attachment to upload_url, reading it from stream in chunks"""
+        url_obj = urllib.parse.urlparse(upload_url)
+        if url_obj.scheme == "http":
+            connection = http.client.HTTPConnection(url_obj.hostname, url_obj.port, timeout=30, blocksize=UPLOAD_CHUNK_SIZE)
+        else:
+            connection = http.client.HTTPSConnection(url_obj.hostname, url_obj.port, timeout=30, blocksize=UPLOAD_CHUNK_SIZE)
+        path = url_obj.path
+        if url_obj.query:
+            path += "?" + url_obj.query
+        header = {
+            "Content-Type": "application/octet-stream",
+            "Content-Length": str(size),
+        }
         try:
-            connection = self.get_connection(self.host, 443)
-            connection.request("POST", url, message_data, self.header)
+            connection.request("PUT", path, stream, header)
             response = connection.getresponse()
-        except (socket.gaierror, TimeoutError):
-            connection.close()
-            return None
-        if response.status == 200:
-            message_id = json.loads(response.read())["id"]
+            response.read()
+        except (socket.gaierror, TimeoutError, ConnectionError, http.client.HTTPException):
             connection.close()
-            return message_id
-        logger.error(f"({self.name}) Failed to send message. Response code: {response.status}")
+            return False
         connection.close()
-        return None
+        if response.status in (200, 201, 204):
+            return True
+        logger.error(f"({self.name}) Failed to upload attachment. Response code: {response.status}")
+        return False
 
 
     def send_update_message(self, channel_id, message_id, message_content, embeds):
@@ -138,18 +357,11 @@ class Discord():
             message_dict["embeds"] = embeds
         message_data = json.dumps(message_dict)
         url = f"/api/v9/channels/{channel_id}/messages/{message_id}"
-        try:
-            connection = self.get_connection(self.host, 443)
-            connection.request("PATCH", url, message_data, self.header)
-            response = connection.getresponse()
-        except (socket.gaierror, TimeoutError):
-            connection.close()
-            return False
-        if response.status == 200:
-            connection.close()
+        status, _ = self.send_request("PATCH", url, message_data)
+        if status == 200:
             return True
-        logger.error(f"({self.name}) Failed to edit the message. Response code: {response.status}")
-        connection.close()
+        if status:
+            logger.error(f"({self.name}) Failed to edit the message. Response code: {status}")
         return False
 
 
@@ -157,18 +369,118 @@ class Discord():
         """Delete the message from the channel"""
         message_data = None
         url = f"/api/v9/channels/{channel_id}/messages/{message_id}"
-        try:
-            connection = self.get_connection(self.host, 443)
-            connection.request("DELETE", url, message_data, self.header)
-            response = connection.getresponse()
-        except (socket.gaierror, TimeoutError):
-            connection.close()
+        status, _ = self.send_request("DELETE", url, message_data)
+        if status is None:
             return None
-        if response.status != 204:
-            logger.error(f"({self.name}) Failed to delete the message. Response code: {response.status}")
-            connection.close()
+        if status != 204:
+            logger.error(f"({self.name}) Failed to delete the message. Response code: {status}")
+            return False
+        return True
+
+
+    def send_bulk_delete(self, channel_id, message_ids):
+        """Delete 2-100 messages, not older than 2 weeks, from the channel in one request"""
+        message_data = json.dumps({"messages": message_ids})
+        url = f"/api/v9/channels/{channel_id}/messages/bulk-delete"
+        status, _ = self.send_request("POST", url, message_data)
+        if status is None:
+            return None
+        if status != 204:
+            logger.error(f"({self.name}) Failed to bulk delete {len(message_ids)} messages. Response code: {status}")
+            return False
+        return True
+
+
+    def get_webhook(self, channel_id, name):
+        """Get webhook with specified name from the channel, create it if it doesnt exist, return webhook id and token"""
+        url = f"/api/v9/channels/{channel_id}/webhooks"
+        status, data = self.send_request("GET", url)
+        if status == 200:
+            for webhook in json.loads(data):
+                if webhook.get("name") == name and webhook.get("token"):
+                    return webhook["id"], webhook["token"]
+        elif status:
+            logger.error(f"({self.name}) Failed to fetch webhooks. Response code: {status}")
+            return None
+        else:
+            return None
+        message_data = json.dumps({"name": name})
+        status, data = self.send_request("POST", url, message_data)
+        if status == 200:
+            webhook = json.loads(data)
+            logger.info(f"({self.name}) Created webhook in channel {channel_id}")
+            return webhook["id"], webhook["token"]
+        if status:
+            logger.error(f"({self.name}) Failed to create webhook. Response code: {status}")
+        return None
+
+
+    def execute_webhook(self, webhook_id, webhook_token, message_content, username=None, avatar_url=None, attachments=None, embeds=None, return_message=False):
+        """
+        Send a message through webhook with custom username and avatar.
+        Return sent message id, or whole sent message if return_message is True.
+        Return False if webhook doesnt exist anymore.
+        """
+        message_dict = {
+            "content": message_content,
+            "allowed_mentions": {
+                "parse": [],
+            },
+        }
+        if username:
+            message_dict["username"] = username
+        if avatar_url:
+            message_dict["avatar_url"] = avatar_url
+        if attachments:
+            message_dict["attachments"] = []
+            for attachment in attachments:
+                message_dict["attachments"].append({
+                    "id": len(message_dict["attachments"]),
+                    "filename": attachment["name"],
+                    "uploaded_filename": attachment["upload_filename"],
+                })
+        if embeds:
+            message_dict["embeds"] = embeds
+        message_data = json.dumps(message_dict)
+        url = f"/api/v9/webhooks/{webhook_id}/{webhook_token}?wait=true"
+        status, data = self.send_request("POST", url, message_data)
+        if status == 200:
+            if return_message:
+                return json.loads(data)
+            return json.loads(data)["id"]
+        if status == 404:   # Unknown Webhook
+            return False
+        if status:
+            logger.error(f"({self.name}) Failed to execute webhook. Response code: {status}")
+        return None
+
+
+    def edit_webhook_message(self, webhook_id, webhook_token, message_id, message_content, embeds=None):
+        """Update the message sent by webhook"""
+        message_dict = {
+            "content": message_content,
+        }
+        if embeds:
+            message_dict["embeds"] = embeds
+        message_data = json.dumps(message_dict)
+        url = f"/api/v9/webhooks/{webhook_id}/{webhook_token}/messages/{message_id}"
+        status, _ = self.send_request("PATCH", url, message_data)
+        if status == 200:
+            return True
+        if status:
+            logger.debug(f"({self.name}) Failed to edit the webhook message. Response code: {status}")
+        return False
+
+
+    def delete_webhook_message(self, webhook_id, webhook_token, message_id):
+        """Delete the message sent by webhook"""
+        url = f"/api/v9/webhooks/{webhook_id}/{webhook_token}/messages/{message_id}"
+        status, _ = self.send_request("DELETE", url)
+        if status is None:
+            return None
+        if status != 204:
+            logger.debug(f"({self.name}) Failed to delete the webhook message. Response code: {status}")
             return False
-        connection.close()
         return True
 
 
@@ -177,18 +489,12 @@ class Discord():
         encoded_reaction = urllib.parse.quote(reaction)
         message_data = None
         url = f"/api/v9/channels/{channel_id}/messages/{message_id}/reactions/{encoded_reaction}/%40me?location=Message%20Reaction%20Picker&type=0"
-        try:
-            connection = self.get_connection(self.host, 443)
-            connection.request("PUT", url, message_data, self.header)
-            response = connection.getresponse()
-        except (socket.gaierror, TimeoutError):
-            connection.close()
+        status, _ = self.send_request("PUT", url, message_data)
+        if status is None:
             return None
-        if response.status != 204:
-            logger.error(f"({self.name}) Failed to send reaction: {reaction}. Response code: {response.status}")
-            connection.close()
+        if status != 204:
+            logger.error(f"({self.name}) Failed to send reaction: {reaction}. Response code: {status}")
             return False
-        connection.close()
         return True
 
 
@@ -197,16 +503,10 @@ class Discord():
         encoded_reaction = urllib.parse.quote(reaction)
         message_data = None
         url = f"/api/v9/channels/{channel_id}/messages/{message_id}/reactions/{encoded_reaction}/0/%40me?location=Message%20Inline%20Button&burst=false"
-        try:
-            connection = self.get_connection(self.host, 443)
-            connection.request("DELETE", url, message_data, self.header)
-            response = connection.getresponse()
-        except (socket.gaierror, TimeoutError):
-            connection.close()
+        status, _ = self.send_request("DELETE", url, message_data)
+        if status is None:
             return None
-        if response.status != 204:
-            logger.error(f"({self.name}) Failed to delete reaction: {reaction}. Response code: {response.status}")
-            connection.close()
+        if status != 204:
+            logger.error(f"({self.name}) Failed to delete reaction: {reaction}. Response code: {status}")
             return False
-        connection.close()
         return True
@@ -0,0 +1,101 @@
+class Slotted:
+    """Base of compact event data, with fields stored in slots instead of dict"""
+    __slots__ = ()
+
+    def get_fields(self):
+        """Get dict of fields that are set"""
+        fields = {}
+        for name in self.__slots__:
+            try:
+                fields[name] = object.__getattribute__(self, name)
+            except AttributeError:
+                pass
+        return fields
+
+
+    def copy(self, **changes):
+        """Get shallow copy, with specified fields changed, fields that are not computed yet are left for copy to compute"""
+        new = object.__new__(type(self))
+        for name, value in {**self.get_fields(), **changes}.items():
+            setattr(new, name, value)
+        return new
+
+
+    def __repr__(self):
+        """Get readable representation with fields that are set"""
+        fields = ", ".join(f"{name}={value!r}" for name, value in self.get_fields().items() if name != "raw")
+        return f"{type(self).__name__}({fields})"
+
+
+class Lazy(Slotted):
+    """
+    View over raw event data, whose fields are computed on first access and then stored in their slots.
+    Field is computed by its `compute_<field>` method, which sets it and can also set other fields computed together with it.
+    Computing must not change raw data, because copies share it.
+    """
+    __slots__ = ()
+    computes = {}   # field: compute method
+
+    def __init_subclass__(cls):
+        """Map fields to their compute methods once, so first access doesnt search them"""
+        super().__init_subclass__()
+        cls.computes = {name: getattr(cls, f"compute_{name}") for name in cls.__slots__ if hasattr(cls, f"compute_{name}")}
+
+
+    def __getattr__(self, name):
+        """Compute field that is not set, called only when normal attribute lookup fails"""
+        compute = self.computes.get(name)
+        if not compute:
+            raise AttributeError(f"{type(self).__name__!r} object has no attribute {name!r}")
+        compute(self)
+        return object.__getattribute__(self, name)
+
+
+class MessageDelete(Slotted):
+    """Deleted message"""
+    __slots__ = ("id", "channel_id", "guild_id")
+    user_id = None   # author is not known
+
+    def __init__(self, id, channel_id, guild_id):   # noqa: A002
+        self.id = id
+        self.channel_id = channel_id
+        self.guild_id = guild_id
+
+
+class MessageDeleteBulk(Slotted):
+    """Multiple messages deleted at once"""
+    __slots__ = ("ids", "channel_id", "guild_id")
+    user_id = None
+
+    def __init__(self, ids, channel_id, guild_id):
+        self.ids = ids
+        self.channel_id = channel_id
+        self.guild_id = guild_id
+
+
+class Reaction(Slotted):
+    """Reaction added to or removed from message by one user, user names are known only for some added reactions"""
+    __slots__ = ("id", "channel_id", "guild_id", "emoji", "emoji_id", "user_id", "username", "global_name", "nick")
+
+    def __init__(self, id, channel_id, guild_id, emoji, emoji_id, user_id, username=None, global_name=None, nick=None):   # noqa: A002
+        self.id = id
+        self.channel_id = channel_id
+        self.guild_id = guild_id
+        self.emoji = emoji
+        self.emoji_id = emoji_id
+        self.user_id = user_id
+        self.username = username
+        self.global_name = global_name
+        self.nick = nick
+
+
+class Event:
+    """Queued gateway event, with its prepared data"""
+    __slots__ = ("op", "data", "trace", "replayed", "sequence")
+
+    def __init__(self, op, data, trace=None, replayed=False, sequence=None):
+        self.op = op
+        self.data = data
+        self.trace = trace
+        self.replayed = replayed   # might be already processed before restart
+        self.sequence = sequence   # gateway sequence number of event that carried it
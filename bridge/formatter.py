@@ -141,26 +141,27 @@ def build_message(message, config, roles, channels):
     reactions_separator = config["reactions_separator"]
     content = ""
 
-    if message["interaction"]:
+    if message.interaction:
         content = (
             format_interaction
-            .replace("%username", message["interaction"]["username"])
-            .replace("%command", message["interaction"]["command"])
+            .replace("%username", message.interaction["username"])
+            .replace("%command", message.interaction["command"])
         )
 
-    if "poll" in message:
-        message["content"] = format_poll(message["poll"])
+    message_content = message.content
+    if message.poll:
+        message_content = format_poll(message.poll)
 
-    if message["content"]:
+    if message_content:
         if content:
             content += "\n"
-        content = replace_discord_emoji(message["content"])
-        content = replace_mentions(content, message["mentions"])
+        content = replace_discord_emoji(message_content)
+        content = replace_mentions(content, message.mentions)
         content = replace_roles(content, roles)
         content = replace_discord_url(content)
         content = replace_channels(content, channels)
 
-    for embed in message["embeds"]:
+    for embed in message.embeds:
         embed_url = embed["url"]
         if embed_url and not embed.get("hidden") and embed_url not in content:
             if content:
@@ -172,7 +173,7 @@ def build_message(message, config, roles, channels):
             else:
                 content += f"[({clean_type(embed["type"])} embed)]({embed_url})"
 
-    for sticker in message["stickers"]:
+    for sticker in message.stickers:
         sticker_type = sticker["format_type"]
         if content:
             content += "\n"
@@ -186,9 +187,9 @@ def build_message(message, config, roles, channels):
             content += f"[(gif sticker)]({sticker["name"]})"
 
     # reactions
-    if message["reactions"]:
+    if message.reactions:
         reactions = []
-        for reaction in message["reactions"]:
+        for reaction in message.reactions:
             emoji_str = reaction["emoji"]
             my_reaction = ""
             if reaction["me"]:
@@ -203,3 +204,16 @@ def build_message(message, config, roles, channels):
         content += reactions_separator.join(reactions)
 
     return content
+
+
+def build_reply_quote(reference, max_length=100):
+    """Build one line quote of replied message, used where replies cant be sent"""
+    if not reference.id:
+        return "> *Reply to deleted message*"
+    name = reference.nick or reference.global_name or reference.username
+    content = replace_discord_emoji(reference.content or "").replace("\n", " ")
+    if len(content) > max_length:
+        content = content[:max_length] + "..."
+    elif not content and reference.embeds:
+        content = "*attachment*"
+    return f"> **{name}**: {content}"
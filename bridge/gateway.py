@@ -1,6 +1,8 @@
+import atexit
 import http.client
 import json
 import logging
+import os
 import random
 import socket
 import struct
@@ -11,19 +13,25 @@ import traceback
 import urllib
 import urllib.parse
 import zlib
+from collections import deque
 
 import websocket
 
+from bridge import logs, metrics, recorder, timing
+from bridge.events import Event, MessageDelete, MessageDeleteBulk, Reaction
 from bridge.message import prepare_message
 
 DISCORD_HOST = "discord.com"
 ZLIB_SUFFIX = b"\x00\x00\xff\xff"
-inflator = zlib.decompressobj()
+IDENTIFY_INTERVAL = 5   # seconds between identify requests in one concurrency bucket
+TRACED_EVENTS = ("MESSAGE_CREATE", "MESSAGE_UPDATE", "MESSAGE_DELETE", "MESSAGE_DELETE_BULK")
+RECORD_DIR = os.getenv("GATEWAY_RECORD_DIR")   # record received dispatch frames, for replaying them with tools.replay
 logger = logging.getLogger(__name__)
+event_logger = logging.getLogger(logs.EVENTS_LOGGER)
 
 
-def zlib_decompress(data):
-    """Decompress zlib data, if it is not zlib compressed, return data instead"""
+def zlib_decompress(data, inflator):
+    """Decompress zlib data with connection inflator, if it is not zlib compressed, return data instead"""
     buffer = bytearray()
     buffer.extend(data)
     if len(data) < 4 or data[-4:] != ZLIB_SUFFIX:
@@ -35,25 +43,44 @@ def zlib_decompress(data):
         return None
 
 
-def reset_inflator():
-    """Resets inflator object"""
-    global inflator
-    del inflator
-    inflator = zlib.decompressobj()   # noqa
+def get_shard_id(guild_id, shard_count):
+    """Get id of gateway shard that receives events for guild"""
+    return (int(guild_id) >> 22) % shard_count
+
+
+class IdentifyLimiter:
+    """Limits identify requests of all shards of one bot to one per interval in each of max_concurrency buckets"""
+
+    def __init__(self, max_concurrency):
+        self.max_concurrency = max(max_concurrency, 1)
+        self.locks = [threading.Lock() for _ in range(self.max_concurrency)]
+        self.last_identify = [0] * self.max_concurrency
+
+
+    def wait(self, shard_id):
+        """Block until shard is allowed to identify"""
+        bucket = shard_id % self.max_concurrency
+        with self.locks[bucket]:
+            wait = self.last_identify[bucket] + IDENTIFY_INTERVAL - time.time()
+            if wait > 0:
+                time.sleep(wait)
+            self.last_identify[bucket] = time.time()
 
 
 class Gateway():
     """Methods for fetching and sending data to Discord gateway through websocket"""
 
-    def __init__(self, token, host, name, compressed=True):
+    def __init__(self, token, host, name, compressed=True, session_path=None, shard=None, identify_limiter=None):
         if host:
             host_obj = urllib.parse.urlparse(host)
             if host_obj.netloc:
                 self.host = host_obj.netloc
             else:
                 self.host = host_obj.path
+            self.secure = host_obj.scheme != "http"
         else:
             self.host = DISCORD_HOST
+            self.secure = True
         self.header = [
             "Connection: keep-alive, Upgrade",
             "Sec-WebSocket-Extensions: permessage-deflate",
@@ -61,22 +88,39 @@ class Gateway():
         ]
         self.name = name
         self.compressed = compressed
+        self.inflator = zlib.decompressobj()
+        self.shard = shard   # [shard_id, shard_count] or None when not sharded
+        self.identify_limiter = identify_limiter
         self.init_time = time.time() * 1000
         self.token = token
         self.run = True
         self.wait = False
         self.heartbeat_received = True
         self.sequence = None
+        self.dispatching = None   # sequence of event taken from buffer, that is being dispatched
+        self.session_lock = threading.Lock()
         self.resume_gateway_url = ""
         self.session_id = ""
+        self.session_restarted = None
+        self.session_path = session_path
+        self.resuming = False
         self.ready = False
         self.my_id = None
-        self.messages_buffer = []
+        self.messages_buffer = deque()
+        metrics.add_callback("bridge_gateway_queue_depth", lambda: len(self.messages_buffer), gateway=name)
+        self.heartbeat_sent = None
         self.reconnect_requested = False
         self.legacy = False
         self.error = None
         self.resumable = False
-        threading.Thread(target=self.thread_guard, daemon=True, args=()).start()
+        self.recorder = None
+        if RECORD_DIR:
+            os.makedirs(RECORD_DIR, exist_ok=True)
+            filename = f"{name.replace(" ", "_").lower()}_{time.strftime("%Y%m%d-%H%M%S")}.frames.gz"
+            self.recorder = recorder.FrameRecorder(os.path.join(RECORD_DIR, filename))
+            atexit.register(self.recorder.close)
+        self.load_session()
+        threading.Thread(target=self.thread_guard, daemon=True, args=(), name=f"guard-{self.name}").start()
 
 
     def thread_guard(self):
@@ -89,11 +133,51 @@ class Gateway():
             if self.reconnect_requested:
                 self.reconnect_requested = False
                 if not self.reconnect_thread.is_alive():
-                    self.reconnect_thread = threading.Thread(target=self.reconnect, daemon=True, args=())
+                    self.reconnect_thread = threading.Thread(target=self.reconnect, daemon=True, args=(), name=f"reconnect-{self.name}")
                     self.reconnect_thread.start()
             time.sleep(0.5)
 
 
+    def load_session(self):
+        """Load session state saved by previous run, so it can be resumed"""
+        if not self.session_path or not os.path.exists(self.session_path):
+            return
+        try:
+            with open(self.session_path, "r") as f:
+                session = json.load(f)
+            if session.get("shard") != self.shard:
+                logger.info(f"({self.name}) Stored session is from different shard, not resuming it")
+                return
+            self.session_id = session["session_id"]
+            self.sequence = session["sequence"]
+            self.resume_gateway_url = session["resume_gateway_url"]
+            self.my_id = session["my_id"]
+            logger.info(f"({self.name}) Loaded stored session")
+        except (OSError, ValueError, KeyError) as e:
+            logger.warn(f"({self.name}) Failed to load stored session: {e}")
+
+
+    def save_session(self):
+        """Save session state so it can be resumed after restart"""
+        if not self.session_path or not self.session_id:
+            return
+        session = {
+            "session_id": self.session_id,
+            "sequence": self.get_processed_sequence(),
+            "resume_gateway_url": self.resume_gateway_url,
+            "my_id": self.my_id,
+            "shard": self.shard,
+        }
+        # saved from receiver, heartbeat and main thread
+        with self.session_lock:
+            try:
+                with open(self.session_path + ".tmp", "w") as f:
+                    json.dump(session, f)
+                os.replace(self.session_path + ".tmp", self.session_path)
+            except OSError as e:
+                logger.warn(f"({self.name}) Failed to save session: {e}")
+
+
     def connect_ws(self, resume=False):
         """Connect to websocket"""
         if resume and self.resume_gateway_url:
@@ -109,7 +193,10 @@ class Gateway():
 
     def connect(self):
         """Create initial connection to Discord gateway"""
-        connection = http.client.HTTPSConnection(self.host, 443)
+        if self.secure:
+            connection = http.client.HTTPSConnection(self.host)
+        else:
+            connection = http.client.HTTPConnection(self.host)
 
         # get gateway url
         try:
@@ -129,20 +216,32 @@ class Gateway():
             logger.error(f"({self.name}) Failed to get gateway url. Response code: {response.status}. Exiting...")
             raise SystemExit(f"Failed to get gateway url. Response code: {response.status}. Exiting...")
 
-        self.connect_ws()
+        self.resuming = bool(self.session_id and self.resume_gateway_url)
+        if self.resuming:
+            try:
+                self.connect_ws(resume=True)
+            except (websocket._exceptions.WebSocketException, OSError):
+                logger.info(f"({self.name}) Failed to connect to stored session gateway")
+                self.resuming = False
+        if not self.resuming:
+            self.connect_ws()
         data = self.ws.recv()
         if self.compressed:
-            data = zlib_decompress(data)
+            data = zlib_decompress(data, self.inflator)
         if data:
             self.heartbeat_interval = int(json.loads(data)["d"]["heartbeat_interval"])
         else:
             self.heartbeat_interval = 41250
-        self.receiver_thread = threading.Thread(target=self.safe_function_wrapper, daemon=True, args=(self.receiver, ))
+        self.receiver_thread = threading.Thread(target=self.safe_function_wrapper, daemon=True, args=(self.receiver, ), name=f"receiver-{self.name}")
         self.receiver_thread.start()
-        self.heartbeat_thread = threading.Thread(target=self.send_heartbeat, daemon=True)
+        self.heartbeat_thread = threading.Thread(target=self.send_heartbeat, daemon=True, name=f"heartbeat-{self.name}")
         self.heartbeat_thread.start()
         self.reconnect_thread = threading.Thread()
-        self.authenticate()
+        if self.resuming:
+            self.send({"op": 6, "d": {"token": self.token, "session_id": self.session_id, "seq": self.sequence}})
+            logger.debug(f"({self.name}) Sent resume for stored session")
+        else:
+            self.authenticate()
 
 
     def safe_function_wrapper(self, function, args=()):
@@ -172,6 +271,7 @@ class Gateway():
         while self.run and not self.wait:
             try:
                 ws_opcode, data = self.ws.recv_data()
+                received = time.perf_counter()
             except (
                 ConnectionResetError,
                 websocket._exceptions.WebSocketConnectionClosedException,
@@ -193,7 +293,7 @@ class Gateway():
                 break
             try:
                 if self.compressed:
-                    data = zlib_decompress(data)
+                    data = zlib_decompress(data, self.inflator)
                 if data:
                     try:
                         response = json.loads(data)
@@ -208,13 +308,19 @@ class Gateway():
                 logger.warn(f"({self.name}) Receiver error: {e}")
                 self.resumable = True
                 break
-            logger.debug(f"({self.name}) Received: opcode={opcode}, optext={response["t"] if (response and "t" in response and response["t"] and "LIST" not in response["t"]) else 'None'}")
+            decoded = time.perf_counter()
+            if event_logger.isEnabledFor(logging.DEBUG):
+                optext = response.get("t") if response else None
+                event_logger.debug("(%s) Received: opcode=%s, optext=%s", self.name, opcode, optext if optext and "LIST" not in optext else None)
             # debug_events
             # if response.get("t"):
             #     debug.save_json(response, f"{response["t"]}.json", False)
 
             if opcode == 11:
                 self.heartbeat_received = True
+                if self.heartbeat_sent:
+                    metrics.observe("bridge_gateway_heartbeat_rtt_seconds", time.perf_counter() - self.heartbeat_sent, gateway=self.name)
+                    self.heartbeat_sent = None
 
             elif opcode == 10:
                 self.heartbeat_interval = int(response["d"]["heartbeat_interval"])
@@ -223,50 +329,64 @@ class Gateway():
                 self.send({"op": 1, "d": self.sequence})
 
             elif opcode == 0:
-                self.sequence = int(response["s"])
+                sequence = int(response["s"])
                 optext = response["t"]
+                if self.recorder and optext not in ("READY", "RESUMED"):
+                    self.recorder.record(data)
                 data = response["d"]
+                metrics.inc("bridge_gateway_events_total", gateway=self.name, type=optext)
+                if optext in TRACED_EVENTS:
+                    trace = timing.Trace(f"{optext} {data["channel_id"]}-{data.get("id", "bulk")}", received)
+                    trace.add("decode", received, decoded - received)
 
                 if optext == "READY":
+                    if self.session_id:   # previous session is lost, events in between are missed
+                        self.session_restarted = int(time.time() * 1000)
                     self.resume_gateway_url = data["resume_gateway_url"]
                     self.session_id = data["session_id"]
                     self.my_id = data["user"]["id"]
+                    self.resuming = False
                     self.ready = True
+                    self.sequence = sequence
+                    self.save_session()
+
+                elif optext == "RESUMED":
+                    if self.resuming:
+                        logger.info(f"({self.name}) Session resumed")
+                        self.resuming = False
+                        self.ready = True
+                        self.sequence = sequence
+                        self.save_session()
 
                 elif optext == "MESSAGE_CREATE":
                     message = response["d"]
+                    start = time.perf_counter()
                     message_done = prepare_message(message)
-                    message_done.update({
-                        "channel_id": message["channel_id"],
-                        "guild_id": message.get("guild_id"),
-                    })
-                    self.messages_buffer.append({
-                        "op": "MESSAGE_CREATE",
-                        "d": message_done,
-                    })
+                    trace.add("prepare", start, time.perf_counter() - start)
+                    self.messages_buffer.append(Event("MESSAGE_CREATE", message_done, trace, replayed=self.resuming, sequence=sequence))
 
                 elif optext == "MESSAGE_UPDATE":
                     message = response["d"]
+                    start = time.perf_counter()
                     message_done = prepare_message(message)
-                    message_done.update({
-                        "channel_id": message["channel_id"],
-                        "guild_id": message.get("guild_id"),
-                    })
-                    self.messages_buffer.append({
-                        "op": "MESSAGE_UPDATE",
-                        "d": message_done,
-                    })
+                    trace.add("prepare", start, time.perf_counter() - start)
+                    self.messages_buffer.append(Event("MESSAGE_UPDATE", message_done, trace, sequence=sequence))
 
                 elif optext == "MESSAGE_DELETE":
-                    ready_data = {
-                        "id": data["id"],
-                        "channel_id": data["channel_id"],
-                        "guild_id": data.get("guild_id"),
-                    }
-                    self.messages_buffer.append({
-                        "op": "MESSAGE_DELETE",
-                        "d": ready_data,
-                    })
+                    ready_data = MessageDelete(
+                        id=data["id"],
+                        channel_id=data["channel_id"],
+                        guild_id=data.get("guild_id"),
+                    )
+                    self.messages_buffer.append(Event("MESSAGE_DELETE", ready_data, trace, sequence=sequence))
+
+                elif optext == "MESSAGE_DELETE_BULK":
+                    ready_data = MessageDeleteBulk(
+                        ids=data["ids"],
+                        channel_id=data["channel_id"],
+                        guild_id=data.get("guild_id"),
+                    )
+                    self.messages_buffer.append(Event("MESSAGE_DELETE_BULK", ready_data, trace, sequence=sequence))
 
                 elif optext == "MESSAGE_REACTION_ADD":
                     if "member" in data and "user" in data["member"]:   # spacebar_fix - "user" is mising
@@ -279,21 +399,18 @@ class Gateway():
                         username = None
                         global_name = None
                         nick = None
-                    ready_data = {
-                        "id": data["message_id"],
-                        "channel_id": data["channel_id"],
-                        "guild_id": data.get("guild_id"),
-                        "emoji": data["emoji"]["name"],
-                        "emoji_id": data["emoji"].get("id"),   # spacebar_fix - get
-                        "user_id": user_id,
-                        "username": username,
-                        "global_name": global_name,
-                        "nick": nick,
-                    }
-                    self.messages_buffer.append({
-                        "op": "MESSAGE_REACTION_ADD",
-                        "d": ready_data,
-                    })
+                    ready_data = Reaction(
+                        id=data["message_id"],
+                        channel_id=data["channel_id"],
+                        guild_id=data.get("guild_id"),
+                        emoji=data["emoji"]["name"],
+                        emoji_id=data["emoji"].get("id"),   # spacebar_fix - get
+                        user_id=user_id,
+                        username=username,
+                        global_name=global_name,
+                        nick=nick,
+                    )
+                    self.messages_buffer.append(Event("MESSAGE_REACTION_ADD", ready_data, sequence=sequence))
 
                 elif optext == "MESSAGE_REACTION_ADD_MANY":
                     channel_id = data["channel_id"]
@@ -301,35 +418,29 @@ class Gateway():
                     message_id = data["message_id"]
                     for reaction in data["reactions"]:
                         for user_id in reaction["users"]:
-                            ready_data = {
-                                "id": message_id,
-                                "channel_id": channel_id,
-                                "guild_id": guild_id,
-                                "emoji": reaction["emoji"]["name"],
-                                "emoji_id": reaction["emoji"]["id"],
-                                "user_id": user_id,
-                                "username": None,
-                                "global_name": None,
-                                "nick": None,
-                            }
-                            self.messages_buffer.append({
-                                "op": "MESSAGE_REACTION_ADD",
-                                "d": ready_data,
-                            })
+                            ready_data = Reaction(
+                                id=message_id,
+                                channel_id=channel_id,
+                                guild_id=guild_id,
+                                emoji=reaction["emoji"]["name"],
+                                emoji_id=reaction["emoji"]["id"],
+                                user_id=user_id,
+                            )
+                            self.messages_buffer.append(Event("MESSAGE_REACTION_ADD", ready_data, sequence=sequence))
 
                 elif optext == "MESSAGE_REACTION_REMOVE":
-                    ready_data = {
-                        "id": data["message_id"],
-                        "channel_id": data["channel_id"],
-                        "guild_id": data.get("guild_id"),
-                        "emoji": data["emoji"]["name"],
-                        "emoji_id": data["emoji"].get("id"),   # spacebar_fix - get
-                        "user_id": data["user_id"],
-                    }
-                    self.messages_buffer.append({
-                        "op": "MESSAGE_REACTION_REMOVE",
-                        "d": ready_data,
-                    })
+                    ready_data = Reaction(
+                        id=data["message_id"],
+                        channel_id=data["channel_id"],
+                        guild_id=data.get("guild_id"),
+                        emoji=data["emoji"]["name"],
+                        emoji_id=data["emoji"].get("id"),   # spacebar_fix - get
+                        user_id=data["user_id"],
+                    )
+                    self.messages_buffer.append(Event("MESSAGE_REACTION_REMOVE", ready_data, sequence=sequence))
+
+                # advanced only after event is queued, so processed sequence never skips event that is not queued yet
+                self.sequence = sequence
 
 
             elif opcode == 7:
@@ -338,8 +449,14 @@ class Gateway():
                 break
 
             elif opcode == 9:
-                logger.info(f"({self.name}) Session invalidated, reconnecting")
-                break
+                if self.resuming:
+                    logger.info(f"({self.name}) Stored session is invalid, identifying")
+                    self.resuming = False
+                    time.sleep(1 + 4 * random.random())
+                    self.authenticate()
+                else:
+                    logger.info(f"({self.name}) Session invalidated, reconnecting")
+                    break
 
             if abnormal:
                 self.resumable = True
@@ -359,9 +476,11 @@ class Gateway():
         heartbeat_sent_time = int(time.time())
         while self.run and not self.wait and self.heartbeat_running:
             if time.time() - heartbeat_sent_time >= heartbeat_interval_rand:
+                self.heartbeat_sent = time.perf_counter()
                 self.send({"op": 1, "d": self.sequence})
                 heartbeat_sent_time = int(time.time())
                 logger.debug(f"({self.name}) Sent heartbeat")
+                self.save_session()
                 if not self.heartbeat_received:
                     logger.warn(f"({self.name}) Heartbeat reply not received")
                     self.resumable = True
@@ -376,7 +495,9 @@ class Gateway():
 
 
     def authenticate(self):
-        """Authenticate client with discord gateway"""
+        """Authenticate client with discord gateway, waiting for identify rate limit if sharded"""
+        if self.identify_limiter:
+            self.identify_limiter.wait(self.shard[0])
         payload = {
             "op": 2,
             "d": {
@@ -395,6 +516,8 @@ class Gateway():
                 },
             },
         }
+        if self.shard:
+            payload["d"]["shard"] = self.shard
         self.send(payload)
         logger.debug(f"({self.name}) Sent identify")
 
@@ -402,11 +525,11 @@ class Gateway():
     def resume(self):
         """
         Try to resume discord gateway session on url provided by Discord in READY event.
-        Return gateway response code, 9 means resumming has failed
+        Replayed events, RESUMED and invalid session are handled by receiver. Return 9 if connecting has failed.
         """
         self.ws.close(timeout=0)   # this will stop receiver
         time.sleep(1)   # so receiver ends before opening new socket
-        reset_inflator()   # otherwise decompression wont work
+        self.inflator = zlib.decompressobj()   # otherwise decompression wont work
         self.ws = websocket.WebSocket()
         try:
             self.connect_ws(resume=True)
@@ -414,36 +537,28 @@ class Gateway():
             logger.info(f"({self.name}) Failed to resume connection")
             return 9
         if self.compressed:
-            _ = zlib_decompress(self.ws.recv())
+            _ = zlib_decompress(self.ws.recv(), self.inflator)
         else:
             _ = self.ws.recv()
-        payload = {"op": 6, "d": {"token": self.token, "session_id": self.session_id, "seq": self.sequence}}
-        self.send(payload)
-        try:
-            if self.compressed:
-                op = json.loads(zlib_decompress(self.ws.recv()))["op"]
-            else:
-                op = json.loads(self.ws.recv())["op"]
-            logger.info(f"({self.name}) Connection resumed")
-            return op
-        except (json.decoder.JSONDecodeError, websocket._exceptions.WebSocketConnectionClosedException):
-            logger.info(f"({self.name}) Failed to resume connection")
-            return 9
+        self.resuming = True
+        self.send({"op": 6, "d": {"token": self.token, "session_id": self.session_id, "seq": self.sequence}})
+        return None
 
 
     def reconnect(self):
         """Try to resume session, if cant, create new one"""
+        metrics.inc("bridge_gateway_reconnects_total", gateway=self.name)
         if not self.wait:
             logger.info(f"({self.name}) Trying to reconnect")
         try:
-            code = None
+            code = 9
             if self.resumable:
                 self.resumable = False
                 code = self.resume()
             if code == 9:
                 self.ws.close(timeout=0)   # this will stop receiver
                 time.sleep(1)   # so receiver ends before opening new socket
-                reset_inflator()   # otherwise decompression wont work
+                self.inflator = zlib.decompressobj()   # otherwise decompression wont work
                 self.ready = False   # will receive new ready event
                 self.ws = websocket.WebSocket()
                 self.connect_ws()
@@ -452,10 +567,10 @@ class Gateway():
             self.wait = False
             # restarting threads
             if not self.receiver_thread.is_alive():
-                self.receiver_thread = threading.Thread(target=self.safe_function_wrapper, daemon=True, args=(self.receiver, ))
+                self.receiver_thread = threading.Thread(target=self.safe_function_wrapper, daemon=True, args=(self.receiver, ), name=f"receiver-{self.name}")
                 self.receiver_thread.start()
             if not self.heartbeat_thread.is_alive():
-                self.heartbeat_thread = threading.Thread(target=self.send_heartbeat, daemon=True)
+                self.heartbeat_thread = threading.Thread(target=self.send_heartbeat, daemon=True, name=f"heartbeat-{self.name}")
                 self.heartbeat_thread.start()
             logger.info(f"({self.name}) Connection established")
         except websocket._exceptions.WebSocketAddressException:
@@ -502,6 +617,16 @@ class Gateway():
         return self.ready
 
 
+    def get_session_restarted(self):
+        """
+        Get time in ms when new session replaced lost one, or None if session was not lost since last call.
+        Events from lost session end until this time are missed.
+        """
+        restarted = self.session_restarted
+        self.session_restarted = None
+        return restarted
+
+
     def get_my_id(self):
         """Get my discord user ID"""
         return self.my_id
@@ -512,6 +637,144 @@ class Gateway():
         Get message CREATE, EDIT, DELETE and ACK events for every guild and channel.
         Returns 1 by 1 event as an update for list of messages.
         """
-        if len(self.messages_buffer) == 0:
+        self.dispatching = None   # previous event is dispatched
+        if not self.messages_buffer:
+            return None
+        self.dispatching = self.messages_buffer[0].sequence
+        return self.messages_buffer.popleft()
+
+
+    def get_processed_sequence(self):
+        """
+        Get sequence of last event that is dispatched, so events that are still queued or being dispatched
+        are replayed when stored session is resumed.
+        """
+        sequence = self.sequence
+        # buffer is checked before dispatching, because event is marked as dispatching before it leaves buffer
+        try:
+            pending = self.messages_buffer[0].sequence
+        except IndexError:
+            pending = None
+        dispatching = self.dispatching
+        if dispatching is not None:
+            pending = dispatching
+        if pending is None or sequence is None:
+            return sequence
+        return min(pending - 1, sequence)
+
+
+class ShardedGateway():
+    """Gateway connection split over multiple shards, events from all shards are received as from one gateway"""
+
+    def __init__(self, token, host, name, discord, shards=None, compressed=True, session_path=None, guild_id=None):
+        self.token = token
+        self.host = host
+        self.name = name
+        self.discord = discord
+        self.shards = shards   # None - not sharded, "auto" - recommended by gateway, or number of shards
+        self.compressed = compressed
+        self.session_path = session_path
+        self.guild_id = guild_id
+        self.gateways = []
+        self.next_gateway = 0
+
+
+    def get_shard_config(self):
+        """Get number of shards and max identify concurrency, or None if connection should not be sharded"""
+        if not self.shards:
             return None
-        return self.messages_buffer.pop(0)
+        recommended = self.discord.get_gateway_bot()
+        if self.shards == "auto":
+            if not recommended:
+                logger.warn(f"({self.name}) Failed to get recommended number of shards, connecting without sharding")
+            return recommended
+        return int(self.shards), recommended[1] if recommended else 1
+
+
+    def connect(self):
+        """Create gateway for each shard and connect them, respecting identify concurrency"""
+        shard_config = self.get_shard_config()
+        if not shard_config:
+            self.gateways = [Gateway(self.token, self.host, self.name, self.compressed, self.session_path)]
+        else:
+            shard_count, max_concurrency = shard_config
+            logger.info(f"({self.name}) Connecting {shard_count} shards, max concurrency={max_concurrency}")
+            identify_limiter = IdentifyLimiter(max_concurrency)
+            root, ext = os.path.splitext(self.session_path) if self.session_path else (None, None)
+            self.gateways = [
+                Gateway(
+                    self.token,
+                    self.host,
+                    f"{self.name} shard {shard_id}",
+                    self.compressed,
+                    f"{root}_{shard_id}{ext}" if root else None,
+                    shard=[shard_id, shard_count],
+                    identify_limiter=identify_limiter,
+                )
+                for shard_id in range(shard_count)
+            ]
+        for gateway in self.gateways:
+            gateway.connect()
+
+
+    @property
+    def error(self):
+        """Error from first failed shard, or None"""
+        for gateway in self.gateways:
+            if gateway.error:
+                return gateway.error
+        return None
+
+
+    @property
+    def run(self):
+        """Whether all shards are running"""
+        return all(gateway.run for gateway in self.gateways)
+
+
+    def save_session(self):
+        """Save session state of all shards"""
+        for gateway in self.gateways:
+            gateway.save_session()
+
+
+    def update_presence(self, status, custom_status=None, custom_status_emoji=None):
+        """Update client status on all shards"""
+        for gateway in self.gateways:
+            gateway.update_presence(status, custom_status, custom_status_emoji)
+
+
+    def get_ready(self):
+        """Return wether all shards processed entire READY event"""
+        return all(gateway.get_ready() for gateway in self.gateways)
+
+
+    def get_session_restarted(self):
+        """
+        Get time in ms when new session replaced lost one, or None if session was not lost since last call.
+        Only shard receiving events from bridged guild is checked, if guild is known.
+        """
+        restarted = [gateway.get_session_restarted() for gateway in self.gateways]
+        if self.guild_id and len(self.gateways) > 1:
+            return restarted[get_shard_id(self.guild_id, len(self.gateways))]
+        return min((timestamp for timestamp in restarted if timestamp), default=None)
+
+
+    def get_my_id(self):
+        """Get my discord user ID"""
+        for gateway in self.gateways:
+            if gateway.my_id:
+                return gateway.my_id
+        return None
+
+
+    def get_messages(self):
+        """Get next event from shards, taking them in turns so no shard is starved"""
+        count = len(self.gateways)
+        for num in range(count):
+            gateway = self.gateways[(self.next_gateway + num) % count]
+            event = gateway.get_messages()
+            if event:
+                self.next_gateway = (self.next_gateway + num + 1) % count
+                return event
+        return None
@@ -0,0 +1,51 @@
+import atexit
+import logging
+import queue
+import random
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+LOG_FORMAT = "{asctime} - {levelname}\n  [{module}]: {message}\n"
+LOG_DATE_FORMAT = "%Y-%m-%d-%H:%M:%S"
+MAX_SIZE = 10 * 1024 * 1024
+BACKUP_COUNT = 3
+EVENTS_LOGGER = "bridge.events"   # per-event debug logs, these are sampled
+
+
+class SampleFilter(logging.Filter):
+    """Pass only random fraction of log records"""
+
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+
+
+    def filter(self, _record):
+        """Return whether record is kept"""
+        return self.rate >= 1 or random.random() < self.rate
+
+
+class LazyQueueHandler(QueueHandler):
+    """Queue handler that leaves formatting of records to listener thread, log arguments must not be changed after logging"""
+
+    def prepare(self, record):
+        """Pass record unformatted"""
+        return record
+
+
+def setup(path, level, sample_rate=1):
+    """
+    Log to rotating file, records are queued and formatted and written by background thread.
+    Per-event debug logs are sampled with sample_rate.
+    """
+    file_handler = RotatingFileHandler(path, maxBytes=MAX_SIZE, backupCount=BACKUP_COUNT, encoding="utf-8")
+    file_handler.setFormatter(logging.Formatter(LOG_FORMAT, LOG_DATE_FORMAT, style="{"))
+    log_queue = queue.SimpleQueue()
+    listener = QueueListener(log_queue, file_handler)
+    root = logging.getLogger()
+    root.setLevel(level)
+    root.addHandler(LazyQueueHandler(log_queue))
+    if sample_rate < 1:
+        logging.getLogger(EVENTS_LOGGER).addFilter(SampleFilter(sample_rate))
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
@@ -0,0 +1,165 @@
+import logging
+import threading
+import time
+import urllib.parse
+
+import apsw
+
+logger = logging.getLogger(__name__)
+TOUCH_INTERVAL = 3600   # dont update last used time more often than this
+MEMO_SIZE = 10000
+SIGNATURE_PARAMS = ("ex", "is", "hm")   # expiring discord cdn url signature
+EXPIRY_MARGIN = 3600   # signed urls expiring sooner than this are not used
+
+
+def source_key(url):
+    """Remove expiring signature from cdn url, so same file always has same key"""
+    url_obj = urllib.parse.urlparse(url)
+    if not url_obj.query:
+        return url
+    query = [x for x in urllib.parse.parse_qsl(url_obj.query) if x[0] not in SIGNATURE_PARAMS]
+    return url_obj._replace(query=urllib.parse.urlencode(query)).geturl()
+
+
+def get_expiry(url):
+    """Get unix time when signed cdn url expires, from its hex "ex" parameter, or None if it is not signed"""
+    expires = urllib.parse.parse_qs(urllib.parse.urlparse(url).query).get("ex")
+    if not expires:
+        return None
+    try:
+        return int(expires[0], 16)
+    except ValueError:
+        return None
+
+
+def is_expired(expires):
+    """Check if signed url is expired or expires soon"""
+    return expires is not None and expires - EXPIRY_MARGIN < time.time()
+
+
+class MediaCache:
+    """
+    Content-addressed cache of files already uploaded to target platforms: content hash -> target url.
+    Source urls are also mapped to content hashes, so known files dont have to be downloaded again.
+    Least recently used entries are evicted when total size of cached files exceeds max_size.
+    Entries with expiring signed target urls are treated as not cached when they expire, and are replaced when file is uploaded again.
+    """
+
+    def __init__(self, db_path, max_size):
+        self.max_size = max_size
+        self.conn = apsw.Connection(db_path)
+        self.lock = threading.Lock()
+        self.memo = {}   # (target, source): [url, hash, last_used, expires]
+        self.init_db()
+        self.total_size = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM media").fetchone()[0]
+
+
+    def init_db(self):
+        """Initialize database"""
+        cur = self.conn.cursor()
+        cur.execute("PRAGMA journal_mode=WAL")
+        cur.execute("PRAGMA synchronous=NORMAL")
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS media (
+                target TEXT NOT NULL,
+                hash TEXT NOT NULL,
+                url TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                last_used REAL NOT NULL,
+                expires REAL,
+                PRIMARY KEY (target, hash)
+            )
+        """)
+        # table created before url expiry was stored
+        columns = [row[1] for row in cur.execute("PRAGMA table_info(media)")]
+        if "expires" not in columns:
+            cur.execute("ALTER TABLE media ADD COLUMN expires REAL")
+            rows = cur.execute("SELECT target, hash, url FROM media").fetchall()
+            cur.executemany("UPDATE media SET expires = ? WHERE target = ? AND hash = ?", [(get_expiry(url), target, digest) for target, digest, url in rows])
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS sources (
+                target TEXT NOT NULL,
+                source TEXT NOT NULL,
+                hash TEXT NOT NULL,
+                PRIMARY KEY (target, source)
+            )
+        """)
+        cur.execute("CREATE INDEX IF NOT EXISTS media_last_used ON media (last_used)")
+
+
+    def touch(self, target, digest, last_used):
+        """Update last used time of cached file, return new last used time"""
+        now = time.time()
+        if now - last_used > TOUCH_INTERVAL:
+            with self.conn:
+                self.conn.execute("UPDATE media SET last_used = ? WHERE target = ? AND hash = ?", (now, target, digest))
+            return now
+        return last_used
+
+
+    def get_by_source(self, target, source):
+        """Get target url of file from its source url, if not cached return none"""
+        key = (target, source_key(source))
+        entry = self.memo.get(key)
+        if entry:
+            if is_expired(entry[3]):
+                self.memo.pop(key, None)
+                return None
+            entry[2] = self.touch(target, entry[1], entry[2])
+            return entry[0]
+        row = self.conn.execute("""
+            SELECT media.url, media.hash, media.last_used, media.expires FROM sources
+            JOIN media ON media.target = sources.target AND media.hash = sources.hash
+            WHERE sources.target = ? AND sources.source = ?
+        """, key).fetchone()
+        if not row or is_expired(row[3]):
+            return None
+        if len(self.memo) > MEMO_SIZE:
+            self.memo.clear()
+        self.memo[key] = [row[0], row[1], self.touch(target, row[1], row[2]), row[3]]
+        return row[0]
+
+
+    def get_by_hash(self, target, digest):
+        """Get target url of file from its content hash, if not cached return none"""
+        row = self.conn.execute("SELECT url, last_used, expires FROM media WHERE target = ? AND hash = ?", (target, digest)).fetchone()
+        if not row or is_expired(row[2]):
+            return None
+        self.touch(target, digest, row[1])
+        return row[0]
+
+
+    def add_source(self, target, source, digest):
+        """Map source url to content hash of already cached file"""
+        with self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO sources (target, source, hash) VALUES (?, ?, ?)", (target, source_key(source), digest))
+
+
+    def add(self, target, source, digest, url, size):
+        """Add uploaded file to cache, evicting least recently used files if cache is full"""
+        with self.lock, self.conn:
+            row = self.conn.execute("SELECT size FROM media WHERE target = ? AND hash = ?", (target, digest)).fetchone()
+            if row:
+                self.total_size -= row[0]
+            self.conn.execute(
+                "INSERT OR REPLACE INTO media (target, hash, url, size, last_used, expires) VALUES (?, ?, ?, ?, ?, ?)",
+                (target, digest, url, size, time.time(), get_expiry(url)),
+            )
+            self.conn.execute("INSERT OR REPLACE INTO sources (target, source, hash) VALUES (?, ?, ?)", (target, source_key(source), digest))
+            self.total_size += size
+            if self.total_size > self.max_size:
+                self.evict()
+
+
+    def evict(self):
+        """Remove least recently used files until cache fits in max_size"""
+        evicted = []
+        for target, digest, size in self.conn.execute("SELECT target, hash, size FROM media ORDER BY last_used"):
+            if self.total_size <= self.max_size:
+                break
+            evicted.append((target, digest))
+            self.total_size -= size
+        self.conn.executemany("DELETE FROM media WHERE target = ? AND hash = ?", evicted)
+        self.conn.executemany("DELETE FROM sources WHERE target = ? AND hash = ?", evicted)
+        self.memo.clear()
+        logger.debug(f"Media cache: evicted {len(evicted)} files")
@@ -1,5 +1,7 @@
 from datetime import datetime
 
+from bridge.events import Lazy
+
 PLATFORM_TYPES = ("Desktop", "Xbox", "Playstation", "IOS", "Android", "Nitendo", "Linux", "MacOS")
 CONTENT_TYPES = ("Played Game", "Watched Media", "Top Game", "Listened Media", "Listened Session", "Top Artist", "Custom Status", "Launched Activity", "Leaderboard")
 
@@ -59,153 +61,171 @@ def prepare_embeds(embeds, message_content):
     return ready_embeds
 
 
-def prepare_message(message):
-    """Prepare message dict"""
-    # replied message
-    if "referenced_message" in message:
-        if message["referenced_message"]:
-            reference_nick = None
-            for mention in message["mentions"]:
-                if mention["id"] == message["referenced_message"]["id"]:
-                    if "member" in mention:
-                        reference_nick = mention["member"]["nick"]
-            ref_mentions = []
-            if message["referenced_message"]["mentions"]:
-                for ref_mention in message["referenced_message"]["mentions"]:
-                    ref_mentions.append({
-                        "username": ref_mention["username"],
-                        "id": ref_mention["id"],
-                    })
-            if "message_snapshots" in message["referenced_message"]:
-                forwarded = message["referenced_message"]["message_snapshots"][0]["message"]
-                # additional text with forwarded message is sent separately
-                message["referenced_message"]["content"] = f"[Forwarded]: {forwarded.get("content")}"
-                message["referenced_message"]["embeds"] = forwarded.get("embeds")
-                message["referenced_message"]["attachments"] = forwarded.get("attachments")
-            reference_embeds = prepare_embeds(message["referenced_message"]["embeds"], "")
-            for attachment in message["referenced_message"].get("attachments", []):
-                reference_embeds.append({
-                    "type": attachment.get("content_type", "unknown"),
-                    "name": attachment["filename"],
-                    "url": attachment["url"],
-                })   # keep attachments in same place as embeds
-            reference = {
-                "id": message["referenced_message"]["id"],
-                "timestamp": message["referenced_message"]["timestamp"],
-                "content": message["referenced_message"]["content"],
-                "mentions": ref_mentions,
-                "user_id": message["referenced_message"]["author"]["id"],
-                "username": message["referenced_message"]["author"]["username"],
-                "global_name": message["referenced_message"]["author"].get("global_name"),   # spacebar_fix - get
-                "nick": reference_nick,
-                "embeds": reference_embeds,
-                "stickers": message["referenced_message"].get("sticker_items", []),
-            }
-        else:   # reference message is deleted
-            reference = {
-                "id": None,
-                "content": "Deleted message",
-            }
-    else:
-        reference = None
-
-    # reactions
-    if "reactions" in message:
-        reactions = []
-        for reaction in message["reactions"]:
-            reactions.append({
-                "emoji": reaction["emoji"]["name"],
-                "emoji_id": reaction["emoji"].get("id"),   # spacebar_fix - get
-                "count": reaction["count"],
-                "me": reaction.get("me"),
-            })
-    else:
-        reactions = []
-    nick = None
-    if "member" in message:
-        nick = message["member"]["nick"]
-
-    # forwarded messages
-    if "message_snapshots" in message:
-        forwarded = message["message_snapshots"][0]["message"]
-        # additional text with forwarded message is sent separately
-        message["content"] = f"[Forwarded]: {forwarded.get("content")}"
-        message["embeds"] = forwarded.get("embeds")
-        message["attachments"] = forwarded.get("attachments")
-
-    # special message types
-    message = prepare_special_message_types(message)
-    if message.get("poll"):   # spacebar_fix - get
-        poll = prepare_poll(message["poll"])
-    else:
-        poll = None
-
-    # embeds and attachments
-    embeds = prepare_embeds(message["embeds"], message["content"])
-    for attachment in message["attachments"]:
-        embeds.append({
+def prepare_attachments(attachments, with_size=True):
+    """Prepare message attachments, they are kept in same place as embeds"""
+    ready_attachments = []
+    for attachment in attachments:
+        ready_attachment = {
             "type": attachment.get("content_type", "unknown"),
             "name": attachment["filename"],
             "url": attachment["url"],
-        })   # keep attachments in same place as embeds
-
-    # mentions
-    mentions = []
-    if message["mentions"]:
-        for mention in message["mentions"]:
-            mentions.append({
-                "username": mention.get("username"),   # spacebar_fix - get
-                "id": mention["id"],
-            })
-
-    # interactions
-    if message.get("interaction"):   # spacebar_fix - get
-        interaction = {
-            "username": message["interaction"]["user"]["username"],
-            "command": message["interaction"]["name"],
         }
-    else:
-        interaction = None
-
-    # components
-    component_info = None
-    if message.get("components"):
-        new_content, new_embeds, component_info = prepare_components(message["components"])
-        new_content_str = ""
-        for line in new_content:
-            new_content_str += f"> {line}\n"
-        new_content_str = new_content_str.strip("\n")
-        message["content"] += new_content_str
-        embeds.extend(new_embeds)
-
-    message_dict = {
-        "id": message["id"],
-        "channel_id": message["channel_id"],
-        "guild_id": message.get("guild_id"),
-        "timestamp": message["timestamp"],
-        "edited": bool(message["edited_timestamp"]),
-        "content": message["content"],
-        "mentions": mentions,
-        "mention_roles": message["mention_roles"],
-        "mention_everyone": message["mention_everyone"],
-        "user_id": message["author"]["id"],
-        "username": message["author"]["username"],
-        "global_name": message["author"].get("global_name"),   # spacebar_fix - get
-        "nick": nick,
-        "avatar_id": message["author"].get("avatar"),
-        "referenced_message": reference,
-        "reactions": reactions,
-        "embeds": embeds,
-        "stickers": message.get("sticker_items", []),   # {name, id, format_type}
-        "interaction": interaction,
+        if with_size:
+            ready_attachment["size"] = attachment.get("size")
+        ready_attachments.append(ready_attachment)
+    return ready_attachments
+
+
+def get_forwarded(message):
+    """Get message with content, embeds and attachments of forwarded message, without changing original message"""
+    if "message_snapshots" not in message:
+        return message
+    forwarded = message["message_snapshots"][0]["message"]
+    # additional text with forwarded message is sent separately
+    return {
+        **message,
+        "content": f"[Forwarded]: {forwarded.get("content")}",
+        "embeds": forwarded.get("embeds"),
+        "attachments": forwarded.get("attachments"),
     }
-    if poll:
-        message_dict["poll"] = poll
-    if component_info:
-        message_dict["component_info"] = component_info
-    # if message["author"].get("bot"):
-    #     message_dict["bot"] = True
-    return message_dict
+
+
+class Reference(Lazy):
+    """Replied message, deleted replied message has no raw data"""
+    __slots__ = ("raw", "id", "nick", "timestamp", "content", "mentions", "user_id", "username", "global_name", "embeds", "stickers")
+
+    def __init__(self, raw, nick=None):
+        self.raw = raw
+        self.nick = nick
+        if raw:
+            self.id = raw["id"]
+            self.user_id = raw["author"]["id"]
+        else:   # reference message is deleted
+            self.id = None
+            self.timestamp = None
+            self.content = "Deleted message"
+            self.mentions = []
+            self.user_id = None
+            self.username = None
+            self.global_name = None
+            self.embeds = []
+            self.stickers = []
+
+
+    def compute_fields(self):
+        """Compute all fields that are cheap to get, at once"""
+        message = self.raw
+        self.timestamp = message["timestamp"]
+        self.content = get_forwarded(message)["content"]
+        self.mentions = [{"username": mention["username"], "id": mention["id"]} for mention in message["mentions"] or []]
+        self.username = message["author"]["username"]
+        self.global_name = message["author"].get("global_name")   # spacebar_fix - get
+        self.stickers = message.get("sticker_items", [])
+    compute_timestamp = compute_content = compute_mentions = compute_username = compute_global_name = compute_stickers = compute_fields
+
+
+    def compute_embeds(self):
+        """Compute embeds with attachments"""
+        message = get_forwarded(self.raw)
+        self.embeds = prepare_embeds(message["embeds"], "") + prepare_attachments(message.get("attachments", []), with_size=False)
+
+
+class Message(Lazy):
+    """
+    View over raw message, from gateway event or fetched from API.
+    Fields needed to filter events are set immediately, other fields are computed in groups on first access.
+    """
+    __slots__ = (
+        "raw", "id", "channel_id", "guild_id", "timestamp", "edited", "content",
+        "mentions", "mention_roles", "mention_everyone",
+        "user_id", "username", "global_name", "nick", "avatar_id", "webhook_id",
+        "referenced_message", "reactions", "embeds", "stickers", "interaction", "poll", "component_info",
+    )
+
+    def __init__(self, raw):
+        self.raw = raw
+        self.id = raw["id"]
+        self.channel_id = raw["channel_id"]
+        self.guild_id = raw.get("guild_id")
+        self.user_id = raw["author"]["id"]
+
+
+    def compute_fields(self):
+        """Compute all fields that are cheap to get, at once, replied message is also lazy"""
+        message = self.raw
+        author = message["author"]
+        self.timestamp = message["timestamp"]
+        self.edited = bool(message["edited_timestamp"])
+        self.mention_roles = message["mention_roles"]
+        self.mention_everyone = message["mention_everyone"]
+        self.username = author["username"]
+        self.global_name = author.get("global_name")   # spacebar_fix - get
+        self.nick = message["member"]["nick"] if "member" in message else None
+        self.avatar_id = author.get("avatar")
+        self.webhook_id = message.get("webhook_id")
+        self.stickers = message.get("sticker_items", [])   # {name, id, format_type}
+        self.mentions = [{
+            "username": mention.get("username"),   # spacebar_fix - get
+            "id": mention["id"],
+        } for mention in message["mentions"] or []]
+        self.reactions = [{
+            "emoji": reaction["emoji"]["name"],
+            "emoji_id": reaction["emoji"].get("id"),   # spacebar_fix - get
+            "count": reaction["count"],
+            "me": reaction.get("me"),
+        } for reaction in message.get("reactions", [])]
+
+        interaction = message.get("interaction")   # spacebar_fix - get
+        if interaction:
+            self.interaction = {
+                "username": interaction["user"]["username"],
+                "command": interaction["name"],
+            }
+        else:
+            self.interaction = None
+
+        if "referenced_message" not in message:
+            self.referenced_message = None
+            return
+        referenced = message["referenced_message"]
+        nick = None
+        if referenced:
+            for mention in message["mentions"]:
+                if mention["id"] == referenced["id"] and "member" in mention:
+                    nick = mention["member"]["nick"]
+        self.referenced_message = Reference(referenced, nick)
+    compute_timestamp = compute_edited = compute_mention_roles = compute_mention_everyone = compute_fields
+    compute_username = compute_global_name = compute_nick = compute_avatar_id = compute_webhook_id = compute_fields
+    compute_stickers = compute_mentions = compute_reactions = compute_interaction = compute_referenced_message = compute_fields
+
+
+    def compute_body(self):
+        """Compute content, embeds, poll and component info, content of forwarded and special messages and components is added here"""
+        message = get_forwarded(self.raw)
+        if message["type"]:
+            # special message types replace content and can remove embeds
+            message = prepare_special_message_types({**message, "embeds": list(message["embeds"])})
+        content = message["content"]
+        embeds = prepare_embeds(message["embeds"], content) + prepare_attachments(message["attachments"])
+        component_info = None
+        if message.get("components"):
+            new_content, new_embeds, component_info = prepare_components(message["components"])
+            new_content_str = ""
+            for line in new_content:
+                new_content_str += f"> {line}\n"
+            content += new_content_str.strip("\n")
+            embeds.extend(new_embeds)
+        self.content = content
+        self.embeds = embeds
+        self.component_info = component_info
+        poll = message.get("poll")   # spacebar_fix - get
+        self.poll = prepare_poll(poll) if poll else None
+    compute_content = compute_embeds = compute_component_info = compute_poll = compute_body
+
+
+def prepare_message(message):
+    """Prepare message from raw message dict, fields are computed when they are used"""
+    return Message(message)
 
 
 def prepare_messages(data, have_channel_id=False):
@@ -214,7 +234,7 @@ def prepare_messages(data, have_channel_id=False):
     for message in data:
         messages.append(prepare_message(message))
         if have_channel_id:
-            messages[-1]["channel_id"] = message["channel_id"]
+            messages[-1].channel_id = message["channel_id"]
     return messages
 
 
@@ -0,0 +1,205 @@
+import functools
+import gc
+import logging
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+QUERY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.5)
+STAGE_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# name: (type, help)
+DEFINITIONS = {
+    "bridge_gateway_events_total": ("counter", "Gateway dispatch events received, by event type"),
+    "bridge_gateway_queue_depth": ("gauge", "Events received from gateway and not yet processed by bridge"),
+    "bridge_gateway_heartbeat_rtt_seconds": ("histogram", "Time between sent heartbeat and its acknowledgement"),
+    "bridge_gateway_reconnects_total": ("counter", "Gateway reconnect attempts"),
+    "bridge_http_request_seconds": ("histogram", "REST API request latency, by rate limit route"),
+    "bridge_http_responses_total": ("counter", "REST API responses, by status code"),
+    "bridge_http_rate_limited_total": ("counter", "REST API requests rejected with 429, by rate limit route"),
+    "bridge_db_query_seconds": ("histogram", "Pair database query latency, by query"),
+    "bridge_db_lookups_total": ("counter", "Pair database lookups, by result: hit or miss"),
+    "bridge_db_cleanup_seconds": ("gauge", "Duration of last pair database cleanup"),
+    "bridge_forward_latency_seconds": ("histogram", "Time from source message creation until it is sent to all targets"),
+    "bridge_stage_seconds": ("histogram", "Duration of pipeline stages in traced events, by stage"),
+    "bridge_trace_seconds": ("histogram", "Time from gateway receive until traced event is forwarded, by event type"),
+    "bridge_pending_events": ("gauge", "Message edits and reaction changes waiting to be forwarded, by platform and kind"),
+    "bridge_process_resident_memory_bytes": ("gauge", "Resident memory size of bridge process"),
+    "bridge_process_threads": ("gauge", "Running threads"),
+    "bridge_process_objects": ("gauge", "Objects tracked by garbage collector"),
+}
+BUCKETS = {
+    "bridge_db_query_seconds": QUERY_BUCKETS,
+    "bridge_stage_seconds": STAGE_BUCKETS,
+    "bridge_trace_seconds": STAGE_BUCKETS,
+}
+pages = {"/metrics": lambda _query: registry.render()}   # path: function taking query dict and returning page text
+
+
+def escape_label(value):
+    """Escape label value for prometheus text format"""
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_labels(labels, extra=None):
+    """Format label pairs in prometheus text format"""
+    if extra:
+        labels = labels + (extra, )
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{escape_label(value)}"' for key, value in labels) + "}"
+
+
+class Registry:
+    """Thread-safe store of counters, gauges and histograms, each identified by name and labels"""
+
+    def __init__(self):
+        self.values = {}   # name: {labels: value or [bucket counts, sum, count]}
+        self.callbacks = {}   # name: {labels: function returning gauge value}
+        self.lock = threading.Lock()
+
+
+    def inc(self, name, value=1, **labels):
+        """Increase counter"""
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            series = self.values.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+
+    def set(self, name, value, **labels):
+        """Set gauge value"""
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            self.values.setdefault(name, {})[key] = value
+
+
+    def add_callback(self, name, function, **labels):
+        """Set gauge that is read from function when metrics are collected"""
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            self.callbacks.setdefault(name, {})[key] = function
+
+
+    def observe(self, name, value, **labels):
+        """Add value to histogram"""
+        key = tuple(sorted(labels.items()))
+        bounds = BUCKETS.get(name, LATENCY_BUCKETS)
+        with self.lock:
+            series = self.values.setdefault(name, {})
+            histogram = series.get(key)
+            if not histogram:
+                histogram = series[key] = [[0] * len(bounds), 0, 0]
+            for num, bound in enumerate(bounds):
+                if value <= bound:
+                    histogram[0][num] += 1
+                    break
+            histogram[1] += value
+            histogram[2] += 1
+
+
+    def render(self):
+        """Get all metrics in prometheus text format"""
+        with self.lock:
+            values = {name: dict(series) for name, series in self.values.items()}
+            for name, callbacks in self.callbacks.items():
+                series = values.setdefault(name, {})
+                for key, function in callbacks.items():
+                    series[key] = function()
+        lines = []
+        for name, (metric_type, description) in DEFINITIONS.items():
+            series = values.get(name)
+            if not series:
+                continue
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            for key, value in series.items():
+                if metric_type != "histogram":
+                    lines.append(f"{name}{format_labels(key)} {value}")
+                    continue
+                buckets, total, count = value
+                cumulative = 0
+                for bound, bucket in zip(BUCKETS.get(name, LATENCY_BUCKETS), buckets):
+                    cumulative += bucket
+                    lines.append(f"{name}_bucket{format_labels(key, ("le", bound))} {cumulative}")
+                lines.append(f"{name}_bucket{format_labels(key, ("le", "+Inf"))} {count}")
+                lines.append(f"{name}_sum{format_labels(key)} {total}")
+                lines.append(f"{name}_count{format_labels(key)} {count}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+inc = registry.inc
+set_gauge = registry.set
+add_callback = registry.add_callback
+observe = registry.observe
+
+
+def timed_query(function):
+    """Decorator for pair database methods, observes their duration"""
+    @functools.wraps(function)
+    def wrapper(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return function(self, *args, **kwargs)
+        finally:
+            observe("bridge_db_query_seconds", time.perf_counter() - start, database=self.name, query=function.__name__)
+    return wrapper
+
+
+def get_resident_memory():
+    """Get resident memory of this process in bytes, from /proc"""
+    with open("/proc/self/statm", "r") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+def add_process_callbacks():
+    """Add gauges of process memory, threads and objects, which are read when metrics are collected"""
+    if os.path.exists("/proc/self/statm"):
+        add_callback("bridge_process_resident_memory_bytes", get_resident_memory)
+    add_callback("bridge_process_threads", threading.active_count)
+    add_callback("bridge_process_objects", lambda: len(gc.get_objects()))
+
+
+def add_page(path, function):
+    """Serve text returned by function on path of metrics server, function is called with query dict"""
+    pages[path] = function
+
+
+def count_lookup(database, result):
+    """Count pair lookup as hit if something is found"""
+    inc("bridge_db_lookups_total", database=database, result="hit" if result else "miss")
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """Serves metrics on /metrics, and other added pages"""
+
+    def log_message(self, format, *args):   # noqa: A002
+        """Disable request logging"""
+
+
+    def do_GET(self):   # noqa: N802
+        """Send requested page"""
+        path, _, query = self.path.partition("?")
+        page = pages.get(path)
+        if not page:
+            self.send_error(404)
+            return
+        body = page(dict(x.split("=", 1) for x in query.split("&") if "=" in x)).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def serve(host, port):
+    """Start metrics http server in a thread"""
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logger.info(f"Serving metrics on http://{host}:{port}/metrics")
+    return server
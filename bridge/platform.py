@@ -0,0 +1,108 @@
+import logging
+import os
+import sys
+from collections import namedtuple
+
+from bridge import discord, gateway
+
+logger = logging.getLogger(__name__)
+
+# immutable route from source channel to one target channel, with precomputed pair table names
+Route = namedtuple("Route", ["source_channel", "target", "target_channel", "channel_pair", "reverse_pair", "store", "cdn"])
+
+
+class Platform:
+    """One configured Discord or Spacebar instance, with its clients, database and bridge state"""
+
+    def __init__(self, name, config, database, data_dir):
+        self.name = name
+        self.display_name = name.capitalize()
+        self.cdn = config["cdn_host"]
+        self.guild_id = config["guild_id"]
+        self.presence = config.get("presence", False)
+        self.media_channel_id = config.get("media_channel_id")
+        self.database = database
+        self.discord = discord.Discord(config["token"], config["host"], self.cdn, self.display_name)
+        # optional extra bots used only to send messages, to spread them over more rate limits
+        self.senders = [self.discord]
+        for num, token in enumerate(config.get("send_tokens", [])):
+            self.senders.append(discord.Discord(token, config["host"], self.cdn, f"{self.display_name} {num + 1}"))
+        self.gateway = gateway.ShardedGateway(
+            config["token"],
+            config["host"],
+            self.display_name,
+            self.discord,
+            shards=config.get("shards"),
+            compressed=config.get("compressed", True),
+            session_path=os.path.join(data_dir, f"{name}_session.json"),
+            guild_id=self.guild_id,
+        )
+
+        self.my_id = None
+        self.own_ids = set()   # bot and webhook user ids, messages from them are not forwarded
+        self.webhooks = {}   # channel_id: (webhook_id, webhook_token)
+        self.routes = {}   # source channel_id: (Route, ...)
+        self.last_source = {}   # newest forwarded source message per channel
+        self.catch_up_until = None   # snowflake until which missed messages are not caught up yet
+        self.catch_up_from = {}   # source channel_id: message after which missed messages are not caught up yet
+        self.next_catch_up = 0   # time of next catch up attempt, after failed one
+        self.pending_updates = {}   # message_id: [send_time, data]
+        self.pending_reactions = {}   # message_id: [send_time, channel_id, {(emoji, emoji_id): count_change}]
+        self.reactions = {}   # message_id: last fetched reactions, used for edits that dont include reactions
+
+
+    def add_route(self, source_channel, target, target_channel):
+        """Forward messages from source channel on this platform to target channel on target platform"""
+        route = Route(
+            source_channel=source_channel,
+            target=target,
+            target_channel=target_channel,
+            channel_pair=sys.intern(f"pair_{source_channel}_{target_channel}"),
+            reverse_pair=sys.intern(f"pair_{target_channel}_{source_channel}"),
+            store=self.database,
+            cdn=self.cdn,
+        )
+        self.database.create_table(route.channel_pair)
+        self.routes[source_channel] = self.routes.get(source_channel, ()) + (route, )
+        last_source = self.database.get_last_source(route.channel_pair)
+        if last_source and int(last_source) > int(self.last_source.get(source_channel, 0)):
+            self.last_source[source_channel] = last_source
+
+
+    def set_bots(self, my_id):
+        """Set main bot user id and get ids of send pool bots, messages from all of them are not forwarded"""
+        self.my_id = my_id
+        self.discord.my_id = my_id
+        self.own_ids.add(my_id)
+        senders = [self.discord]
+        for sender in self.senders[1:]:
+            if sender.get_my_id():
+                self.own_ids.add(sender.my_id)
+                senders.append(sender)
+            else:
+                logger.warn(f"({sender.name}) Failed to get send pool bot user, its not used")
+        self.senders = senders
+
+
+    def get_sender(self, channel_id):
+        """Get bot that has most rate limit headroom for sending messages in channel"""
+        if len(self.senders) == 1:
+            return self.discord
+        url = f"/api/v9/channels/{channel_id}/messages"
+        return max(self.senders, key=lambda sender: sender.get_headroom("POST", url))
+
+
+    def get_bot(self, bot_id):
+        """Get bot by its user id, if its not in send pool return main bot"""
+        for sender in self.senders:
+            if sender.my_id == bot_id:
+                return sender
+        return self.discord
+
+
+    def get_route(self, source_channel, target, target_channel):
+        """Get route from source channel to target channel, if not bridged return none"""
+        for route in self.routes.get(source_channel, ()):
+            if route.target is target and route.target_channel == target_channel:
+                return route
+        return None
@@ -0,0 +1,143 @@
+import logging
+import os
+import signal
+import sys
+import threading
+import time
+import tracemalloc
+
+logger = logging.getLogger(__name__)
+PROFILE_DIR = os.getenv("PROFILE_DIR", "./profiles/")
+DEFAULT_DURATION = 30
+MAX_DURATION = 600
+SAMPLE_INTERVAL = 0.005
+HEAP_FRAMES = 10   # traceback depth stored for each allocation
+HEAP_TOP = 50
+
+
+def format_frame(frame):
+    """Get frame label for folded stack: function (file:line where function starts)"""
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class Profiler:
+    """
+    Samples stacks of all threads for limited time, in a background thread, and writes them in folded format,
+    readable by flamegraph.pl, speedscope and inferno. Optionally writes top allocations traced during profiling.
+    """
+
+    def __init__(self, path=PROFILE_DIR, interval=SAMPLE_INTERVAL):
+        self.path = os.path.expanduser(path)
+        self.interval = interval
+        self.thread = None
+        self.end = 0
+        self.last_files = []
+
+
+    def start(self, duration=DEFAULT_DURATION, heap=False):
+        """Start profiling for duration seconds, return false if it is already running"""
+        if self.running:
+            return False
+        duration = min(max(duration, 1), MAX_DURATION)
+        self.end = time.time() + duration
+        self.thread = threading.Thread(target=self.sample, daemon=True, args=(duration, heap), name="profiler")
+        self.thread.start()
+        logger.info(f"Profiling for {duration}s{", with heap snapshot" if heap else ""}")
+        return True
+
+
+    @property
+    def running(self):
+        """Whether profiling is in progress"""
+        return bool(self.thread and self.thread.is_alive())
+
+
+    def sample(self, duration, heap):
+        """Collect stack samples until duration passes, then write results, should be run in a thread"""
+        own_heap = heap and not tracemalloc.is_tracing()
+        if own_heap:
+            tracemalloc.start(HEAP_FRAMES)
+        stacks = {}   # folded stack: number of samples
+        samples = 0
+        start = time.perf_counter()
+        own_id = threading.get_ident()
+        while time.perf_counter() - start < duration:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, top_frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                frame = top_frame
+                while frame:
+                    stack.append(format_frame(frame))
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, str(thread_id)))
+                folded = ";".join(reversed(stack))
+                stacks[folded] = stacks.get(folded, 0) + 1
+            samples += 1
+            time.sleep(self.interval)
+        elapsed = time.perf_counter() - start
+
+        os.makedirs(self.path, exist_ok=True)
+        timestamp = time.strftime("%Y%m%d-%H%M%S")
+        files = [os.path.join(self.path, f"profile-{timestamp}.folded")]
+        with open(files[0], "w", encoding="utf-8") as f:
+            for folded, count in sorted(stacks.items(), key=lambda item: item[1], reverse=True):
+                f.write(f"{folded} {count}\n")
+        if heap:
+            snapshot = tracemalloc.take_snapshot()
+            if own_heap:
+                tracemalloc.stop()
+            files.append(os.path.join(self.path, f"heap-{timestamp}.txt"))
+            self.write_heap(files[1], snapshot)
+        self.last_files = files
+        logger.info(f"Profiling done, {samples} samples in {elapsed:.1f}s, written to {", ".join(files)}")
+
+
+    def write_heap(self, path, snapshot):
+        """Write top allocations by size, with their tracebacks"""
+        snapshot = snapshot.filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, __file__),
+        ))
+        statistics = snapshot.statistics("traceback")
+        total = sum(stat.size for stat in statistics)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(f"Traced memory: {total / 1024:.1f} KiB in {sum(stat.count for stat in statistics)} blocks\n")
+            for num, stat in enumerate(statistics[:HEAP_TOP]):
+                f.write(f"\n#{num + 1}: {stat.size / 1024:.1f} KiB in {stat.count} blocks\n")
+                for line in stat.traceback.format(most_recent_first=True):
+                    f.write(line + "\n")
+
+
+    def status(self):
+        """Get text describing profiling state"""
+        if self.running:
+            return f"Profiling, {max(0, self.end - time.time()):.0f}s left\n"
+        if self.last_files:
+            return "Last profile: " + ", ".join(self.last_files) + "\n"
+        return "No profile taken\n"
+
+
+    def handle_page(self, query):
+        """Start profiling from metrics server page, `seconds` and `heap` are read from query"""
+        try:
+            duration = float(query.get("seconds", DEFAULT_DURATION))
+        except ValueError:
+            return "Invalid seconds\n"
+        if self.start(duration, query.get("heap") in ("1", "true")):
+            return f"Started profiling, results will be written to {self.path}\n"
+        return self.status()
+
+
+    def handle_signal(self, signum, _frame):
+        """Start profiling on signal, SIGUSR2 also takes heap snapshot"""
+        self.start(heap=signum == signal.SIGUSR2)
+
+
+    def register_signals(self):
+        """Start profiling on SIGUSR1, and with heap snapshot on SIGUSR2, where these signals exist"""
+        if hasattr(signal, "SIGUSR1"):
+            signal.signal(signal.SIGUSR1, self.handle_signal)
+            signal.signal(signal.SIGUSR2, self.handle_signal)
@@ -0,0 +1,50 @@
+import gzip
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+FLUSH_INTERVAL = 1
+
+
+class FrameRecorder:
+    """Writes raw gateway frames with their receive time to gzip compressed file, one frame per line"""
+
+    def __init__(self, path):
+        self.path = path
+        self.file = gzip.open(path, "wt", encoding="utf-8")
+        self.start = time.perf_counter()
+        self.next_flush = self.start + FLUSH_INTERVAL
+        self.lock = threading.Lock()
+        logger.info(f"Recording gateway frames to {path}")
+
+
+    def record(self, frame):
+        """Write one decoded frame, prefixed with seconds since recording started"""
+        if isinstance(frame, (bytes, bytearray)):
+            frame = frame.decode("utf-8")
+        now = time.perf_counter()
+        with self.lock:
+            self.file.write(f"{now - self.start:.4f}\t{frame}\n")
+            # so recording is readable even if bridge is killed
+            if now >= self.next_flush:
+                self.file.flush()
+                self.next_flush = now + FLUSH_INTERVAL
+
+
+    def close(self):
+        """Finish recording"""
+        with self.lock:
+            self.file.close()
+
+
+def read_frames(path):
+    """Yield (offset in seconds, frame text) from recording, recording cut off by killed bridge is read until its end"""
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        try:
+            for line in f:
+                offset, _, frame = line.rstrip("\n").partition("\t")
+                if frame:
+                    yield float(offset), frame
+        except EOFError:
+            logger.warn(f"Recording {path} is not complete")
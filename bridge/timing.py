@@ -0,0 +1,106 @@
+import heapq
+import itertools
+import threading
+import time
+from contextlib import contextmanager
+
+from bridge import metrics
+
+
+class Trace:
+    """Timeline of one event going through pipeline stages, from gateway receive until it is forwarded"""
+
+    def __init__(self, name, start=None):
+        self.name = name
+        self.start = start or time.perf_counter()
+        self.received = time.time() - (time.perf_counter() - self.start)
+        self.stages = []   # (name, offset from start, duration, target)
+        self.total = None
+
+
+    def add(self, name, start, duration, target=None):
+        """Add stage that started at perf_counter time and lasted duration in seconds, optionally for one target"""
+        self.stages.append((name, start - self.start, duration, target))
+
+
+    def format(self):
+        """Get readable timeline of trace"""
+        received = time.strftime("%Y-%m-%d-%H:%M:%S", time.localtime(self.received))
+        lines = [f"{self.name} received={received} total={self.total * 1000:.2f}ms"]
+        for name, offset, duration, target in sorted(self.stages, key=lambda stage: stage[1]):
+            label = f"{name} > {target}" if target else name
+            lines.append(f"  +{offset * 1000:.2f}ms {label}: {duration * 1000:.2f}ms")
+        return "\n".join(lines)
+
+
+class StageTimer:
+    """Collects number of runs, total and max duration of each pipeline stage, and slowest finished traces"""
+
+    def __init__(self, slowest_size=20):
+        self.stages = {}   # name: [count, total, max]
+        self.lock = threading.Lock()
+        self.slowest_size = slowest_size
+        self.slowest = []   # min-heap of (total, num, trace)
+        self.counter = itertools.count()
+
+
+    @contextmanager
+    def stage(self, name, trace=None, target=None):
+        """Time code block as one run of named stage, and add it to trace if there is one"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - start
+            self.add(name, duration)
+            if trace:
+                trace.add(name, start, duration, target)
+
+
+    def add(self, name, duration):
+        """Add one run of named stage with its duration in seconds"""
+        with self.lock:
+            entry = self.stages.get(name)
+            if entry:
+                entry[0] += 1
+                entry[1] += duration
+                entry[2] = max(entry[2], duration)
+            else:
+                self.stages[name] = [1, duration, duration]
+
+
+    def finish(self, trace):
+        """Finish trace: add its stages to histograms and keep it if it is one of slowest"""
+        if not trace:
+            return
+        trace.total = time.perf_counter() - trace.start
+        event_type = trace.name.split(" ")[0]
+        for name, _, duration, _ in trace.stages:
+            metrics.observe("bridge_stage_seconds", duration, stage=name)
+        metrics.observe("bridge_trace_seconds", trace.total, type=event_type)
+        with self.lock:
+            entry = (trace.total, next(self.counter), trace)
+            if len(self.slowest) < self.slowest_size:
+                heapq.heappush(self.slowest, entry)
+            elif trace.total > self.slowest[0][0]:
+                heapq.heapreplace(self.slowest, entry)
+
+
+    def dump_slowest(self):
+        """Get readable timelines of slowest traces, slowest first"""
+        with self.lock:
+            slowest = sorted(self.slowest, reverse=True)
+        if not slowest:
+            return "No finished traces\n"
+        return "\n".join(trace.format() for _, _, trace in slowest) + "\n"
+
+
+    def report(self):
+        """Get summary of stage durations since last report and reset them"""
+        with self.lock:
+            stages = self.stages
+            self.stages = {}
+        return "; ".join(
+            f"{name}: {count}x avg={total / count * 1000:.2f}ms max={peak * 1000:.2f}ms"
+            for name, (count, total, peak) in stages.items()
+        )
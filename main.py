@@ -1,45 +1,127 @@
+import argparse
+import hashlib
 import json
 import logging
 import os
+import re
 import signal
 import sys
 import threading
 import time
-
-from bridge import discord, formatter, gateway
+from concurrent.futures import ThreadPoolExecutor
+
+from bridge import (
+    attachments,
+    discord,
+    formatter,
+    logs,
+    media_cache,
+    metrics,
+    platform,
+    profiler,
+    timing,
+)
 
 logger = logging
-logging.basicConfig(
-    level=os.getenv("LOG_LEVEL", "INFO").upper(),
-    filename="spacebar_bridge.log",
-    encoding="utf-8",
-    filemode="w",
-    format="{asctime} - {levelname}\n  [{module}]: {message}\n",
-    style="{",
-    datefmt="%Y-%m-%d-%H:%M:%S",
+event_logger = logging.getLogger(logs.EVENTS_LOGGER)
+logs.setup(
+    "spacebar_bridge.log",
+    os.getenv("LOG_LEVEL", "INFO").upper(),
+    float(os.getenv("LOG_SAMPLE_RATE", 1)),
 )
+MIRROR_BATCH = 50
+WEBHOOK_NAME = "Spacebar Bridge"
+MAX_CONTENT_LENGTH = 2000
+REACTIONS_MEMO_SIZE = 10000
+BULK_DELETE_SIZE = 100
+BULK_DELETE_MAX_AGE = 14 * 86400 - 60   # bulk delete accepts only messages younger than 2 weeks
+FANOUT_WORKERS = 8
+TIMING_REPORT_INTERVAL = 60
+CATCH_UP_RETRY_INTERVAL = 30
+match_webhook_forbidden = re.compile(r"discord|clyde", re.IGNORECASE)
 ERROR_TEXT = "\nUnhandled exception occurred. Please report here: https://github.com/mzivic7/spacebar-bridge/issues"
 
 
 def get_author_name(message):
     """Get author name from message"""
-    if message["nick"]:
-        return message["nick"]
-    if message["global_name"]:
-        return message["global_name"]
-    if message["username"]:
-        return message["username"]
+    if message.nick:
+        return message.nick
+    if message.global_name:
+        return message.global_name
+    if message.username:
+        return message.username
     return "Unknown"
 
 
 def get_author_pfp(message, cdn_url, size=80):
     """Get author pfp url from message"""
-    avatar_id = message["avatar_id"]
+    avatar_id = message.avatar_id
     if avatar_id:
-        return f"https://{cdn_url}/avatars/{message["user_id"]}/{avatar_id}.webp?size={size}"
+        return f"https://{cdn_url}/avatars/{message.user_id}/{avatar_id}.webp?size={size}"
     return None
 
 
+def get_webhook_username(name):
+    """Get username allowed for webhook, it must be 1-80 characters and cant contain some words"""
+    name = match_webhook_forbidden.sub(lambda x: x.group(0)[0] + "*" + x.group(0)[2:], name)
+    return name[:80] or "Unknown"
+
+
+def get_content_hash(author_name, avatar_id, message_text):
+    """Get compact hash of rendered message, used to detect edits that dont change target message"""
+    digest = hashlib.blake2b(digest_size=8)
+    for part in (author_name, avatar_id or "", message_text):
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def build_embeds(author_name, author_pfp, message_text):
+    """Build rich embed with author, used when message is sent as bot"""
+    embeds = [{
+        "type": "rich",
+        "author": {
+            "name": author_name,
+        },
+        "description": message_text,
+    }]
+    if author_pfp:
+        embeds[0]["author"]["icon_url"] = author_pfp
+    return embeds
+
+
+def get_platforms_config(config):
+    """Get config of all platforms, old config with only discord and spacebar sections is converted"""
+    if "platforms" in config:
+        return config["platforms"]
+    attachments_config = config.get("attachments") or {}
+    return {
+        "discord": {
+            **config["discord"],
+            "guild_id": config["discord_guild_id"],
+            "presence": True,
+            "media_channel_id": attachments_config.get("discord_media_channel_id"),
+        },
+        "spacebar": {
+            **config["spacebar"],
+            "guild_id": config["spacebar_guild_id"],
+            "compressed": False,
+            "media_channel_id": attachments_config.get("spacebar_media_channel_id"),
+        },
+    }
+
+
+def get_bridges_config(config):
+    """Get list of bridged channel groups, each is list of (platform name, channel_id), old 1:1 bridges are converted"""
+    groups = []
+    for bridge in config["bridges"]:
+        if "channels" in bridge:
+            groups.append([(channel["platform"], channel["channel_id"]) for channel in bridge["channels"]])
+        else:
+            groups.append([("discord", bridge["discord_channel_id"]), ("spacebar", bridge["spacebar_channel_id"])])
+    return groups
+
+
 class Bridge:
     """Bridge class"""
 
@@ -48,398 +130,798 @@ class Bridge:
             config = json.load(f)
         self.run = True
 
-        if config["database"]["postgresql_host"]:
-            self.init_postgresql(config)
-        else:
-            self.init_sqlite(config)
-
-        host_a = config["discord"]["host"]
-        self.cdn_a = config["discord"]["cdn_host"]
-        token_a = config["discord"]["token"]
-        host_b = config["spacebar"]["host"]
-        self.cdn_b = config["spacebar"]["cdn_host"]
-        token_b = config["spacebar"]["token"]
-        bridges = config["bridges"]
+        self.data_dir = os.path.expanduser(config["database"]["dir_path"])
+        os.makedirs(self.data_dir, exist_ok=True)
         self.message_config = config["format"]
+        self.edit_debounce = config.get("edit_debounce_seconds", 1)
+        reactions_config = config.get("reactions", {})
+        self.reactions_enabled = reactions_config.get("enabled", False)
+        self.reaction_interval = reactions_config.get("interval_seconds", 5)
+        self.executor = ThreadPoolExecutor(max_workers=FANOUT_WORKERS, thread_name_prefix="fanout")
+        self.webhook_lock = threading.Lock()
+        self.timer = timing.StageTimer()
+        self.profiler = profiler.Profiler()
+        self.next_timing_report = time.time() + TIMING_REPORT_INTERVAL
         self.channels = []   # should be loaded from gateway when guild_create event is parsed
         self.roles = []   # this too
 
-        custom_status = config["custom_status"]
-        custom_status_emoji = config["custom_status_emoji"]
-
-        self.guild_id_a = config["discord_guild_id"]
-        self.guild_id_b = config["spacebar_guild_id"]
-
-        self.channels_a = []
-        self.bridges_a = {}
-        self.bridges_a_txt = []
-        self.channels_b = []
-        self.bridges_b = {}
-        self.bridges_b_txt = []
-        for bridge in bridges:
-            a = bridge["discord_channel_id"]
-            b = bridge["spacebar_channel_id"]
-            self.channels_a.append(a)
-            self.bridges_a[a] = b
-            self.bridges_a_txt.append(f"pair_{a}_{b}")
-            self.database_a.create_table(f"pair_{a}_{b}")
-            self.channels_b.append(b)
-            self.bridges_b[b] = a
-            self.bridges_b_txt.append(f"pair_{b}_{a}")
-            self.database_b.create_table(f"pair_{b}_{a}")
-
+        self.metrics_config = config.get("metrics", {})
+
+        self.custom_status = config["custom_status"]
+        self.custom_status_emoji = config["custom_status_emoji"]
+
+        self.platforms = {}
+        for name, platform_config in get_platforms_config(config).items():
+            if config["database"]["postgresql_host"]:
+                database = self.init_postgresql(config, name)
+            else:
+                database = self.init_sqlite(config, name)
+            self.platforms[name] = platform.Platform(name, platform_config, database, self.data_dir)
+
+        # every channel in a group forwards to all other channels in that group
+        for group in get_bridges_config(config):
+            for source_name, source_channel in group:
+                for target_name, target_channel in group:
+                    if (target_name, target_channel) != (source_name, source_channel):
+                        self.platforms[source_name].add_route(source_channel, self.platforms[target_name], target_channel)
+
+        attachments_config = config.get("attachments")
+        if attachments_config and attachments_config["reupload"]:
+            if attachments_config.get("cache_size_mb"):
+                cache = media_cache.MediaCache(
+                    os.path.join(self.data_dir, "media_cache.db"),
+                    attachments_config["cache_size_mb"] * 1024 * 1024,
+                )
+            else:
+                cache = None
+            media_channels = {}
+            for side in self.platforms.values():
+                if side.media_channel_id:
+                    media_channels[side.display_name] = side.media_channel_id
+            self.uploader = attachments.AttachmentUploader(
+                attachments_config["max_size_mb"] * 1024 * 1024,
+                attachments_config["upload_workers"],
+                cache=cache,
+                media_channels=media_channels,
+            )
+        else:
+            self.uploader = None
+
+        webhooks_config = config.get("webhooks", {})
+        for side in self.platforms.values():
+            if webhooks_config.get(side.name):
+                self.init_webhooks(side)
+
+
+    def start(self):
+        """Connect to gateways and run bridge loops"""
+        self.profiler.register_signals()
+        if self.metrics_config.get("enabled"):
+            metrics.add_page("/traces", lambda _query: self.timer.dump_slowest())
+            metrics.add_page("/profile", self.profiler.handle_page)
+            metrics.add_process_callbacks()
+            for side in self.platforms.values():
+                metrics.add_callback("bridge_pending_events", lambda side=side: len(side.pending_updates), platform=side.name, kind="updates")
+                metrics.add_callback("bridge_pending_events", lambda side=side: len(side.pending_reactions), platform=side.name, kind="reactions")
+            metrics.serve(self.metrics_config.get("host", "127.0.0.1"), self.metrics_config.get("port", 9464))
         print("Connecting to gateways")
-        self.discord_a = discord.Discord(token_a, host_a, self.cdn_a, "Discord")
-        self.gateway_a = gateway.Gateway(token_a, host_a, "Discord")
-        self.gateway_a.connect()
-        self.discord_b = discord.Discord(token_b, host_b, self.cdn_b, "Spacebar")
-        self.gateway_b = gateway.Gateway(token_b, host_b, "Spacebar", compressed=False)
-        self.gateway_b.connect()
-
-        while not (self.gateway_a.get_ready() and self.gateway_b.get_ready()):
-            if self.gateway_a.error:
-                logger.fatal(f"Gateway A error: \n {self.gateway_a.error}")
-                sys.exit(self.gateway_a.error + ERROR_TEXT)
-            if self.gateway_b.error:
-                logger.fatal(f"Gateway B error: \n {self.gateway_b.error}")
-                sys.exit(self.gateway_b.error + ERROR_TEXT)
-            if not self.gateway_a.run or not self.gateway_b.run:
-                sys.exit()
+        for side in self.platforms.values():
+            side.gateway.connect()
+
+        while not all(side.gateway.get_ready() for side in self.platforms.values()):
+            for side in self.platforms.values():
+                if side.gateway.error:
+                    logger.fatal(f"Gateway error ({side.display_name}): \n {side.gateway.error}")
+                    sys.exit(side.gateway.error + ERROR_TEXT)
+                if not side.gateway.run:
+                    sys.exit()
             time.sleep(0.2)
 
-        self.my_id_a = self.gateway_a.get_my_id()
-        self.my_id_b = self.gateway_b.get_my_id()
-
-        self.gateway_a.update_presence(
-            status="online",
-            custom_status=custom_status,
-            custom_status_emoji=custom_status_emoji,
-        )
-        # self.gateway_b.update_presence(   # not supported by spacebar
-        #     status="online",
-        #     custom_status=custom_status,
-        #     custom_status_emoji=custom_status_emoji,
-        # )
+        for side in self.platforms.values():
+            side.set_bots(side.gateway.get_my_id())
+            if side.presence:   # not supported by spacebar
+                side.gateway.update_presence(
+                    status="online",
+                    custom_status=self.custom_status,
+                    custom_status_emoji=self.custom_status_emoji,
+                )
 
         logger.info("Bridge initialized successfully")
         print("Bridge initialized successfully")
 
-        threading.Thread(target=self.loop_b, daemon=True).start()
-        self.loop_a()
-
-
-    def init_sqlite(self, config):
-        """Initialize SQLite database"""
-        print("Initializing database")
+        sides = list(self.platforms.values())
+        for side in sides[1:]:
+            threading.Thread(target=self.loop, daemon=True, args=(side, ), name=f"loop-{side.name}").start()
+        threading.current_thread().name = f"loop-{sides[0].name}"
+        try:
+            self.loop(sides[0])
+        finally:
+            for side in sides:
+                side.gateway.save_session()
+
+
+    def init_webhooks(self, side):
+        """Get webhooks for all bridged channels on one platform, from database or by creating them"""
+        for channel_id in side.routes:
+            webhook = side.database.get_webhook(channel_id)
+            if not webhook:
+                webhook = side.discord.get_webhook(channel_id, WEBHOOK_NAME)
+                if not webhook:
+                    logger.warn(f"({side.display_name}) Failed to get webhook for channel {channel_id}, sending as bot")
+                    continue
+                side.database.add_webhook(channel_id, *webhook)
+            side.webhooks[channel_id] = webhook
+            side.own_ids.add(webhook[0])
+
+
+    def replace_webhook(self, side, channel_id, webhook):
+        """Replace deleted webhook in channel with new one, return new webhook, or None if it cant be created"""
+        with self.webhook_lock:
+            current = side.webhooks.get(channel_id)
+            if current != webhook:   # already replaced
+                return current
+            logger.warn(f"({side.display_name}) Webhook in channel {channel_id} is deleted, creating new one")
+            side.database.delete_webhook(channel_id)
+            side.webhooks.pop(channel_id, None)
+            webhook = side.discord.get_webhook(channel_id, WEBHOOK_NAME)
+            if not webhook:
+                logger.warn(f"({side.display_name}) Failed to get webhook for channel {channel_id}, sending as bot")
+                return None
+            side.database.add_webhook(channel_id, *webhook)
+            side.webhooks[channel_id] = webhook
+            side.own_ids.add(webhook[0])
+            return webhook
+
+
+    def init_sqlite(self, config, name):
+        """Initialize SQLite database for one platform"""
+        print(f"Initializing {name} database")
         from bridge import database
         database_path = os.path.expanduser(config["database"]["dir_path"])
         cleanup_days = config["database"]["cleanup_days"]
         pair_lifetime_days = config["database"]["pair_lifetime_days"]
         if not os.path.exists(database_path):
             os.makedirs(database_path, exist_ok=True)
-        databse_path_a = os.path.join(database_path, "discord.db")
-        databse_path_b = os.path.join(database_path, "spacebar.db")
-        self.database_a = database.PairStore(databse_path_a, cleanup_days, pair_lifetime_days, name="Discord")
-        self.database_b = database.PairStore(databse_path_b, cleanup_days, pair_lifetime_days, name="Spacebar")
+        databse_path = os.path.join(database_path, f"{name}.db")
+        return database.PairStore(databse_path, cleanup_days, pair_lifetime_days, name=name.capitalize())
 
 
-    def init_postgresql(self, config):
-        """"Connect to PostgreSQL database"""
-        print("Connecting to postgres databse")
+    def init_postgresql(self, config, name):
+        """"Connect to PostgreSQL database for one platform"""
+        print(f"Connecting to {name} postgres databse")
         from bridge import database_postgres
         host = config["database"]["postgresql_host"]
         user = config["database"]["postgresql_user"]
         password = config["database"]["postgresql_password"]
         cleanup_days = config["database"]["cleanup_days"]
         pair_lifetime_days = config["database"]["pair_lifetime_days"]
-        self.database_a = database_postgres.PairStore(host, user, password, "bridge_discord_msgs", cleanup_days, pair_lifetime_days, name="Discord")
-        self.database_b = database_postgres.PairStore(host, user, password, "bridge_spacebar_msgs", cleanup_days, pair_lifetime_days, name="Spacebar")
-
-
-    def loop_a(self):   # DISCORD -> SPACEBAR
-        """Loop A"""
-        while self.run:
-
-            # get messages
-            while self.run:
-                new_message = self.gateway_a.get_messages()
-                if new_message:
-                    data = new_message["d"]
-                    if data["channel_id"] in self.channels_a and data.get("user_id") != self.my_id_a:
-                        op = new_message["op"]
-
-                        if op == "MESSAGE_CREATE":
-                            # build message
-                            source_channel = data["channel_id"]
-                            target_channel = self.bridges_a[source_channel]
-                            source_message = data["id"]
-                            author_name = get_author_name(data)
-                            author_pfp = get_author_pfp(data, self.cdn_a)
-                            if data["referenced_message"]:
-                                source_reference_id = data["referenced_message"]["id"]
-                                if data["referenced_message"]["user_id"] == self.my_id_a:
-                                    channel_pair = f"pair_{target_channel}_{source_channel}"
-                                    target_reference_id = self.database_b.get_source(channel_pair, source_reference_id)
-                                else:
-                                    channel_pair = f"pair_{source_channel}_{target_channel}"
-                                    target_reference_id = target_message = self.database_a.get_target(channel_pair, source_reference_id)
-                                for mention in data["referenced_message"]["mentions"]:
-                                    if mention["id"] == self.my_id_a:
-                                        reply_ping = True
-                                        break
-                                else:
-                                    reply_ping = False
-                            else:
-                                target_reference_id = None
-                                reply_ping = True
-                            message_text = formatter.build_message(
-                                data,
-                                self.message_config,
-                                self.roles,
-                                self.channels,
-                            )
-                            if not message_text:
-                                message_text = "*Unknown message content*"
-                            embeds = [{
-                                "type": "rich",
-                                "author": {
-                                    "name": author_name,
-                                },
-                                "description": message_text,
-                            }]
-                            if author_pfp:
-                                embeds[0]["author"]["icon_url"] = author_pfp
-                            # send message
-                            target_message = self.discord_b.send_message(
-                                channel_id=target_channel,
-                                message_content="",
-                                reply_id=target_reference_id,
-                                reply_channel_id=target_channel,
-                                reply_guild_id=self.guild_id_b,
-                                reply_ping=reply_ping,
-                                embeds=embeds,
-                            )
-                            # add to db
-                            if target_message:
-                                logger.debug(f"CREATE (A): = {source_channel} > {target_channel} = [{author_name}] - ({source_message}) - {message_text}")
-                                channel_pair = f"pair_{source_channel}_{target_channel}"
-                                if channel_pair in self.bridges_a_txt:
-                                    self.database_a.add_pair(channel_pair, source_message, target_message)
-                                else:
-                                    logger.warn(f"Channel pair (A): {channel_pair} not initialized")
-
-                        elif op == "MESSAGE_UPDATE":
-                            source_channel = data["channel_id"]
-                            target_channel = self.bridges_a[source_channel]
-                            channel_pair = f"pair_{source_channel}_{target_channel}"
-                            if channel_pair in self.bridges_a_txt:
-                                source_message = data["id"]
-                                target_message = self.database_a.get_target(channel_pair, source_message)
-                                if target_message:
-                                    author_name = get_author_name(data)
-                                    author_pfp = get_author_pfp(data, self.cdn_a)
-                                    message_text = formatter.build_message(
-                                        data,
-                                        self.message_config,
-                                        self.roles,
-                                        self.channels,
-                                    )
-                                    if not message_text:
-                                        message_text = "*Unknown message content*"
-                                    embeds = [{
-                                        "type": "rich",
-                                        "author": {
-                                            "name": author_name,
-                                        },
-                                        "description": message_text,
-                                    }]
-                                    if author_pfp:
-                                        embeds[0]["author"]["icon_url"] = author_pfp
-                                    self.discord_b.send_update_message(
-                                        channel_id=target_channel,
-                                        message_id=target_message,
-                                        message_content="",
-                                        embeds=embeds,
-                                    )
-                                    logger.debug(f"EDIT (A): = {source_channel} > {target_channel} = [{author_name}] - ({source_message}) - {message_text}")
-                            else:
-                                logger.warn(f"Channel pair (A): {channel_pair} not initialized")
-
-                        elif op == "MESSAGE_DELETE":
-                            source_channel = data["channel_id"]
-                            target_channel = self.bridges_a[source_channel]
-                            channel_pair = f"pair_{source_channel}_{target_channel}"
-                            if channel_pair in self.bridges_a_txt:
-                                source_message = data["id"]
-                                target_message = self.database_a.get_target(channel_pair, source_message)
-                                if target_message:
-                                    self.discord_b.send_delete_message(target_channel, target_message)
-                                    logger.debug(f"DELETE (A): = {source_channel} > {target_channel} = ({source_message})")
-                                    self.database_a.delete_pair(channel_pair, source_message)
-                            else:
-                                logger.warn(f"Channel pair (A): {channel_pair} not initialized")
-
-                        elif op == "MESSAGE_REACTION_ADD":
-                            pass
-
-                        elif op == "MESSAGE_REACTION_REMOVE":
-                            pass
-
-                else:
+        return database_postgres.PairStore(host, user, password, f"bridge_{name}_msgs", cleanup_days, pair_lifetime_days, name=name.capitalize())
+
+
+    def fan_out(self, function, jobs):
+        """Call function with each of argument tuples, in parallel if there are more of them, return results in same order"""
+        if len(jobs) == 1:
+            return [function(*jobs[0])]
+        futures = [self.executor.submit(function, *job) for job in jobs]
+        return [future.result() for future in futures]
+
+
+    def get_unbridged(self, source, source_channel, message_ids):
+        """Get routes that messages are not bridged through yet, return dict message_id: [route]"""
+        unbridged = {}
+        for route in source.routes[source_channel]:
+            bridged = route.store.get_targets(route.channel_pair, message_ids)
+            for message_id in message_ids:
+                if message_id not in bridged:
+                    unbridged.setdefault(message_id, []).append(route)
+        return unbridged
+
+
+    def catch_up(self, source, until):
+        """
+        Forward messages sent in bridged channels after message recorded when session was lost and before `until` snowflake.
+        Already bridged messages are skipped. Recorded message is moved forward as messages are caught up,
+        and channel is removed once it is caught up.
+        Return False if some channel could not be fetched, so catch up should be retried.
+        """
+        success = True
+        for source_channel, after in list(source.catch_up_from.items()):
+            logger.info(f"({source.display_name}) Catching up on channel {source_channel} after message {after}")
+            forwarded = 0
+            try:
+                for page in source.discord.iter_messages(source_channel, after=after, num=100):
+                    done = int(page[-1].id) >= until
+                    missed = [message for message in page if int(message.id) < until]
+                    messages = [message for message in missed if message.user_id not in source.own_ids]
+                    unbridged = self.get_unbridged(source, source_channel, [message.id for message in messages])
+                    for message in messages:
+                        if message.id in unbridged and self.create(source, message, routes=unbridged[message.id]):
+                            forwarded += 1
+                    if missed:
+                        # live messages move last_source past missed ones, so retry continues from here
+                        source.catch_up_from[source_channel] = missed[-1].id
+                    if done or not self.run:
+                        break
+            except ConnectionError as e:
+                logger.warn(f"({source.display_name}) Catching up on channel {source_channel} stopped after forwarding {forwarded} messages: {e}, will retry in {CATCH_UP_RETRY_INTERVAL}s")
+                success = False
+                continue
+            if not self.run:
+                return False
+            del source.catch_up_from[source_channel]
+            logger.info(f"({source.display_name}) Caught up on channel {source_channel}, forwarded {forwarded} messages")
+        return success
+
+
+    def mirror(self, channel_id, limit, platform_name=None):
+        """
+        Forward history of bridged channel, going back from oldest bridged message, oldest message first.
+        Progress is stored in checkpoint file, so interrupted mirror continues where it stopped,
+        and completed mirror continues further back in history when run again.
+        """
+        sources = [side for side in self.platforms.values() if channel_id in side.routes and platform_name in (None, side.name)]
+        if not sources:
+            sys.exit(f"Channel {channel_id} is not bridged")
+        if len(sources) > 1:
+            sys.exit(f"Channel {channel_id} is bridged on multiple platforms, select one with --platform")
+        source = sources[0]
+        for side in self.platforms.values():
+            my_id = side.discord.get_my_id()
+            if not my_id:
+                sys.exit("Failed to get bot users")
+            side.set_bots(my_id)
+        first_pair = source.routes[channel_id][0].channel_pair
+
+        # load checkpoint
+        checkpoint_path = os.path.join(self.data_dir, f"mirror_{first_pair}.json")
+        if os.path.exists(checkpoint_path):
+            with open(checkpoint_path, "r") as f:
+                checkpoint = json.load(f)
+        else:
+            checkpoint = {
+                "before": source.database.get_first_source(first_pair) or discord.generate_nonce(),
+                "last": None,
+            }
+        before = checkpoint["before"]
+        last = int(checkpoint["last"] or 0)
+
+        # fetch history newest first, then send oldest first
+        print(f"Fetching up to {limit} messages before {before}")
+        history = []
+        try:
+            for page in source.discord.iter_messages(channel_id, before=before, num=100):
+                history.extend(page)
+                if len(history) >= limit:
                     break
+        except ConnectionError as e:
+            sys.exit(f"{e}, run mirror again to retry")
+        history = history[:limit]
+        history.reverse()
+        if not history:
+            print("Nothing to mirror")
+            return
+        oldest = history[0].id
+        unbridged = self.get_unbridged(source, channel_id, [message.id for message in history])
+        history = [message for message in history if int(message.id) > last and message.id in unbridged and message.user_id not in source.own_ids]
+
+        # send and store pairs in batches
+        print(f"Mirroring {len(history)} messages")
+        pairs = {}   # channel_pair: [(source, target, hash, bot, uploads)]
+        batched = set()   # source messages with pairs in current batch
+        start_time = time.time()
+        for num, message in enumerate(history):
+            if not self.run:
+                break
+            reference = message.referenced_message
+            if reference and reference.id in batched:
+                # replied message is in current batch, its pairs are stored first so reply can be resolved
+                for channel_pair, batch in pairs.items():
+                    source.database.add_pairs(channel_pair, batch)
+                pairs = {}
+                batched = set()
+            for channel_pair, target_message, content_hash, bot_id, uploads in self.create(source, message, routes=unbridged[message.id], add_pair=False):
+                pairs.setdefault(channel_pair, []).append((message.id, target_message, content_hash, bot_id, uploads))
+                batched.add(message.id)
+            if (num + 1) % MIRROR_BATCH == 0 or num == len(history) - 1:
+                for channel_pair, batch in pairs.items():
+                    source.database.add_pairs(channel_pair, batch)
+                pairs = {}
+                batched = set()
+                checkpoint["last"] = message.id
+                with open(checkpoint_path, "w") as f:
+                    json.dump(checkpoint, f)
+                rate = (num + 1) / (time.time() - start_time)
+                print(f"Mirrored {num + 1}/{len(history)} messages, {rate:.2f} msg/s")
+                logger.info(f"Mirror {source.display_name} {channel_id}: {num + 1}/{len(history)} messages, {rate:.2f} msg/s")
+        else:
+            # next run continues before oldest fetched message
+            with open(checkpoint_path, "w") as f:
+                json.dump({"before": oldest, "last": None}, f)
+            print("Mirror completed")
+
+
+    def flush_updates(self, source):
+        """Forward pending message updates whose coalescing window has passed, only latest state is forwarded"""
+        now = time.time()
+        for message_id, (send_time, data, trace) in list(source.pending_updates.items()):
+            if send_time <= now:
+                del source.pending_updates[message_id]
+                self.update(source, data, trace)
+                self.timer.finish(trace)
+
+
+    def delete_messages(self, target, channel_id, messages):
+        """
+        Delete multiple messages from target channel, messages are (message_id, bot_id), in bulk delete chunks where possible.
+        Messages that are too old for bulk delete and messages from failed chunks are deleted one by one, by bot that sent them.
+        """
+        cutoff = discord.timestamp_to_snowflake((time.time() - BULK_DELETE_MAX_AGE) * 1000)
+        recent = [message for message in messages if int(message[0]) > cutoff]
+        single = [message for message in messages if int(message[0]) <= cutoff]
+        for num in range(0, len(recent), BULK_DELETE_SIZE):
+            chunk = recent[num:num+BULK_DELETE_SIZE]
+            if len(chunk) < 2 or not target.discord.send_bulk_delete(channel_id, [message_id for message_id, _ in chunk]):
+                single.extend(chunk)
+        for message_id, bot_id in single:
+            self.delete_target(target, channel_id, message_id, bot_id)
+
+
+    def count_reaction(self, source, data, change):
+        """Add reaction event to per-message counter, so bursts of reactions are forwarded at most once per interval"""
+        pending = source.pending_reactions.get(data.id)
+        if not pending:
+            pending = source.pending_reactions[data.id] = [time.time() + self.reaction_interval, data.channel_id, {}]
+        emoji = (data.emoji, data.emoji_id)
+        pending[2][emoji] = pending[2].get(emoji, 0) + change
+
+
+    def flush_reactions(self, source):
+        """Forward reaction changes whose interval has passed, reactions that were added and removed are skipped"""
+        now = time.time()
+        for message_id, (send_time, channel_id, counter) in list(source.pending_reactions.items()):
+            if send_time <= now:
+                del source.pending_reactions[message_id]
+                changes = [emoji for emoji, change in counter.items() if change]
+                if changes:
+                    self.reaction(source, channel_id, message_id, changes)
+
+
+    def remember_reactions(self, source, message):
+        """Store reactions of fetched message, so they are kept when message is edited"""
+        if len(source.reactions) > REACTIONS_MEMO_SIZE:
+            source.reactions.clear()
+        source.reactions[message.id] = message.reactions
+
+
+    def sync_reactions(self, target, channel_id, message_id, reactions, changes):
+        """Add or remove bot reactions on original message, so they match reactions of other users on its bridged copy"""
+        counts = {(reaction["emoji"], reaction["emoji_id"]): reaction["count"] - bool(reaction["me"]) for reaction in reactions}
+        for emoji, emoji_id in changes:
+            if emoji_id:
+                continue   # custom emojis are not available on other platform
+            if counts.get((emoji, emoji_id), 0) > 0:
+                target.discord.send_reaction(channel_id, message_id, emoji)
+            else:
+                target.discord.remove_reaction(channel_id, message_id, emoji)
+
+
+    def resolve_reference(self, source, reference, route):
+        """Get id of message in route target channel that corresponds to message referenced in source channel"""
+        if reference.user_id in source.own_ids:
+            # referenced message is bridged copy, find its original, then original's copy in target channel
+            for origin_route in source.routes[route.source_channel]:
+                origin = origin_route.target
+                original_message = origin.database.get_source(origin_route.reverse_pair, reference.id)
+                if original_message:
+                    if origin_route is route:
+                        return original_message
+                    target_route = origin.get_route(origin_route.target_channel, route.target, route.target_channel)
+                    if target_route:
+                        return origin.database.get_target(target_route.channel_pair, original_message)
+                    return None
+            return None
+        return route.store.get_target(route.channel_pair, reference.id)
+
+
+    def create(self, source, data, routes=None, add_pair=True, trace=None):
+        """
+        Forward new message through all its routes, or only through specified routes, in parallel.
+        Return list of (channel_pair, target_message, content_hash, bot_id, uploads) for each sent message.
+        """
+        if routes is None:
+            with self.timer.stage("route", trace):
+                routes = source.routes[data.channel_id]
+        results = self.fan_out(self.forward_create, [(source, data, route, trace) for route in routes])
+        sent = []
+        for route, result in zip(routes, results):
+            if result:
+                sent.append((route.channel_pair, *result))
+        if sent and add_pair:
+            with self.timer.stage("persist", trace):
+                self.persist(source, data, sent)
+        return sent
+
+
+    def forward_create(self, source, data, route, trace=None):
+        """
+        Run new message through resolve, render and deliver stages for one route,
+        return target message id, content hash, bot id and indexes of re-uploaded attachments.
+        """
+        with self.timer.stage("resolve", trace):
+            reference_id, reply_ping = self.resolve(source, data, route)
+        with self.timer.stage("render", trace):
+            rendered = self.render(data, route, upload=True, trace=trace)
+        with self.timer.stage("deliver", trace, route.target.display_name):
+            target_message, bot_id = self.deliver(route, rendered, reference_id, reply_ping)
+        if not target_message:
+            return None
+        event_logger.debug("CREATE: %s %s-%s > %s %s=%s = [%s] - %s", source.display_name, route.source_channel, data.id, route.target.display_name, route.target_channel, target_message, rendered["author_name"], rendered["message_text"])
+        return target_message, rendered["content_hash"], bot_id, rendered["uploads"]
+
+
+    def resolve(self, source, data, route):
+        """Resolve stage: get id of replied message in route target channel, and whether reply should ping"""
+        reference = data.referenced_message
+        if not reference:
+            return None, True
+        for mention in reference.mentions:
+            if mention["id"] == source.my_id:
+                reply_ping = True
+                break
+        else:
+            reply_ping = False
+        return self.resolve_reference(source, reference, route), reply_ping
+
+
+    def render(self, data, route, upload=False, uploads=None, trace=None):
+        """
+        Render stage: build message for route target channel.
+        If uploader is enabled, avatar is re-hosted, and with upload attachments are re-uploaded to target.
+        Without upload, attachments at `uploads` indexes, that were re-uploaded when message was sent, are hidden,
+        so edit renders same as create.
+        """
+        target = route.target
+        author_name = get_author_name(data)
+        author_pfp = get_author_pfp(data, route.cdn)
+        uploaded = None
+        attached = False
+        if upload:
+            uploads = ""
+        if self.uploader:
+            if author_pfp:
+                author_pfp = self.uploader.get_rehosted(target.discord, author_pfp)
+            # uploaded attachments are marked in embeds, so each target needs its own copy
+            data = data.copy(embeds=[dict(embed) for embed in data.embeds])
+            source_attachments = [embed for embed in data.embeds if embed["name"] and not embed.get("hidden")]
+            if source_attachments:
+                if upload:
+                    uploaded = self.uploader.upload_all(target.discord, route.target_channel, source_attachments)
+                    uploads = ",".join(str(num) for num, attachment in enumerate(source_attachments) if attachment.get("hidden"))
+                else:
+                    self.uploader.resolve_all(target.discord, source_attachments, uploads)
+                attached = any(attachment.get("hidden") for attachment in source_attachments)
+        with self.timer.stage("format", trace):
+            message_text = formatter.build_message(
+                data,
+                self.message_config,
+                self.roles,
+                self.channels,
+            )
+        if not message_text and not attached:
+            message_text = "*Unknown message content*"
+        webhook = target.webhooks.get(route.target_channel)
+        if webhook and data.referenced_message:
+            webhook_text = formatter.build_reply_quote(data.referenced_message) + "\n" + message_text
+        else:
+            webhook_text = message_text
+        return {
+            "author_name": author_name,
+            "author_pfp": author_pfp,
+            "message_text": message_text,
+            "webhook": webhook,
+            "webhook_text": webhook_text[:MAX_CONTENT_LENGTH],
+            "uploaded": uploaded,
+            "uploads": uploads,
+            # attachments are resolved same way for create and edit, so unchanged edit has same hash
+            "content_hash": get_content_hash(author_name, data.avatar_id, message_text),
+        }
+
+
+    def deliver(self, route, rendered, reference_id=None, reply_ping=True):
+        """Deliver stage: send rendered message to route target channel, return target message id and id of bot or webhook that sent it"""
+        target = route.target
+        webhook = rendered["webhook"]
+        uploaded = rendered["uploaded"]
+        if webhook:
+            target_message = self.deliver_webhook(target, webhook, rendered)
+            if target_message is False:
+                # messages are sent through new webhook, or as bot if it cant be created
+                webhook = self.replace_webhook(target, route.target_channel, webhook)
+                target_message = self.deliver_webhook(target, webhook, rendered) if webhook else None
+        if webhook:
+            bot_id = webhook[0]   # webhook messages are authored by webhook user
+        else:
+            sender = target.get_sender(route.target_channel)
+            bot_id = sender.my_id
+            target_message = sender.send_message(
+                channel_id=route.target_channel,
+                message_content="",
+                reply_id=reference_id,
+                reply_channel_id=route.target_channel,
+                reply_guild_id=target.guild_id,
+                reply_ping=reply_ping,
+                attachments=uploaded,
+                embeds=build_embeds(rendered["author_name"], rendered["author_pfp"], rendered["message_text"]),
+                return_message=bool(uploaded),
+            )
+        if uploaded and target_message:
+            self.uploader.store_uploaded(target.discord.name, uploaded, target_message["attachments"])
+            target_message = target_message["id"]
+        return target_message or None, bot_id
+
+
+    def deliver_webhook(self, target, webhook, rendered):
+        """Send rendered message through webhook, return sent message, or False if webhook is deleted"""
+        uploaded = rendered["uploaded"]
+        return target.discord.execute_webhook(
+            webhook_id=webhook[0],
+            webhook_token=webhook[1],
+            message_content=rendered["webhook_text"],
+            username=get_webhook_username(rendered["author_name"]),
+            avatar_url=rendered["author_pfp"],
+            attachments=uploaded,
+            return_message=bool(uploaded),
+        )
 
-            # check gateway for errors
-            if self.gateway_a.error:
-                logger.fatal(f"Gateway error: \n {self.gateway_a.error}")
-                sys.exit(self.gateway_a.error + ERROR_TEXT)
 
-            time.sleep(0.1)   # some reasonable delay
-        self.run = False
+    def deliver_update(self, route, rendered, target_message, bot_id):
+        """Deliver stage for edits: edit target message through bot or webhook that sent it, return true if it is edited"""
+        target = route.target
+        webhook = rendered["webhook"]
+        if webhook and bot_id == webhook[0]:
+            return target.discord.edit_webhook_message(webhook[0], webhook[1], target_message, rendered["webhook_text"])
+        # sender is not stored for messages sent before this was added, so webhook is tried first when it is enabled, then bot
+        if webhook and not bot_id and target.discord.edit_webhook_message(webhook[0], webhook[1], target_message, rendered["webhook_text"]):
+            return True
+        return target.get_bot(bot_id).send_update_message(
+            channel_id=route.target_channel,
+            message_id=target_message,
+            message_content="",
+            embeds=build_embeds(rendered["author_name"], rendered["author_pfp"], rendered["message_text"]),
+        )
 
 
-    def loop_b(self):   # SPACEBAR -> DISCORD
-        """Loop B"""
+    def persist(self, source, data, sent):
+        """Persist stage: store pairs of source message and all its sent target messages"""
+        source_channel = data.channel_id
+        source_message = data.id
+        source.database.add_pair_targets(source_message, sent)
+        if int(source_message) > int(source.last_source.get(source_channel, 0)):
+            source.last_source[source_channel] = source_message
+
+
+    def update(self, source, data, trace=None):
+        """Forward message edit to all targets it was bridged to, in parallel"""
+        source_message = data.id
+        if not data.reactions and source_message in source.reactions:
+            data.reactions = source.reactions[source_message]
+        with self.timer.stage("route", trace):
+            jobs = []
+            for route in source.routes[data.channel_id]:
+                info = route.store.get_target_info(route.channel_pair, source_message)
+                if info:
+                    jobs.append((source, data, route, *info, trace))
+        if not jobs:
+            return
+        results = self.fan_out(self.forward_update, jobs)
+        with self.timer.stage("persist", trace):
+            for job, content_hash in zip(jobs, results):
+                if content_hash:
+                    job[2].store.set_hash(job[2].channel_pair, source_message, content_hash)
+
+
+    def forward_update(self, source, data, route, target_message, old_hash, bot_id, uploads, trace=None):
+        """Run message edit through render and deliver stages for one route, return hash of new rendered content if it is edited"""
+        with self.timer.stage("render", trace):
+            rendered = self.render(data, route, uploads=uploads, trace=trace)
+        # skip edits that dont change anything that is rendered
+        if rendered["content_hash"] == old_hash:
+            event_logger.debug("EDIT: %s %s-%s > %s %s=%s - rendered content not changed, skipping", source.display_name, route.source_channel, data.id, route.target.display_name, route.target_channel, target_message)
+            return None
+        with self.timer.stage("deliver", trace, route.target.display_name):
+            success = self.deliver_update(route, rendered, target_message, bot_id)
+        event_logger.debug("EDIT: %s %s-%s > %s %s=%s = [%s] - %s", source.display_name, route.source_channel, data.id, route.target.display_name, route.target_channel, target_message, rendered["author_name"], rendered["message_text"])
+        if success:
+            return rendered["content_hash"]
+        return None
+
+
+    def delete(self, source, data, trace=None):
+        """Forward message delete to all targets it was bridged to, in parallel"""
+        source_message = data.id
+        with self.timer.stage("route", trace):
+            jobs = []
+            routes = []
+            for route in source.routes[data.channel_id]:
+                info = route.store.get_target_info(route.channel_pair, source_message)
+                if info:
+                    jobs.append((route.target, route.target_channel, info[0], info[2]))
+                    routes.append(route)
+        if not jobs:
+            return
+        with self.timer.stage("deliver", trace):
+            self.fan_out(self.delete_target, jobs)
+        with self.timer.stage("persist", trace):
+            for route in routes:
+                route.store.delete_pair(route.channel_pair, source_message)
+        event_logger.debug("DELETE: %s %s-%s > %s targets", source.display_name, data.channel_id, source_message, len(jobs))
+
+
+    def delete_target(self, target, target_channel, target_message, bot_id=None):
+        """Delete one target message, through webhook or bot that sent it, bot also deletes messages that webhook failed to delete"""
+        webhook = target.webhooks.get(target_channel)
+        if not (webhook and bot_id in (webhook[0], None) and target.discord.delete_webhook_message(webhook[0], webhook[1], target_message)):
+            target.get_bot(bot_id).send_delete_message(target_channel, target_message)
+
+
+    def delete_bulk(self, source, data, trace=None):
+        """Forward bulk delete to all targets, in parallel"""
+        with self.timer.stage("route", trace):
+            jobs = []
+            pairs = []
+            for route in source.routes[data.channel_id]:
+                targets = route.store.get_targets(route.channel_pair, data.ids)
+                if targets:
+                    jobs.append((route.target, route.target_channel, list(targets.values())))
+                    pairs.append((route, list(targets)))
+        if not jobs:
+            return
+        with self.timer.stage("deliver", trace):
+            self.fan_out(self.delete_messages, jobs)
+        with self.timer.stage("persist", trace):
+            for route, sources in pairs:
+                route.store.delete_pairs(route.channel_pair, sources)
+        event_logger.debug("DELETE BULK: %s %s = %s messages > %s targets", source.display_name, data.channel_id, len(data.ids), len(jobs))
+
+
+    def reaction(self, source, channel_id, message_id, changes):
+        """Forward reaction changes, as reactions summary on bridged messages, or as bot reactions on original message"""
+        message = source.discord.get_message(channel_id, message_id)
+        if not message:
+            return
+        self.remember_reactions(source, message)
+        routes = source.routes[channel_id]
+        for route in routes:
+            if route.store.get_target(route.channel_pair, message_id):
+                self.update(source, message)   # skipped if rendered summary is not changed
+                return
+        for route in routes:
+            origin = route.target
+            original_message = origin.database.get_source(route.reverse_pair, message_id)
+            if original_message:
+                self.sync_reactions(origin, route.target_channel, original_message, message.reactions, changes)
+                event_logger.debug("REACTION: %s %s-%s > %s %s=%s - %s", source.display_name, channel_id, message_id, origin.display_name, route.target_channel, original_message, changes)
+                return
+
+
+    def ingest(self, source):
+        """Ingest stage: yield queued gateway events from bridged channels, that are not sent by bridge"""
+        while self.run:
+            start = time.perf_counter()
+            event = source.gateway.get_messages()
+            if not event:
+                return
+            data = event.data
+            if data.channel_id in source.routes and data.user_id not in source.own_ids:
+                self.timer.add("ingest", time.perf_counter() - start)
+                yield event
+
+
+    def dispatch(self, source, event):
+        """Run ingested event through pipeline for its type"""
+        op = event.op
+        data = event.data
+        trace = event.trace
+
+        if op == "MESSAGE_CREATE":
+            if event.replayed:
+                # events replayed from stored session are forwarded only where they are not bridged yet
+                unbridged = self.get_unbridged(source, data.channel_id, [data.id])
+                if unbridged:
+                    self.create(source, data, routes=unbridged[data.id], trace=trace)
+            elif self.create(source, data, trace=trace):
+                latency = time.time() - discord.snowflake_to_timestamp(data.id) / 1000
+                metrics.observe("bridge_forward_latency_seconds", latency, platform=source.name)
+            self.timer.finish(trace)
+
+        elif op == "MESSAGE_UPDATE":
+            # coalesce bursts of updates for same message, trace of latest one is kept
+            pending = source.pending_updates.get(data.id)
+            if pending:
+                pending[1] = data
+                pending[2] = trace
+            else:
+                source.pending_updates[data.id] = [time.time() + self.edit_debounce, data, trace]
+
+        elif op == "MESSAGE_DELETE":
+            source.pending_updates.pop(data.id, None)
+            source.pending_reactions.pop(data.id, None)
+            self.delete(source, data, trace)
+            self.timer.finish(trace)
+
+        elif op == "MESSAGE_DELETE_BULK":
+            for message_id in data.ids:
+                source.pending_updates.pop(message_id, None)
+                source.pending_reactions.pop(message_id, None)
+            self.delete_bulk(source, data, trace)
+            self.timer.finish(trace)
+
+        elif op == "MESSAGE_REACTION_ADD":
+            if self.reactions_enabled:
+                self.count_reaction(source, data, 1)
+
+        elif op == "MESSAGE_REACTION_REMOVE":
+            if self.reactions_enabled:
+                self.count_reaction(source, data, -1)
+
+
+    def loop(self, source):
+        """Forward events from one platform"""
         while self.run:
 
+            # forward messages missed while gateway session was lost
+            restarted = source.gateway.get_session_restarted()
+            if restarted:
+                until = discord.timestamp_to_snowflake(restarted)
+                source.catch_up_until = max(until, source.catch_up_until or 0)
+                source.next_catch_up = 0
+                for source_channel in source.routes:
+                    after = source.last_source.get(source_channel)
+                    if after:
+                        # channel that is still catching up continues from where it stopped
+                        source.catch_up_from.setdefault(source_channel, after)
+            if source.catch_up_from and time.time() >= source.next_catch_up:
+                if self.catch_up(source, source.catch_up_until):
+                    source.catch_up_until = None
+                else:
+                    source.next_catch_up = time.time() + CATCH_UP_RETRY_INTERVAL
+
             # get messages
-            while self.run:
-                new_message = self.gateway_b.get_messages()
-                if new_message:
-                    data = new_message["d"]
-                    if data["channel_id"] in self.channels_b and data.get("user_id") != self.my_id_b:
-                        op = new_message["op"]
-
-                        if op == "MESSAGE_CREATE":
-                            # build message
-                            source_channel = data["channel_id"]
-                            target_channel = self.bridges_b[source_channel]
-                            source_message = data["id"]
-                            author_name = get_author_name(data)
-                            author_pfp = get_author_pfp(data, self.cdn_b)
-                            if data["referenced_message"]:
-                                source_reference_id = data["referenced_message"]["id"]
-                                if data["referenced_message"]["user_id"] == self.my_id_b:
-                                    channel_pair = f"pair_{target_channel}_{source_channel}"
-                                    target_reference_id = self.database_a.get_source(channel_pair, source_reference_id)
-                                else:
-                                    channel_pair = f"pair_{source_channel}_{target_channel}"
-                                    target_reference_id = target_message = self.database_b.get_target(channel_pair, source_reference_id)
-                                for mention in data["referenced_message"]["mentions"]:
-                                    if mention["id"] == self.my_id_b:
-                                        reply_ping = True
-                                        break
-                                else:
-                                    reply_ping = False
-                            else:
-                                target_reference_id = None
-                                reply_ping = True
-                            # build message
-                            message_text = formatter.build_message(
-                                data,
-                                self.message_config,
-                                self.roles,
-                                self.channels,
-                            )
-                            if not message_text:
-                                message_text = "*Unknown message content*"
-                            embeds = [{
-                                "type": "rich",
-                                "author": {
-                                    "name": author_name,
-                                },
-                                "description": message_text,
-                            }]
-                            if author_pfp:
-                                embeds[0]["author"]["icon_url"] = author_pfp
-                            # send message
-                            target_message = self.discord_a.send_message(
-                                channel_id=target_channel,
-                                message_content="",
-                                reply_id=target_reference_id,
-                                reply_channel_id=target_channel,
-                                reply_guild_id=self.guild_id_a,
-                                reply_ping=reply_ping,
-                                embeds=embeds,
-                            )
-                            # add to db
-                            if target_message:
-                                logger.debug(f"CREATE (B): {source_channel}-{source_message} > {target_channel}={target_message} = [{author_name}] - {message_text}")
-                                channel_pair = f"pair_{source_channel}_{target_channel}"
-                                if channel_pair in self.bridges_b_txt:
-                                    self.database_b.add_pair(channel_pair, source_message, target_message)
-                                else:
-                                    logger.warn(f"Channel pair (B): {channel_pair} not initialized")
-
-                        elif op == "MESSAGE_UPDATE":
-                            source_channel = data["channel_id"]
-                            target_channel = self.bridges_b[source_channel]
-                            channel_pair = f"pair_{source_channel}_{target_channel}"
-                            if channel_pair in self.bridges_b_txt:
-                                source_message = data["id"]
-                                target_message = self.database_b.get_target(channel_pair, source_message)
-                                if target_message:
-                                    author_name = get_author_name(data)
-                                    author_pfp = get_author_pfp(data, self.cdn_b)
-                                    message_text = formatter.build_message(
-                                        data,
-                                        self.message_config,
-                                        self.roles,
-                                        self.channels,
-                                    )
-                                    if not message_text:
-                                        message_text = "*Unknown message content*"
-                                    embeds = [{
-                                        "type": "rich",
-                                        "author": {
-                                            "name": author_name,
-                                        },
-                                        "description": message_text,
-                                    }]
-                                    if author_pfp:
-                                        embeds[0]["author"]["icon_url"] = author_pfp
-                                    self.discord_a.send_update_message(
-                                        channel_id=target_channel,
-                                        message_id=target_message,
-                                        message_content="",
-                                        embeds=embeds,
-                                    )
-                                    logger.debug(f"EDIT (B): = {source_channel}-{source_message} > {target_channel}={target_message} = [{author_name}] - {message_text}")
-                            else:
-                                logger.warn(f"Channel pair (B): {channel_pair} not initialized")
-
-                        elif op == "MESSAGE_DELETE":
-                            source_channel = data["channel_id"]
-                            target_channel = self.bridges_b[source_channel]
-                            channel_pair = f"pair_{source_channel}_{target_channel}"
-                            if channel_pair in self.bridges_b_txt:
-                                source_message = data["id"]
-                                target_message = self.database_b.get_target(channel_pair, source_message)
-                                if target_message:
-                                    self.discord_a.send_delete_message(target_channel, target_message)
-                                    logger.debug(f"DELETE (B): = {source_channel} > {target_channel} = ({source_message})")
-                                    self.database_b.delete_pair(channel_pair, source_message)
-                            else:
-                                logger.warn(f"Channel pair (B): {channel_pair} not initialized")
-
-                        elif op == "MESSAGE_REACTION_ADD":
-                            pass
-
-                        elif op == "MESSAGE_REACTION_REMOVE":
-                            pass
+            for event in self.ingest(source):
+                self.dispatch(source, event)
 
-                else:
-                    break
+            # send coalesced updates and reactions
+            self.flush_updates(source)
+            self.flush_reactions(source)
 
             # check gateway for errors
-            if self.gateway_a.error:
-                logger.fatal(f"Gateway error: \n {self.gateway_b.error}")
-                sys.exit(self.gateway_b.error + ERROR_TEXT)
+            if source.gateway.error:
+                logger.fatal(f"Gateway error ({source.display_name}): \n {source.gateway.error}")
+                sys.exit(source.gateway.error + ERROR_TEXT)
+
+            # log stage timings
+            if time.time() >= self.next_timing_report:
+                self.next_timing_report = time.time() + TIMING_REPORT_INTERVAL
+                report = self.timer.report()
+                if report:
+                    logger.debug(f"Stage timings: {report}")
 
             time.sleep(0.1)   # some reasonable delay
         self.run = False
 
 
 
+def parse_args():
+    """Parse command line arguments"""
+    parser = argparse.ArgumentParser(description="Discord-Spacebar bridge bot")
+    subparsers = parser.add_subparsers(dest="command")
+    mirror_parser = subparsers.add_parser("mirror", help="mirror history of bridged channel to its target channels")
+    mirror_parser.add_argument("channel_id", help="source channel ID, from any platform in the bridge")
+    mirror_parser.add_argument("-l", "--limit", type=int, default=1000, help="max number of messages to mirror, default: 1000")
+    mirror_parser.add_argument("-p", "--platform", help="platform name of source channel, needed only if channel ID is bridged on multiple platforms")
+    return parser.parse_args()
+
+
 def sigint_handler(_signum, _frame):
     """Handling Ctrl-C event"""
     sys.exit(0)
@@ -447,4 +929,9 @@ def sigint_handler(_signum, _frame):
 
 if __name__ == "__main__":
     signal.signal(signal.SIGINT, sigint_handler)
+    args = parse_args()
     bridge = Bridge()
+    if args.command == "mirror":
+        bridge.mirror(args.channel_id, args.limit, args.platform)
+    else:
+        bridge.start()
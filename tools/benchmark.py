@@ -0,0 +1,157 @@
+import argparse
+import gc
+import json
+import statistics
+import sys
+import time
+import tracemalloc
+
+from bridge import formatter
+from bridge.message import (
+    prepare_components,
+    prepare_embeds,
+    prepare_message,
+    prepare_poll,
+    prepare_special_message_types,
+)
+from tools import corpus
+
+MIN_REPEAT_TIME = 0.02   # seconds, calls in one repeat are increased until it takes at least this long
+
+
+def build_message(message):
+    """Format prepared message with corpus roles and channels"""
+    return formatter.build_message(message, corpus.FORMAT_CONFIG, corpus.ROLES, corpus.CHANNELS)
+
+
+def prepare_build_message(payload):
+    """Prepare and format message, as it is done for each forwarded message"""
+    return build_message(prepare_message(payload))
+
+
+def get_cases():
+    """Get benchmark cases as name: (function, function returning fresh arguments)"""
+    cases = {}
+    for name in corpus.PAYLOADS:
+        cases[f"prepare_message/{name}"] = (prepare_message, lambda name=name: (corpus.get_payload(name), ))
+    for name in corpus.PAYLOADS:
+        cases[f"build_message/{name}"] = (build_message, lambda name=name: (prepare_message(corpus.get_payload(name)), ))
+    for name in corpus.PAYLOADS:
+        cases[f"prepare_build_message/{name}"] = (prepare_build_message, lambda name=name: (corpus.get_payload(name), ))
+    embeds = corpus.get_payload("embeds")
+    cases["prepare_embeds/embeds"] = (prepare_embeds, lambda: (embeds["embeds"], embeds["content"]))
+    components = corpus.get_payload("components")
+    cases["prepare_components/components"] = (prepare_components, lambda: (components["components"], ))
+    cases["prepare_special_message_types/automod"] = (prepare_special_message_types, lambda: (corpus.get_payload("automod"), ))
+    poll = corpus.get_payload("poll")
+    cases["prepare_poll/poll"] = (prepare_poll, lambda: (poll["poll"], ))
+    return cases
+
+
+def time_case(function, setup, number):
+    """Time number of calls, each with fresh arguments, return CPU seconds per call, so time when process is not running is excluded"""
+    arguments = [setup() for _ in range(number)]
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        start = time.process_time()
+        for args in arguments:
+            function(*args)
+        duration = time.process_time() - start
+    finally:
+        if gc_enabled:
+            gc.enable()
+    return duration / number
+
+
+def measure_time(function, setup, repeat):
+    """Calibrate number of calls per repeat, then return min and median seconds per call over repeats"""
+    number = 1
+    while time_case(function, setup, number) * number < MIN_REPEAT_TIME:
+        number *= 2
+    results = [time_case(function, setup, number) for _ in range(repeat)]
+    return min(results), statistics.median(results)
+
+
+def measure_memory(function, setup):
+    """Return peak bytes allocated during one call, and number of memory blocks still held by its result"""
+    args = setup()
+    function(*args)   # warm up caches, like compiled regex
+    args = setup()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot()
+        start = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        result = function(*args)
+        peak = tracemalloc.get_traced_memory()[1] - start
+        after = tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+    del result
+    blocks = sum(stat.count_diff for stat in after.compare_to(before, "filename"))
+    return peak, blocks
+
+
+def run(cases, repeat):
+    """Run all cases, return name: results"""
+    results = {}
+    for name, (function, setup) in cases.items():
+        best, median = measure_time(function, setup, repeat)
+        peak, blocks = measure_memory(function, setup)
+        results[name] = {"min": best, "median": median, "peak": peak, "blocks": blocks}
+        print(f"{name:40} {best * 1e6:10.2f} {median * 1e6:10.2f} {peak / 1024:10.1f} {blocks:8}", flush=True)
+    return results
+
+
+def compare(results, baseline, threshold):
+    """Print changes against baseline, return names of cases that regressed more than threshold"""
+    regressed = []
+    print(f"\n{"case":40} {"min us":>10} {"change":>8} {"peak KiB":>10} {"change":>8} {"blocks":>8} {"change":>8}")
+    for name, result in results.items():
+        old = baseline.get(name)
+        if not old:
+            print(f"{name:40} {"not in baseline":>10}")
+            continue
+        time_change = result["min"] / old["min"] - 1
+        peak_change = result["peak"] / old["peak"] - 1 if old["peak"] else 0
+        blocks_change = result["blocks"] - old["blocks"]
+        mark = ""
+        if time_change > threshold or peak_change > threshold or blocks_change > old["blocks"] * threshold:
+            regressed.append(name)
+            mark = "  REGRESSED"
+        print(f"{name:40} {result["min"] * 1e6:10.2f} {time_change:+8.1%} {result["peak"] / 1024:10.1f} {peak_change:+8.1%} {result["blocks"]:8} {blocks_change:+8}{mark}")
+    return regressed
+
+
+def main():
+    """Run micro-benchmarks of message preparing and formatting on payload corpus"""
+    parser = argparse.ArgumentParser(description="Benchmark message preparing and formatting on corpus of realistic payloads")
+    parser.add_argument("-k", "--filter", help="run only cases whose name contains this text")
+    parser.add_argument("-r", "--repeat", type=int, default=10, help="timed repeats of each case, default: 10")
+    parser.add_argument("--save", metavar="PATH", help="save results as baseline json")
+    parser.add_argument("--compare", metavar="PATH", help="compare results with saved baseline, exit with 1 on regression")
+    parser.add_argument("--threshold", type=float, default=0.2, help="relative increase of time, peak memory or held blocks that counts as regression, default: 0.2")
+    args = parser.parse_args()
+
+    cases = {name: case for name, case in get_cases().items() if not args.filter or args.filter in name}
+    print(f"Python {sys.version.split()[0]}, {len(cases)} cases, {args.repeat} repeats")
+    print(f"{"case":40} {"min us":>10} {"median us":>10} {"peak KiB":>10} {"blocks":>8}")
+    results = run(cases, args.repeat)
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Saved baseline to {args.save}")
+    if args.compare:
+        with open(args.compare, "r") as f:
+            baseline = json.load(f)
+        regressed = compare(results, baseline, args.threshold)
+        if regressed:
+            print(f"{len(regressed)} cases regressed: {", ".join(regressed)}")
+            sys.exit(1)
+        print("No regressions")
+
+
+if __name__ == "__main__":
+    main()
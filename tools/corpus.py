@@ -0,0 +1,174 @@
+import json
+
+GUILD_ID = "10"
+CHANNEL_ID = "100"
+USERS = [{"id": str(200000000000000000 + num), "username": f"user{num}", "global_name": f"User {num}", "avatar": "a" * 32} for num in range(40)]
+ROLES = [{"id": str(300000000000000000 + num), "name": f"role{num}"} for num in range(30)]
+CHANNELS = [{"id": str(400000000000000000 + num), "name": f"channel-{num}"} for num in range(50)]
+FORMAT_CONFIG = {
+    "format_interaction": "╭──⤙ %username used [%command]",
+    "format_one_reaction": "%reaction %count",
+    "reactions_separator": "; ",
+}
+
+
+def build_raw(num, content="", **fields):
+    """Build raw message as received from gateway"""
+    message = {
+        "id": str(1300000000000000000 + num),
+        "channel_id": CHANNEL_ID,
+        "guild_id": GUILD_ID,
+        "type": 0,
+        "author": USERS[num % len(USERS)],
+        "member": {"nick": None, "roles": []},
+        "content": content,
+        "timestamp": "2026-10-19T10:00:00.000000+00:00",
+        "edited_timestamp": None,
+        "mentions": [],
+        "mention_roles": [],
+        "mention_everyone": False,
+        "embeds": [],
+        "attachments": [],
+    }
+    message.update(fields)
+    return message
+
+
+def build_plain():
+    """Short text message, most common case"""
+    return build_raw(1, "hey, did anyone try the new build? it crashes for me on startup :(")
+
+
+def build_mentions():
+    """Long message mentioning many users, roles, channels and custom emoji"""
+    parts = []
+    for num in range(30):
+        parts.append(f"<@{USERS[num]["id"]}> check <#{CHANNELS[num]["id"]}> with <@&{ROLES[num]["id"]}> <:pog{num}:{500000000000000000 + num}>")
+    parts.append("https://discord.com/channels/10/100/1300000000000000000")
+    return build_raw(
+        2,
+        " ".join(parts),
+        mentions=[{**user, "member": {"nick": f"nick{num}"}} for num, user in enumerate(USERS[:30])],
+        mention_roles=[role["id"] for role in ROLES[:30]],
+    )
+
+
+def build_embeds():
+    """Bot message with several large rich embeds and attachments"""
+    embeds = []
+    for num in range(10):
+        embeds.append({
+            "type": "rich",
+            "url": f"https://example.com/articles/{num}",
+            "title": f"Release notes {num}",
+            "description": "Lorem ipsum dolor sit amet, consectetur adipiscing elit. " * 30,
+            "fields": [{"name": f"Field {field}", "value": "value " * 20, "inline": False} for field in range(25)],
+            "image": {"url": f"https://cdn.example.com/image{num}.png", "width": 800, "height": 600},
+            "footer": {"text": "footer text"},
+        })
+    attachments = [
+        {"id": str(600000000000000000 + num), "filename": f"file{num}.png", "size": 12345, "url": f"https://cdn.discordapp.com/attachments/100/1/file{num}.png", "content_type": "image/png"}
+        for num in range(10)
+    ]
+    return build_raw(3, "changelog", embeds=embeds, attachments=attachments)
+
+
+def build_components():
+    """Bot message with nested containers, buttons, selects, media and content inventory entry"""
+    buttons = [{"type": 2, "style": 1, "label": f"Option {num}", "custom_id": f"button_{num}"} for num in range(5)]
+    select = {
+        "type": 3,
+        "custom_id": "select",
+        "placeholder": "Pick one",
+        "options": [{"label": f"Choice {num}", "value": str(num), "default": num == 3} for num in range(25)],
+    }
+    section = {
+        "type": 9,
+        "components": [
+            {"type": 10, "content": "## Server status"},
+            {"type": 10, "content": "All systems operational " * 5},
+            {"type": 12, "items": [{"media": {"url": f"https://cdn.example.com/gallery{num}.png", "content_type": "image/png"}, "description": f"Image {num}"} for num in range(5)]},
+        ],
+    }
+    entry = {
+        "type": 16,
+        "content_inventory_entry": {
+            "content_type": 1,
+            "extra": {"game_name": "Some Game", "platform": 0, "media_title": "Episode", "media_subtitle": "S01E01", "url": "https://example.com"},
+            "started_at": "2026-10-19T09:00:00.000000+00:00",
+            "ended_at": "2026-10-19T10:00:00.000000+00:00",
+        },
+    }
+    components = [
+        {"type": 17, "components": [section, {"type": 14}, {"type": 1, "components": buttons}, {"type": 1, "components": [select]}]},
+        {"type": 17, "components": [section, {"type": 13, "file": {"url": "https://cdn.example.com/log.txt", "type": "text"}}]},
+        entry,
+        {"type": 1, "components": [{"type": 2, "style": 5, "url": "https://example.com/docs"}]},
+    ]
+    return build_raw(4, "", components=components, interaction={"user": USERS[5], "name": "status"})
+
+
+def build_poll():
+    """Poll with many answers and results"""
+    answers = [{"answer_id": num, "poll_media": {"text": f"Answer number {num}"}} for num in range(1, 11)]
+    return build_raw(5, "", poll={
+        "question": {"text": "Which release should we ship next?"},
+        "answers": answers,
+        "expiry": "2026-10-26T10:00:00.000000+00:00",
+        "allow_multiselect": True,
+        "results": {"is_finalized": False, "answer_counts": [{"id": num, "count": num * 3, "me_voted": num == 2} for num in range(1, 11)]},
+    })
+
+
+def build_forward():
+    """Forwarded message with embed and attachment"""
+    forwarded = build_embeds()
+    return build_raw(6, "", message_snapshots=[{"message": {
+        "content": "look at this " * 10,
+        "embeds": forwarded["embeds"][:2],
+        "attachments": forwarded["attachments"][:2],
+    }}], message_reference={"type": 1, "message_id": forwarded["id"], "channel_id": CHANNEL_ID})
+
+
+def build_reply():
+    """Reply to message with mentions, with reactions and sticker"""
+    referenced = build_mentions()
+    referenced["embeds"] = build_embeds()["embeds"][:1]
+    return build_raw(
+        7,
+        "agreed, " * 20,
+        referenced_message=referenced,
+        message_reference={"message_id": referenced["id"], "channel_id": CHANNEL_ID},
+        mentions=[{**referenced["author"], "member": {"nick": "replied"}}],
+        reactions=[{"emoji": {"name": f"emoji{num}", "id": None}, "count": num + 1, "me": num == 0} for num in range(8)],
+        sticker_items=[{"name": "wave", "id": "700000000000000000", "format_type": 1}],
+    )
+
+
+def build_automod():
+    """Automod alert, special message type that rewrites content from embed fields"""
+    fields = [
+        {"name": "rule_name", "value": "No spam"},
+        {"name": "channel_id", "value": CHANNEL_ID},
+        {"name": "quarantine_user", "value": "username"},
+        {"name": "quarantine_user_action", "value": "block_guild_communication"},
+    ]
+    return build_raw(8, "spam " * 40, type=24, embeds=[{"type": "auto_moderation_message", "description": "spam " * 40, "fields": fields}])
+
+
+BUILDERS = {
+    "plain": build_plain,
+    "mentions": build_mentions,
+    "embeds": build_embeds,
+    "components": build_components,
+    "poll": build_poll,
+    "forward": build_forward,
+    "reply": build_reply,
+    "automod": build_automod,
+}
+PAYLOADS = {name: json.dumps(builder()) for name, builder in BUILDERS.items()}   # name: json, as received from gateway
+
+
+def get_payload(name):
+    """Get fresh raw payload, because preparing message changes it"""
+    return json.loads(PAYLOADS[name])
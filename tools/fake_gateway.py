@@ -0,0 +1,272 @@
+import base64
+import hashlib
+import json
+import socket
+import socketserver
+import struct
+import threading
+import time
+import uuid
+from collections import deque
+
+WEBSOCKET_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+HEARTBEAT_INTERVAL = 41250
+BOT_USER_ID = "1"
+RESUME_BUFFER_SIZE = 1000   # dispatches kept per session for resuming
+RESUME_TIMEOUT = 60   # seconds after disconnect session still receives dispatches
+
+
+def read_exact(rfile, size):
+    """Read exactly size bytes, raise ConnectionError if connection is closed"""
+    data = rfile.read(size)
+    if len(data) < size:
+        raise ConnectionError("Connection closed")
+    return data
+
+
+def build_frame(opcode, payload):
+    """Build unmasked websocket frame, as sent by server"""
+    length = len(payload)
+    if length < 126:
+        header = struct.pack("!BB", 0x80 | opcode, length)
+    elif length < 65536:
+        header = struct.pack("!BBH", 0x80 | opcode, 126, length)
+    else:
+        header = struct.pack("!BBQ", 0x80 | opcode, 127, length)
+    return header + payload
+
+
+def read_frame(rfile):
+    """Read one masked websocket frame sent by client, return opcode and payload"""
+    first, second = read_exact(rfile, 2)
+    opcode = first & 0x0F
+    length = second & 0x7F
+    if length == 126:
+        length = struct.unpack("!H", read_exact(rfile, 2))[0]
+    elif length == 127:
+        length = struct.unpack("!Q", read_exact(rfile, 8))[0]
+    mask = read_exact(rfile, 4) if second & 0x80 else b"\x00\x00\x00\x00"
+    payload = bytearray(read_exact(rfile, length))
+    for num in range(length):
+        payload[num] ^= mask[num % 4]
+    return opcode, bytes(payload)
+
+
+class GatewayHandler(socketserver.StreamRequestHandler):
+    """Handles one gateway websocket connection, state is stored in FakeGateway object"""
+
+    def handshake(self):
+        """Read websocket upgrade request and accept it, return false if it is not valid"""
+        headers = {}
+        while True:
+            line = self.rfile.readline()
+            if not line or line in (b"\r\n", b"\n"):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        key = headers.get("sec-websocket-key")
+        if not key:
+            self.wfile.write(b"HTTP/1.1 400 Bad Request\r\nContent-Length: 0\r\n\r\n")
+            return False
+        accept = base64.b64encode(hashlib.sha1((key + WEBSOCKET_GUID).encode("ascii")).digest()).decode("ascii")
+        self.wfile.write((
+            "HTTP/1.1 101 Switching Protocols\r\n"
+            "Upgrade: websocket\r\n"
+            "Connection: Upgrade\r\n"
+            f"Sec-WebSocket-Accept: {accept}\r\n\r\n"
+        ).encode("ascii"))
+        return True
+
+
+    def send(self, data, opcode=1):
+        """Send text frame with json data, or other frame with raw payload"""
+        payload = json.dumps(data).encode("utf-8") if opcode == 1 else data
+        with self.lock:
+            self.wfile.write(build_frame(opcode, payload))
+
+
+    def identify(self):
+        """Start new session and send ready"""
+        fake = self.server.fake
+        self.session = fake.new_session()
+        fake.attach(self.session, self, [])
+        fake.send_dispatch(self.session, "READY", {
+            "session_id": self.session["id"],
+            "resume_gateway_url": fake.url,
+            "user": {"id": fake.user_id, "username": "fake bot"},
+            "guilds": [],
+        })
+
+
+    def resume(self, session_id, sequence):
+        """Resume session, sending dispatches client missed, or invalidate session if they are not kept"""
+        fake = self.server.fake
+        session = fake.sessions.get(session_id)
+        if not session or (session["sent"] and session["sent"][0][0] > sequence + 1):
+            self.send({"op": 9, "d": False})
+            return
+        self.session = session
+        fake.attach(session, self, [payload for num, payload in list(session["sent"]) if num > sequence])
+        fake.send_dispatch(session, "RESUMED", None)
+
+
+    def handle(self):
+        """Run gateway protocol: hello, heartbeat acks, ready after identify and resuming"""
+        fake = self.server.fake
+        if not self.handshake():
+            return
+        self.lock = threading.Lock()
+        self.session = None
+        self.send({"op": 10, "d": {"heartbeat_interval": HEARTBEAT_INTERVAL}})
+        try:
+            while True:
+                opcode, payload = read_frame(self.rfile)
+                if opcode == 8:
+                    self.send(payload[:2], opcode=8)
+                    break
+                if opcode == 9:
+                    self.send(payload, opcode=10)
+                    continue
+                if opcode != 1:
+                    continue
+                request = json.loads(payload)
+                if request["op"] == 1:
+                    self.send({"op": 11})
+                elif request["op"] == 2:
+                    self.identify()
+                elif request["op"] == 6:
+                    self.resume(request["d"]["session_id"], request["d"]["seq"] or 0)
+        except (ConnectionError, OSError, ValueError):
+            pass
+        finally:
+            if self.session:
+                fake.detach(self.session, self)
+
+
+class FakeGateway:
+    """
+    Local stand-in for Discord/Spacebar gateway, over plain websocket without compression.
+    Identified clients receive events sent with dispatch(), sessions can be resumed.
+    Faults are injected with disconnect(), request_reconnect() and invalidate().
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, user_id=BOT_USER_ID):
+        self.user_id = user_id
+        self.sessions = {}   # session_id: session
+        self.lock = threading.Lock()
+        self.identified = threading.Event()
+        self.server = socketserver.ThreadingTCPServer((host, port), GatewayHandler)
+        self.server.daemon_threads = True
+        self.server.fake = self
+        self.url = f"ws://{host}:{self.server.server_address[1]}"
+
+
+    def new_session(self):
+        """Create new session"""
+        session = {
+            "id": uuid.uuid4().hex,
+            "sequence": 0,
+            "sent": deque(maxlen=RESUME_BUFFER_SIZE),   # (sequence, payload)
+            "client": None,
+            "detached": None,
+            "lock": threading.Lock(),
+        }
+        with self.lock:
+            self.sessions[session["id"]] = session
+        return session
+
+
+    def attach(self, session, client, missed):
+        """Attach connected client to session, after sending it missed dispatches"""
+        with session["lock"]:
+            with client.lock:
+                for payload in missed:
+                    client.wfile.write(build_frame(1, payload))
+            session["client"] = client
+            session["detached"] = None
+        self.identified.set()
+
+
+    def detach(self, session, client):
+        """Detach disconnected client from session, dispatches are kept for resuming"""
+        with session["lock"]:
+            if session["client"] is client:
+                session["client"] = None
+                session["detached"] = time.time()
+        with self.lock:
+            if not any(session["client"] for session in self.sessions.values()):
+                self.identified.clear()
+
+
+    def send_dispatch(self, session, event_type, data):
+        """Add dispatch event with next sequence number to session, and send it if client is attached"""
+        with session["lock"]:
+            session["sequence"] += 1
+            payload = json.dumps({"op": 0, "t": event_type, "s": session["sequence"], "d": data}).encode("utf-8")
+            session["sent"].append((session["sequence"], payload))
+            client = session["client"]
+            if client:
+                try:
+                    with client.lock:
+                        client.wfile.write(build_frame(1, payload))
+                except OSError:
+                    session["client"] = None
+                    session["detached"] = time.time()
+        return bool(client)
+
+
+    def dispatch(self, event_type, data):
+        """Send dispatch event to all sessions that are connected or can be resumed, return number of connected clients it is sent to"""
+        now = time.time()
+        with self.lock:
+            sessions = [
+                session for session in self.sessions.values()
+                if session["client"] or (session["detached"] and now - session["detached"] < RESUME_TIMEOUT)
+            ]
+        return sum(self.send_dispatch(session, event_type, data) for session in sessions)
+
+
+    def disconnect(self):
+        """Drop connections of all clients without closing handshake, they should resume"""
+        with self.lock:
+            clients = [session["client"] for session in self.sessions.values() if session["client"]]
+        for client in clients:
+            try:
+                client.connection.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+
+    def request_reconnect(self):
+        """Send reconnect opcode to all clients, they should resume"""
+        with self.lock:
+            clients = [session["client"] for session in self.sessions.values() if session["client"]]
+        for client in clients:
+            try:
+                client.send({"op": 7, "d": None})
+            except OSError:
+                pass
+
+
+    def invalidate(self):
+        """Invalidate sessions of all clients, they should identify again"""
+        with self.lock:
+            clients = [session["client"] for session in self.sessions.values() if session["client"]]
+            self.sessions.clear()
+        for client in clients:
+            try:
+                client.send({"op": 9, "d": False})
+            except OSError:
+                pass
+
+
+    def start(self):
+        """Start serving in a thread"""
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+
+    def stop(self):
+        """Stop serving"""
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,507 @@
+import argparse
+import json
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from bridge.discord import get_route
+from tools.fake_gateway import FakeGateway
+
+CHUNK_SIZE = 65536
+PATTERN = bytes(range(251)) * (CHUNK_SIZE // 251 + 2)
+match_cdn_file = re.compile(r"^/attachments/\d+/\d+/[^/?]+$")
+match_attachments = re.compile(r"^/api/v9/channels/(\d+)/attachments$")
+match_upload = re.compile(r"^/upload/([^?]+)$")
+match_messages = re.compile(r"^/api/v9/channels/(\d+)/messages$")
+match_message = re.compile(r"^/api/v9/channels/(\d+)/messages/(\d+)$")
+match_bulk_delete = re.compile(r"^/api/v9/channels/(\d+)/messages/bulk-delete$")
+match_reaction = re.compile(r"^/api/v9/channels/\d+/messages/\d+/reactions/")
+match_webhooks = re.compile(r"^/api/v9/channels/(\d+)/webhooks$")
+match_webhook = re.compile(r"^/api/v9/webhooks/(\d+)/([^/?]+)$")
+match_webhook_message = re.compile(r"^/api/v9/webhooks/(\d+)/([^/?]+)/messages/(\d+)$")
+
+
+def generate_chunk(offset, size):
+    """Generate deterministic file content, so downloaded and uploaded files can be compared, size is up to CHUNK_SIZE"""
+    start = offset % 251
+    return PATTERN[start:start+size]
+
+
+def get_timestamp():
+    """Get current time as ISO timestamp, as in message objects"""
+    return time.strftime("%Y-%m-%dT%H:%M:%S.000000+00:00", time.gmtime())
+
+
+class QuietHTTPServer(ThreadingHTTPServer):
+    """Threading HTTP server that ignores clients closing connection"""
+
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        """Print errors other than closed connection"""
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+class FakeHandler(BaseHTTPRequestHandler):
+    """Request handler for fake server, state is stored in FakeServer object"""
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):   # noqa: A002
+        """Disable request logging"""
+
+
+    def send_json(self, status, data):
+        """Send json response"""
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in self.rate_limit_headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+    def send_empty(self, status):
+        """Send response without body"""
+        self.send_response(status)
+        self.send_header("Content-Length", "0")
+        for name, value in self.rate_limit_headers:
+            self.send_header(name, value)
+        self.end_headers()
+
+
+    def read_json(self):
+        """Read json request body"""
+        length = int(self.headers.get("Content-Length", 0))
+        if not length:
+            return None
+        return json.loads(self.rfile.read(length))
+
+
+    def inject_faults(self):
+        """
+        Delay API request by configured latency, and respond to it with injected error or 429 if route is rate limited.
+        Return true if request is already responded.
+        """
+        fake = self.server.fake
+        self.rate_limit_headers = []
+        if not self.path.startswith("/api/"):
+            return False
+        if fake.latency:
+            time.sleep(max(0, random.gauss(fake.latency, fake.jitter)))
+        if fake.error_rate and random.random() < fake.error_rate:
+            self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            fake.count("errors_injected")
+            self.send_json(500, {"message": "500: Internal Server Error", "code": 0})
+            return True
+        allowed, self.rate_limit_headers = fake.take_rate_limit(get_route(self.command, self.path))
+        if allowed:
+            return False
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        fake.count("rate_limited")
+        retry_after = float(dict(self.rate_limit_headers)["X-RateLimit-Reset-After"])
+        self.send_json(429, {"message": "You are being rate limited.", "retry_after": retry_after, "global": False})
+        return True
+
+
+    def do_GET(self):   # noqa: N802
+        """Serve files from fake CDN, file size is taken from `size` query parameter, gateway url, messages and webhooks"""
+        if self.inject_faults():
+            return
+        path, _, query = self.path.partition("?")
+        params = dict(x.split("=", 1) for x in query.split("&") if "=" in x)
+        fake = self.server.fake
+        if path in ("/api/v9/gateway", "/api/v9/gateway/bot") and fake.gateway_url:
+            self.send_json(200, {"url": fake.gateway_url, "shards": 1, "session_start_limit": {"max_concurrency": 1}})
+            return
+        if path == "/api/v9/users/@me":
+            self.send_json(200, {"id": fake.user_id, "username": "fake bot"})
+            return
+        match = match_messages.match(path)
+        if match:
+            self.send_json(200, fake.get_messages(match.group(1), int(params.get("limit", 50)), params.get("before"), params.get("after")))
+            return
+        match = match_message.match(path)
+        if match:
+            message = fake.messages.get(match.group(1), {}).get(match.group(2))
+            if message:
+                self.send_json(200, message)
+            else:
+                self.send_json(404, {"message": "Unknown Message", "code": 10008})
+            return
+        match = match_webhooks.match(path)
+        if match:
+            self.send_json(200, [webhook for webhook in fake.webhooks.values() if webhook["channel_id"] == match.group(1)])
+            return
+        if match_cdn_file.match(path):
+            size = int(params.get("size", fake.default_file_size))
+            self.send_response(200)
+            self.send_header("Content-Type", "application/octet-stream")
+            self.send_header("Content-Length", str(size))
+            self.end_headers()
+            for offset in range(0, size, CHUNK_SIZE):
+                self.wfile.write(generate_chunk(offset, min(CHUNK_SIZE, size - offset)))
+            fake.count("cdn_downloads")
+            return
+        self.send_empty(404)
+
+
+    def do_POST(self):   # noqa: N802
+        """Hand out upload urls for attachments, send and bulk delete messages, create and execute webhooks"""
+        if self.inject_faults():
+            return
+        fake = self.server.fake
+        path = self.path.split("?")[0]
+        match = match_attachments.match(path)
+        if match:
+            data = self.read_json()
+            attachments = []
+            for file in data["files"]:
+                if file["file_size"] > fake.max_upload_size:
+                    self.send_json(413, {"message": "Request entity too large", "code": 40005})
+                    return
+                upload_filename = f"{uuid.uuid4().hex}/{file["filename"]}"
+                attachments.append({
+                    "id": file["id"],
+                    "upload_url": f"{fake.url}/upload/{upload_filename}",
+                    "upload_filename": upload_filename,
+                })
+            self.send_json(200, {"attachments": attachments})
+            return
+        match = match_messages.match(path)
+        if match:
+            message = fake.create_message(match.group(1), self.read_json(), {"id": fake.user_id, "username": "fake bot"})
+            fake.count("messages_sent")
+            self.send_json(200, message)
+            return
+        match = match_bulk_delete.match(path)
+        if match:
+            for message_id in self.read_json()["messages"]:
+                fake.delete_message(match.group(1), message_id)
+            fake.count("bulk_deletes")
+            self.send_empty(204)
+            return
+        match = match_webhooks.match(path)
+        if match:
+            self.send_json(200, fake.create_webhook(match.group(1), self.read_json()["name"]))
+            return
+        match = match_webhook.match(path)
+        webhook = match and fake.webhooks.get(match.group(1))
+        if webhook:
+            data = self.read_json()
+            author = {"id": webhook["id"], "username": data.get("username") or webhook["name"], "bot": True}
+            message = fake.create_message(webhook["channel_id"], data, author, webhook_id=webhook["id"])
+            fake.count("messages_sent")
+            self.send_json(200, message)
+            return
+        self.send_empty(404)
+
+
+    def do_PATCH(self):   # noqa: N802
+        """Edit messages sent by bot or webhook"""
+        if self.inject_faults():
+            return
+        fake = self.server.fake
+        path = self.path.split("?")[0]
+        match = match_message.match(path)
+        if match:
+            channel_id, message_id = match.groups()
+        else:
+            match = match_webhook_message.match(path)
+            if not match or match.group(1) not in fake.webhooks:
+                self.send_empty(404)
+                return
+            channel_id, message_id = fake.webhooks[match.group(1)]["channel_id"], match.group(3)
+        message = fake.edit_message(channel_id, message_id, self.read_json())
+        if message:
+            fake.count("messages_edited")
+            self.send_json(200, message)
+        else:
+            self.send_json(404, {"message": "Unknown Message", "code": 10008})
+
+
+    def do_DELETE(self):   # noqa: N802
+        """Delete messages sent by bot or webhook, and accept reaction removals"""
+        if self.inject_faults():
+            return
+        fake = self.server.fake
+        path = self.path.split("?")[0]
+        if match_reaction.match(path):
+            fake.count("reactions_removed")
+            self.send_empty(204)
+            return
+        match = match_message.match(path)
+        if match:
+            channel_id, message_id = match.groups()
+        else:
+            match = match_webhook_message.match(path)
+            if not match or match.group(1) not in fake.webhooks:
+                self.send_empty(404)
+                return
+            channel_id, message_id = fake.webhooks[match.group(1)]["channel_id"], match.group(3)
+        if fake.delete_message(channel_id, message_id):
+            fake.count("messages_deleted")
+            self.send_empty(204)
+        else:
+            self.send_json(404, {"message": "Unknown Message", "code": 10008})
+
+
+    def do_PUT(self):   # noqa: N802
+        """Receive uploaded file in chunks and store only its size and checksum, and accept reactions"""
+        if self.inject_faults():
+            return
+        fake = self.server.fake
+        if match_reaction.match(self.path):
+            fake.count("reactions_added")
+            self.send_empty(204)
+            return
+        match = match_upload.match(self.path)
+        if match:
+            length = int(self.headers.get("Content-Length", 0))
+            received = 0
+            valid = True
+            while received < length:
+                chunk = self.rfile.read(min(CHUNK_SIZE, length - received))
+                if not chunk:
+                    break
+                valid = valid and chunk == generate_chunk(received, len(chunk))
+                received += len(chunk)
+            with fake.lock:
+                fake.uploads[match.group(1)] = {"size": received, "valid": valid}
+            self.send_empty(200)
+            return
+        self.send_empty(404)
+
+
+class FakeServer:
+    """
+    Local stand-in for Discord/Spacebar REST API and CDN: messages, reactions, webhooks, attachment uploads and gateway url.
+    Run it in a thread with start(), and point bridge hosts and attachment urls to its url.
+    With gateway_url, it is returned to bridge as gateway to connect to, with gateway, own fake gateway is started,
+    and messages created, edited and deleted through API are dispatched to it.
+    API requests can be delayed by latency with gaussian jitter, fail with error_rate, and be limited to
+    rate_limit requests per route in each rate_limit_window seconds, with X-RateLimit headers and 429 responses.
+    """
+
+    def __init__(
+        self,
+        host="127.0.0.1",
+        port=0,
+        max_upload_size=25*1024*1024,
+        default_file_size=1024,
+        gateway_url=None,
+        user_id="1",
+        gateway=False,
+        latency=0,
+        jitter=0,
+        error_rate=0,
+        rate_limit=None,
+        rate_limit_window=1,
+    ):
+        self.gateway = FakeGateway(host, user_id=user_id) if gateway else None
+        self.gateway_url = self.gateway.url if self.gateway else gateway_url
+        self.user_id = user_id
+        self.max_upload_size = max_upload_size
+        self.default_file_size = default_file_size
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self.rate_limit_window = rate_limit_window
+        self.buckets = {}   # route: [remaining requests, time when they reset]
+        self.uploads = {}
+        self.messages = {}   # channel_id: {message_id: message}
+        self.webhooks = {}   # webhook_id: webhook
+        self.on_message = None   # called with each message created through API
+        self.counters = {}
+        self.last_id = 0
+        self.lock = threading.Lock()
+        self.httpd = QuietHTTPServer((host, port), FakeHandler)
+        self.httpd.fake = self
+        self.url = f"http://{host}:{self.httpd.server_address[1]}"
+
+
+    def generate_id(self):
+        """Generate unique snowflake"""
+        with self.lock:
+            self.last_id = max(self.last_id + 1, (int(time.time() * 1000) - 1420070400000) << 22)
+            return str(self.last_id)
+
+
+    def count(self, name):
+        """Increment named counter"""
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + 1
+
+
+    def take_rate_limit(self, route):
+        """Take one request from route bucket, return whether it is allowed and rate limit headers"""
+        if not self.rate_limit:
+            return True, []
+        now = time.time()
+        with self.lock:
+            bucket = self.buckets.get(route)
+            if not bucket or bucket[1] <= now:
+                bucket = self.buckets[route] = [self.rate_limit, now + self.rate_limit_window]
+            allowed = bucket[0] > 0
+            if allowed:
+                bucket[0] -= 1
+            headers = [
+                ("X-RateLimit-Limit", str(self.rate_limit)),
+                ("X-RateLimit-Remaining", str(bucket[0])),
+                ("X-RateLimit-Reset-After", f"{bucket[1] - now:.3f}"),
+                ("X-RateLimit-Bucket", route),
+            ]
+        return allowed, headers
+
+
+    def dispatch(self, event_type, data):
+        """Send event to own fake gateway, if it is started"""
+        if self.gateway:
+            self.gateway.dispatch(event_type, data)
+
+
+    def create_message(self, channel_id, data, author, webhook_id=None):
+        """Store message sent with request data, dispatch MESSAGE_CREATE and return message"""
+        message_id = self.generate_id()
+        attachments = []
+        for attachment in data.get("attachments", []):
+            upload = self.uploads.get(attachment["uploaded_filename"], {"size": 0})
+            attachments.append({
+                "id": self.generate_id(),
+                "filename": attachment["filename"],
+                "size": upload["size"],
+                "url": f"{self.url}/attachments/{channel_id}/{message_id}/{attachment["filename"]}?size={upload["size"]}",
+            })
+        message = {
+            "id": message_id,
+            "channel_id": channel_id,
+            "type": 0,
+            "author": author,
+            "content": data.get("content", ""),
+            "timestamp": get_timestamp(),
+            "edited_timestamp": None,
+            "mentions": [],
+            "mention_roles": [],
+            "mention_everyone": False,
+            "embeds": data.get("embeds", []),
+            "attachments": attachments,
+            "reactions": [],
+        }
+        if webhook_id:
+            message["webhook_id"] = webhook_id
+        reference = data.get("message_reference")
+        if reference:
+            message["message_reference"] = reference
+            message["referenced_message"] = self.messages.get(channel_id, {}).get(reference.get("message_id"))
+        with self.lock:
+            self.messages.setdefault(channel_id, {})[message_id] = message
+        if self.on_message:
+            self.on_message(message)
+        self.dispatch("MESSAGE_CREATE", message)
+        return message
+
+
+    def add_message(self, message):
+        """Store raw message sent by other user and dispatch MESSAGE_CREATE, so it is also in channel history"""
+        with self.lock:
+            self.messages.setdefault(message["channel_id"], {})[message["id"]] = message
+        self.dispatch("MESSAGE_CREATE", message)
+
+
+    def edit_message(self, channel_id, message_id, data):
+        """Edit stored message, dispatch MESSAGE_UPDATE and return message, or None if it does not exist"""
+        message = self.messages.get(channel_id, {}).get(message_id)
+        if not message:
+            return None
+        for key in ("content", "embeds"):
+            if key in data:
+                message[key] = data[key]
+        message["edited_timestamp"] = get_timestamp()
+        self.dispatch("MESSAGE_UPDATE", message)
+        return message
+
+
+    def delete_message(self, channel_id, message_id):
+        """Delete stored message and dispatch MESSAGE_DELETE, return whether it existed"""
+        with self.lock:
+            message = self.messages.get(channel_id, {}).pop(message_id, None)
+        if message:
+            self.dispatch("MESSAGE_DELETE", {"id": message_id, "channel_id": channel_id, "guild_id": message.get("guild_id")})
+        return bool(message)
+
+
+    def get_messages(self, channel_id, limit, before=None, after=None):
+        """Get stored messages in channel, newest first, as in API"""
+        with self.lock:
+            messages = sorted(self.messages.get(channel_id, {}).values(), key=lambda message: int(message["id"]), reverse=True)
+        if before:
+            messages = [message for message in messages if int(message["id"]) < int(before)]
+        if after:
+            messages = [message for message in messages if int(message["id"]) > int(after)][-limit:]
+        return messages[:limit]
+
+
+    def create_webhook(self, channel_id, name):
+        """Create webhook in channel and return it"""
+        webhook = {"id": self.generate_id(), "token": uuid.uuid4().hex, "name": name, "channel_id": channel_id}
+        with self.lock:
+            self.webhooks[webhook["id"]] = webhook
+        return webhook
+
+
+    def file_url(self, filename, size):
+        """Get fake CDN url for file with specified size"""
+        return f"{self.url}/attachments/1/1/{filename}?size={size}"
+
+
+    def start(self):
+        """Start serving in a thread"""
+        if self.gateway:
+            self.gateway.start()
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self
+
+
+    def stop(self):
+        """Stop serving"""
+        if self.gateway:
+            self.gateway.stop()
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fake Discord/Spacebar server for local testing")
+    parser.add_argument("-p", "--port", type=int, default=8080, help="port to listen on, default: 8080")
+    parser.add_argument("-g", "--gateway", action="store_true", help="also start fake gateway, messages sent through API are dispatched to it")
+    parser.add_argument("--latency", type=float, default=0, help="seconds each API request is delayed")
+    parser.add_argument("--jitter", type=float, default=0, help="standard deviation of latency in seconds")
+    parser.add_argument("--error-rate", type=float, default=0, help="fraction of API requests that fail with 500")
+    parser.add_argument("--rate-limit", type=int, help="API requests allowed per route in each rate limit window")
+    parser.add_argument("--rate-limit-window", type=float, default=1, help="rate limit window in seconds, default: 1")
+    args = parser.parse_args()
+    server = FakeServer(
+        port=args.port,
+        gateway=args.gateway,
+        latency=args.latency,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        rate_limit=args.rate_limit,
+        rate_limit_window=args.rate_limit_window,
+    )
+    print(f"Fake server running on {server.url}")
+    if server.gateway:
+        server.gateway.start()
+        print(f"Fake gateway running on {server.gateway_url}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
@@ -0,0 +1,137 @@
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from tools.fake_server import FakeServer
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+GUILD_IDS = {"discord": "10", "spacebar": "20"}
+CHANNEL_IDS = {"discord": "100", "spacebar": "200"}
+AUTHOR = {"id": "555", "username": "load", "avatar": None}
+match_token = re.compile(r"load-(\d+)")
+
+
+def get_config(servers, data_dir):
+    """Get bridge config from config.json, with both platforms pointing to fake servers and one bridged channel pair"""
+    with open(os.path.join(ROOT_DIR, "config.json"), "r") as f:
+        config = json.load(f)
+    for name, server in servers.items():
+        config[name].update({"host": server.url, "cdn_host": server.url.split("://")[1], "token": name, "compressed": False})
+        config[f"{name}_guild_id"] = GUILD_IDS[name]
+    config["database"]["dir_path"] = data_dir
+    config["database"]["postgresql_host"] = None
+    config["metrics"]["enabled"] = False
+    config["bridges"] = [{"discord_channel_id": CHANNEL_IDS["discord"], "spacebar_channel_id": CHANNEL_IDS["spacebar"]}]
+    return config
+
+
+def build_message(num, channel_id, guild_id):
+    """Build raw MESSAGE_CREATE data of numbered load message"""
+    return {
+        "id": str(((int(time.time() * 1000) - 1420070400000) << 22) + num % 4096),
+        "channel_id": channel_id,
+        "guild_id": guild_id,
+        "type": 0,
+        "author": AUTHOR,
+        "content": f"load-{num}",
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S.000000+00:00", time.gmtime()),
+        "edited_timestamp": None,
+        "mentions": [],
+        "mention_roles": [],
+        "mention_everyone": False,
+        "embeds": [],
+        "attachments": [],
+    }
+
+
+def percentile(values, fraction):
+    """Get percentile of sorted values"""
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def main():
+    """Run bridge between two fake servers, send load messages to one side and measure when they arrive on the other"""
+    parser = argparse.ArgumentParser(description="Measure bridge throughput and latency against local fake servers")
+    parser.add_argument("-n", "--count", type=int, default=1000, help="number of messages to send, default: 1000")
+    parser.add_argument("-r", "--rate", type=float, default=100, help="messages sent per second, 0 for as fast as possible, default: 100")
+    parser.add_argument("-s", "--source", choices=("discord", "spacebar"), default="discord", help="platform messages are sent from, default: discord")
+    parser.add_argument("--latency", type=float, default=0, help="seconds each API request is delayed")
+    parser.add_argument("--jitter", type=float, default=0, help="standard deviation of latency in seconds")
+    parser.add_argument("--error-rate", type=float, default=0, help="fraction of API requests that fail with 500")
+    parser.add_argument("--rate-limit", type=int, help="API requests allowed per route in each second")
+    parser.add_argument("--timeout", type=float, default=30, help="seconds to wait for messages after last one is sent, default: 30")
+    args = parser.parse_args()
+
+    servers = {name: FakeServer(gateway=True).start() for name in GUILD_IDS}
+    target = "spacebar" if args.source == "discord" else "discord"
+    sent = {}   # num: send time
+    received = {}   # num: receive time
+    done = threading.Event()
+
+    def on_message(message):
+        match = match_token.search(message["content"] + json.dumps(message["embeds"]))
+        if match and message["channel_id"] == CHANNEL_IDS[target]:
+            received.setdefault(int(match.group(1)), time.perf_counter())
+            if len(received) >= args.count:
+                done.set()
+    servers[target].on_message = on_message
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        with open(os.path.join(work_dir, "config.json"), "w") as f:
+            json.dump(get_config(servers, os.path.join(work_dir, "db")), f, indent=2)
+        env = {**os.environ, "LOG_LEVEL": os.getenv("LOG_LEVEL", "WARNING")}
+        process = subprocess.Popen([sys.executable, os.path.join(ROOT_DIR, "main.py")], cwd=work_dir, env=env)
+        try:
+            print("Waiting for bridge to connect")
+            for server in servers.values():
+                if not server.gateway.identified.wait(30):
+                    sys.exit("Bridge did not connect to fake gateways")
+            time.sleep(1)   # let bridge finish processing ready events
+            # faults are injected only after startup, bridge exits if it cant get gateway url
+            for server in servers.values():
+                server.latency = args.latency
+                server.jitter = args.jitter
+                server.error_rate = args.error_rate
+                server.rate_limit = args.rate_limit
+
+            print(f"Sending {args.count} messages from {args.source} to {target}")
+            source = servers[args.source]
+            start = time.perf_counter()
+            for num in range(args.count):
+                if args.rate:
+                    wait = start + num / args.rate - time.perf_counter()
+                    if wait > 0:
+                        time.sleep(wait)
+                sent[num] = time.perf_counter()
+                source.add_message(build_message(num, CHANNEL_IDS[args.source], GUILD_IDS[args.source]))
+            sending = time.perf_counter() - start
+            done.wait(args.timeout)
+        finally:
+            process.terminate()
+            process.wait()
+            for server in servers.values():
+                server.stop()
+
+    print(f"Sent {len(sent)} messages in {sending:.2f}s, received {len(received)}, lost {len(sent) - len(received)}")
+    for name, server in servers.items():
+        print(f"{name}: {server.counters}")
+    if not received:
+        return
+    latencies = sorted(received[num] - sent[num] for num in received)
+    duration = max(received.values()) - start
+    print(f"Throughput: {len(received) / duration:.1f} messages/s")
+    print(
+        f"Latency: p50 {percentile(latencies, 0.5) * 1000:.1f}ms, "
+        f"p99 {percentile(latencies, 0.99) * 1000:.1f}ms, "
+        f"max {latencies[-1] * 1000:.1f}ms",
+    )
+
+
+if __name__ == "__main__":
+    main()
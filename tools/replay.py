@@ -0,0 +1,84 @@
+import argparse
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from bridge.recorder import read_frames
+from tools.fake_gateway import FakeGateway
+from tools.fake_server import FakeServer
+
+IDLE_CHECK_INTERVAL = 0.1
+
+
+def replay(gateway, path, fast=False):
+    """Send recorded frames to gateway clients, at recorded speed or as fast as possible, return number of sent frames"""
+    start = time.perf_counter()
+    sent = 0
+    for offset, frame in read_frames(path):
+        if not fast:
+            wait = start + offset - time.perf_counter()
+            if wait > 0:
+                time.sleep(wait)
+        event = json.loads(frame)
+        gateway.dispatch(event["t"], event["d"])
+        sent += 1
+    return sent
+
+
+def wait_idle(servers, idle_time):
+    """Wait until no server received request for idle_time seconds, return time of last request"""
+    last_counters = None
+    last_change = time.perf_counter()
+    while time.perf_counter() - last_change < idle_time:
+        counters = [dict(server.counters) for server in servers]
+        if counters != last_counters:
+            last_counters = counters
+            last_change = time.perf_counter()
+        time.sleep(IDLE_CHECK_INTERVAL)
+    return last_change
+
+
+def main():
+    """Serve fake gateway and REST server for each recording, and replay recordings when bridge connects"""
+    parser = argparse.ArgumentParser(description="Replay recorded gateway frames into bridge, with REST calls going to fake server")
+    parser.add_argument("recordings", nargs="+", help="recordings made with GATEWAY_RECORD_DIR, one per platform")
+    parser.add_argument("-p", "--port", type=int, default=8080, help="port of first fake REST server, next recordings use next ports, default: 8080")
+    parser.add_argument("--fast", action="store_true", help="replay as fast as possible, instead of at recorded speed")
+    parser.add_argument("--user-id", default="1", help="user id of fake bot, set to recorded bot id so its messages are not forwarded")
+    parser.add_argument("--idle", type=float, default=2, help="bridge is done when no request is received for this many seconds, default: 2")
+    args = parser.parse_args()
+
+    gateways = []
+    servers = []
+    for num, path in enumerate(args.recordings):
+        gateway = FakeGateway(user_id=args.user_id).start()
+        server = FakeServer(port=args.port + num, gateway_url=gateway.url, user_id=args.user_id).start()
+        gateways.append(gateway)
+        servers.append(server)
+        print(f"{path}: set platform host to {server.url} and compressed to false")
+
+    print("Waiting for bridge to connect")
+    for gateway in gateways:
+        gateway.identified.wait()
+    print("Replaying")
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=len(gateways)) as executor:
+        results = list(executor.map(replay, gateways, args.recordings, [args.fast] * len(gateways)))
+    replayed = time.perf_counter() - start
+    done = wait_idle(servers, args.idle) - start
+
+    frames = sum(results)
+    print(f"Replayed {frames} frames in {replayed:.2f}s, bridge done after {done:.2f}s")
+    for path, server in zip(args.recordings, servers):
+        print(f"{path}: {server.counters}")
+    sent = sum(server.counters.get("messages_sent", 0) for server in servers)
+    if done > 0:
+        print(f"Throughput: {frames / done:.1f} frames/s, {sent / done:.1f} messages sent/s")
+    for gateway, server in zip(gateways, servers):
+        gateway.stop()
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
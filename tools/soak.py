@@ -0,0 +1,187 @@
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+from collections import deque
+
+from tools import load
+from tools.fake_server import FakeServer
+
+FAULTS = ("disconnect", "request_reconnect", "invalidate")
+# name: metric summed over all its series
+SAMPLED = {
+    "rss_mb": "bridge_process_resident_memory_bytes",
+    "threads": "bridge_process_threads",
+    "objects": "bridge_process_objects",
+    "queue": "bridge_gateway_queue_depth",
+    "pending": "bridge_pending_events",
+}
+RECENT_SIZE = 100   # recently sent messages that are edited and deleted
+EDIT_EVERY = 5
+DELETE_EVERY = 7
+
+
+def get_free_port():
+    """Get port that is free on localhost"""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def parse_metrics(text):
+    """Sum values of sampled metrics from prometheus text format"""
+    values = dict.fromkeys(SAMPLED, 0.0)
+    names = {metric: name for name, metric in SAMPLED.items()}
+    for line in text.splitlines():
+        if line.startswith("#") or not line:
+            continue
+        series, _, value = line.rpartition(" ")
+        name = names.get(series.split("{")[0])
+        if name:
+            values[name] += float(value)
+    values["rss_mb"] /= 1024 * 1024
+    return values
+
+
+def middle(samples, name):
+    """Median of metric in samples, so one outlier sample doesnt decide the result"""
+    return statistics.median(sample[name] for sample in samples)
+
+
+def check(samples, warmup_samples, args):
+    """Compare samples after warmup with end of the run, return list of exceeded thresholds"""
+    start = samples[warmup_samples:warmup_samples + 3]
+    end = samples[-3:]
+    failures = []
+    rss_growth = middle(end, "rss_mb") - middle(start, "rss_mb")
+    if rss_growth > args.max_rss_growth:
+        failures.append(f"RSS grew by {rss_growth:.1f}MB, limit is {args.max_rss_growth}MB")
+    thread_growth = middle(end, "threads") - middle(start, "threads")
+    if thread_growth > args.max_thread_growth:
+        failures.append(f"Threads grew by {thread_growth:.0f}, limit is {args.max_thread_growth}")
+    object_growth = middle(end, "objects") / middle(start, "objects") - 1
+    if object_growth > args.max_object_growth:
+        failures.append(f"Objects grew by {object_growth:.1%}, limit is {args.max_object_growth:.0%}")
+    for name, limit in (("queue", args.max_queue), ("pending", args.max_pending)):
+        peak = max(sample[name] for sample in samples)
+        if peak > limit:
+            failures.append(f"{name.capitalize()} reached {peak:.0f}, limit is {limit}")
+    return failures
+
+
+def main():
+    """Drive synthetic traffic with forced reconnects through bridge for long time, and check for resource growth"""
+    parser = argparse.ArgumentParser(description="Soak test bridge against local fake servers and detect memory, thread and queue growth")
+    parser.add_argument("-d", "--duration", type=float, default=3600, help="test duration in seconds, default: 3600")
+    parser.add_argument("-r", "--rate", type=float, default=20, help="messages sent per second, alternating platforms, default: 20")
+    parser.add_argument("--sample-interval", type=float, default=30, help="seconds between samples, default: 30")
+    parser.add_argument("--warmup", type=float, default=0.1, help="fraction of duration before first compared sample, default: 0.1")
+    parser.add_argument("--fault-interval", type=float, default=300, help="seconds between forced reconnects, cycling disconnect, opcode 7 and opcode 9, 0 to disable, default: 300")
+    parser.add_argument("--max-rss-growth", type=float, default=50, help="allowed RSS growth in MB, default: 50")
+    parser.add_argument("--max-thread-growth", type=int, default=5, help="allowed growth of thread count, default: 5")
+    parser.add_argument("--max-object-growth", type=float, default=0.2, help="allowed relative growth of object count, default: 0.2")
+    parser.add_argument("--max-queue", type=int, default=1000, help="allowed gateway queue depth, default: 1000")
+    parser.add_argument("--max-pending", type=int, default=1000, help="allowed pending edits and reactions, default: 1000")
+    parser.add_argument("-o", "--output", help="write samples to this csv file")
+    args = parser.parse_args()
+
+    servers = {name: FakeServer(gateway=True).start() for name in load.GUILD_IDS}
+    names = list(servers)
+    received = set()
+    lock = threading.Lock()
+
+    def on_message(message):
+        match = load.match_token.search(message["content"] + json.dumps(message["embeds"]))
+        if match and message["author"]["id"] != load.AUTHOR["id"]:
+            with lock:
+                received.add(int(match.group(1)))
+    for server in servers.values():
+        server.on_message = on_message
+
+    metrics_port = get_free_port()
+    samples = []
+    faults = 0
+    sent = 0
+    with tempfile.TemporaryDirectory() as work_dir:
+        config = load.get_config(servers, os.path.join(work_dir, "db"))
+        config["metrics"].update({"enabled": True, "host": "127.0.0.1", "port": metrics_port})
+        with open(os.path.join(work_dir, "config.json"), "w") as f:
+            json.dump(config, f, indent=2)
+        env = {**os.environ, "LOG_LEVEL": os.getenv("LOG_LEVEL", "WARNING")}
+        process = subprocess.Popen([sys.executable, os.path.join(load.ROOT_DIR, "main.py")], cwd=work_dir, env=env)
+        try:
+            print("Waiting for bridge to connect")
+            for server in servers.values():
+                if not server.gateway.identified.wait(30):
+                    sys.exit("Bridge did not connect to fake gateways")
+            time.sleep(1)
+
+            print(f"Soaking for {args.duration:.0f}s at {args.rate} messages/s")
+            recent = deque(maxlen=RECENT_SIZE)   # (source name, message)
+            start = time.perf_counter()
+            next_sample = start
+            next_fault = start + args.fault_interval if args.fault_interval else float("inf")
+            while time.perf_counter() - start < args.duration:
+                if process.poll() is not None:
+                    sys.exit(f"Bridge exited with code {process.returncode}")
+                now = time.perf_counter()
+                if now >= next_sample:
+                    with urllib.request.urlopen(f"http://127.0.0.1:{metrics_port}/metrics", timeout=10) as response:
+                        sample = parse_metrics(response.read().decode("utf-8"))
+                    sample.update({"time": now - start, "sent": sent, "received": len(received)})
+                    samples.append(sample)
+                    print(", ".join(f"{name}={value:.0f}" for name, value in sample.items()), flush=True)
+                    next_sample += args.sample_interval
+                if now >= next_fault:
+                    fault = FAULTS[faults % len(FAULTS)]
+                    getattr(servers[names[faults % 2]].gateway, fault)()
+                    faults += 1
+                    next_fault += args.fault_interval
+
+                source = names[sent % 2]
+                message = load.build_message(sent, load.CHANNEL_IDS[source], load.GUILD_IDS[source])
+                servers[source].add_message(message)
+                recent.append((source, message))
+                if sent % EDIT_EVERY == 0 and len(recent) > 1:
+                    name, old = recent[len(recent) // 2]
+                    servers[name].edit_message(old["channel_id"], old["id"], {"content": f"{old["content"]} edited {sent}"})
+                if sent % DELETE_EVERY == 0 and len(recent) == RECENT_SIZE:
+                    name, old = recent.popleft()
+                    servers[name].delete_message(old["channel_id"], old["id"])
+                sent += 1
+                wait = start + sent / args.rate - time.perf_counter()
+                if wait > 0:
+                    time.sleep(wait)
+        finally:
+            process.terminate()
+            process.wait()
+            for server in servers.values():
+                server.stop()
+
+    if args.output and samples:
+        with open(args.output, "w") as f:
+            f.write(",".join(samples[0]) + "\n")
+            for sample in samples:
+                f.write(",".join(f"{value:.2f}" for value in sample.values()) + "\n")
+    print(f"Sent {sent} messages, {len(received)} forwarded, {faults} forced reconnects")
+    warmup_samples = int(len(samples) * args.warmup)
+    if len(samples) - warmup_samples < 6:
+        sys.exit("Not enough samples after warmup, increase duration or decrease sample interval")
+    failures = check(samples, warmup_samples, args)
+    for name in SAMPLED:
+        print(f"{name}: {middle(samples[warmup_samples:warmup_samples + 3], name):.1f} -> {middle(samples[-3:], name):.1f}")
+    if failures:
+        print("FAILED:\n  " + "\n  ".join(failures))
+        sys.exit(1)
+    print("PASSED")
+
+
+if __name__ == "__main__":
+    main()